@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cart, CartItem, Order, OrderItem
+from .models import Cart, CartItem, Order, OrderItem, StockReservation
 
 
 class CartItemInline(admin.TabularInline):
@@ -109,9 +109,21 @@ class OrderItemAdmin(admin.ModelAdmin):
     Configuración del panel de administración para OrderItem
     """
     list_display = ['order', 'product', 'quantity', 'price', 'get_item_price']
-    list_filter = ['order__status', 'order__created_at']
+    list_filter = ['order__status', 'created_at']
     search_fields = ['order__id', 'product__name']
 
     def get_item_price(self, obj):
         return f"${obj.get_item_price()}"
     get_item_price.short_description = 'Subtotal'
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """
+    Configuración del panel de administración para StockReservation
+    """
+    list_display = ['product', 'quantity', 'user', 'order', 'expires_at']
+    list_filter = ['expires_at']
+    search_fields = ['product__name', 'user__username', 'order__id']
+    list_select_related = ['product', 'user', 'order']
+    raw_id_fields = ['product', 'user', 'order']
@@ -0,0 +1,114 @@
+"""
+Operaciones por lotes sobre el carrito (POST /api/cart/batch/).
+
+El lote se aplica sobre las cantidades actuales en memoria y el stock
+disponible (descontando reservas de otros carritos) de todos los productos
+afectados se valida con una sola consulta. Si alguna
+operación es inválida no se aplica ninguna. La reserva condicional de
+hold_cart_items es la comprobación definitiva frente a carritos concurrentes.
+
+Con el CartStore el lote se escribe por producto (ver `store_changes`) y no
+se reserva: en ese modo la reserva se hace al crear la orden.
+"""
+from django.db import transaction
+
+from products.models import Product
+from .models import Cart
+from .reservations import InsufficientStock, hold_cart_items, with_available
+
+
+def apply_operations(quantities, operations, products):
+    """
+    Aplica `operations` (add / set / remove) sobre {product_id: cantidad}.
+    `products` es {product_id: Product} de los productos referenciados,
+    anotados con `available_stock` (ver load_products).
+    Devuelve (cantidades_finales, errores).
+    """
+    result = dict(quantities)
+    errors = []
+    touched = []
+    for index, operation in enumerate(operations):
+        product_id = operation['product_id']
+        if product_id not in products:
+            errors.append({'index': index, 'product_id': product_id, 'error': 'Producto no encontrado'})
+            continue
+        touched.append(product_id)
+
+        op = operation['op']
+        quantity = operation.get('quantity', 1)
+        if op == 'remove' or (op == 'set' and quantity == 0):
+            result.pop(product_id, None)
+        elif op == 'add':
+            result[product_id] = result.get(product_id, 0) + quantity
+        else:
+            result[product_id] = quantity
+
+    # El stock se valida sobre la cantidad final de cada producto
+    for product_id in dict.fromkeys(touched):
+        available = products[product_id].available_stock
+        if result.get(product_id, 0) > available:
+            errors.append({'product_id': product_id, 'error': f'Stock insuficiente. Disponible: {available}'})
+    return result, errors
+
+
+def load_products(operations, user_id=None):
+    """
+    Productos referenciados por el lote con su stock disponible, en una
+    sola consulta. Las reservas del carrito de `user_id` no se descuentan.
+    """
+    product_ids = {operation['product_id'] for operation in operations}
+    return with_available(Product.objects.only('id', 'stock'), exclude_user=user_id).in_bulk(product_ids)
+
+
+def _changed(before, after, operations):
+    return {
+        operation['product_id']: after.get(operation['product_id'], 0)
+        for operation in operations
+        if after.get(operation['product_id'], 0) != before.get(operation['product_id'], 0)
+    }
+
+
+def store_changes(operations, result):
+    """
+    Traduce el lote a escrituras por producto para el CartStore: los
+    productos con solo `add` se incrementan (los añadidos concurrentes se
+    conservan) y el resto se fija a su cantidad final en `result`.
+    Devuelve (cantidades, incrementos).
+    """
+    quantities, increments = {}, {}
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['op'] != 'add':
+            quantities[product_id] = result.get(product_id, 0)
+            increments.pop(product_id, None)
+        elif product_id not in quantities:
+            increments[product_id] = increments.get(product_id, 0) + operation.get('quantity', 1)
+    return quantities, increments
+
+
+def apply_cart_batch(user, operations, store=None):
+    """
+    Aplica el lote al carrito del usuario, en la base de datos (una
+    transacción) o en el CartStore si se indica. Devuelve la lista de
+    errores; vacía si el lote se aplicó.
+    """
+    try:
+        if store is not None:
+            quantities, _ = store.load(user.id)
+            result, errors = apply_operations(quantities, operations, load_products(operations, user.id))
+            if not errors and result != quantities:
+                store.apply(user.id, *store_changes(operations, result))
+            return errors
+
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(user=user)
+            # Serializa los lotes concurrentes del mismo usuario
+            Cart.objects.select_for_update().filter(pk=cart.pk).first()
+            quantities = dict(cart.items.values_list('product_id', 'quantity'))
+            result, errors = apply_operations(quantities, operations, load_products(operations, user.id))
+            if not errors and result != quantities:
+                cart.set_items(result)
+                hold_cart_items(user.id, _changed(quantities, result, operations))
+        return errors
+    except InsufficientStock as e:
+        return [{'product_id': e.product_id, 'error': str(e)}]
@@ -0,0 +1,413 @@
+"""
+Almacén de carritos en Redis con persistencia diferida (write-behind).
+
+Con CART_BACKEND='redis', CartView lee y escribe los carritos vivos en
+Redis (un hash producto -> cantidad por usuario) en lugar de Cart/CartItem.
+Los carritos modificados se anotan en el conjunto `cart:dirty` y se
+escriben en la base de datos con `write_back()`: al crear la orden y
+periódicamente con `manage.py flush_carts`. Con CART_BACKEND='db' (por
+defecto) este módulo no se usa.
+
+En este modo el `id` de cada item del carrito es el id del producto.
+
+Cada cambio es una operación atómica sobre el campo del producto (HINCRBY
+para sumar, HSET/HDEL para fijar o quitar, en un MULTI junto con la marca
+de modificado), nunca leer el hash, cambiarlo en Python y reescribirlo:
+dos peticiones concurrentes del mismo usuario no se pisan.
+
+Las reservas de stock se difieren al checkout: los cambios del carrito no
+llaman a hold_cart_items (que escribe y bloquea filas en la base de datos,
+justo lo que este modo evita). Al añadir se valida contra el stock
+disponible en ese momento, y el checkout hace la comprobación definitiva
+con el UPDATE condicional y reserva el stock para la orden. Las reservas
+de carrito hechas antes de activar este modo vencen solas.
+
+CART_REDIS_URL='locmem://' usa un sustituto en memoria del proceso con la
+misma interfaz (tests y desarrollo); 'fakeredis://' usa fakeredis si está
+instalado. Ninguno se usa si no se indica expresamente: sin CART_REDIS_URL
+ni REDIS_URL, CART_BACKEND='redis' es un error de configuración.
+"""
+import logging
+import threading
+from decimal import Decimal
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from products.models import Product
+from .models import Cart, CartItem
+from .reservations import InsufficientStock
+
+ITEMS_KEY = 'cart:{user_id}:items'
+META_KEY = 'cart:{user_id}:meta'
+DIRTY_KEY = 'cart:dirty'
+
+logger = logging.getLogger(__name__)
+
+
+class LocMemRedis:
+    """
+    Sustituto mínimo de redis.Redis(decode_responses=True) en memoria, con
+    las operaciones de hash y conjunto que usa CartStore. Las claves no
+    expiran.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        values = dict(mapping or {})
+        if key is not None:
+            values[key] = value
+        with self._lock:
+            current = self._data.setdefault(name, {})
+            added = sum(1 for field in values if str(field) not in current)
+            current.update({str(field): str(item) for field, item in values.items()})
+            return added
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            current = self._data.setdefault(name, {})
+            if str(key) in current:
+                return 0
+            current[str(key)] = str(value)
+            return 1
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            current = self._data.setdefault(name, {})
+            value = int(current.get(str(key), 0)) + amount
+            current[str(key)] = str(value)
+            return value
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            current = self._data.get(name, {})
+            removed = sum(1 for key in keys if current.pop(str(key), None) is not None)
+            if not current:
+                self._data.pop(name, None)
+            return removed
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def sadd(self, name, *values):
+        with self._lock:
+            current = self._data.setdefault(name, set())
+            added = {str(value) for value in values} - current
+            current.update(added)
+            return len(added)
+
+    def srem(self, name, *values):
+        with self._lock:
+            current = self._data.get(name, set())
+            removed = {str(value) for value in values} & current
+            current.difference_update(removed)
+            if not current:
+                self._data.pop(name, None)
+            return len(removed)
+
+    def spop(self, name, count=None):
+        with self._lock:
+            current = self._data.get(name, set())
+            popped = [current.pop() for _ in range(min(count or 1, len(current)))]
+            if not current:
+                self._data.pop(name, None)
+            return popped if count is not None else (popped[0] if popped else None)
+
+    def expire(self, name, seconds):
+        return name in self._data
+
+    def persist(self, name):
+        return name in self._data
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+
+    def pipeline(self):
+        return _LocMemPipeline(self)
+
+
+class _LocMemPipeline:
+    """
+    Pipeline de LocMemRedis: encola las llamadas y las ejecuta juntas.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._calls = []
+
+
+class CartStore:
+    """
+    Carritos de usuarios en Redis. Un carrito que no está en Redis se
+    carga desde la base de datos en el primer acceso.
+    """
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    @staticmethod
+    def _keys(user_id):
+        return ITEMS_KEY.format(user_id=user_id), META_KEY.format(user_id=user_id)
+
+    def load(self, user_id):
+        """
+        Devuelve ({product_id: cantidad}, meta) del carrito del usuario.
+        """
+        items_key, meta_key = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            pipe.hgetall(items_key)
+            pipe.hgetall(meta_key)
+            items, meta = pipe.execute()
+        if not meta:
+            return self._hydrate(user_id)
+        # Un incremento deshecho (ver `add`) puede dejar el campo en 0
+        return {
+            int(product_id): int(quantity)
+            for product_id, quantity in items.items()
+            if int(quantity) > 0
+        }, meta
+
+    def _hydrate(self, user_id):
+        cart, _ = Cart.objects.get_or_create(user_id=user_id)
+        items = dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+        meta = {
+            'id': str(cart.pk),
+            'created_at': cart.created_at.isoformat(),
+            'updated_at': cart.updated_at.isoformat(),
+        }
+        # HSETNX: si otra petición ya cargó el carrito y lo cambió, su
+        # versión se conserva
+        items_key, meta_key = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            for product_id, quantity in items.items():
+                pipe.hsetnx(items_key, product_id, quantity)
+            for field, value in meta.items():
+                pipe.hsetnx(meta_key, field, value)
+            pipe.expire(items_key, self.ttl)
+            pipe.expire(meta_key, self.ttl)
+            pipe.execute()
+        return items, meta
+
+    def _touch(self, pipe, user_id):
+        """
+        Marca el carrito como modificado. Los carritos pendientes de
+        escribir en la base de datos no expiran.
+        """
+        items_key, meta_key = self._keys(user_id)
+        pipe.hset(meta_key, 'updated_at', timezone.now().isoformat())
+        pipe.persist(items_key)
+        pipe.persist(meta_key)
+        pipe.sadd(DIRTY_KEY, user_id)
+
+    def get_cart(self, user_id):
+        """
+        Devuelve un Cart (no guardado) con sus items y totales ya cargados,
+        listo para CartSerializer. Cuesta las consultas de productos con
+        categoría y marca, independientemente del número de items.
+        """
+        items, meta = self.load(user_id)
+        products = Product.objects.with_catalog_details().in_bulk(list(items))
+        lines = [
+            CartItem(id=product_id, product=products[product_id], quantity=quantity)
+            for product_id, quantity in sorted(items.items())
+            if product_id in products
+        ]
+        cart = Cart(
+            id=int(meta['id']),
+            user_id=user_id,
+            created_at=meta['created_at'],
+            updated_at=meta['updated_at'],
+        )
+        # Mismo mecanismo que prefetch_related: cart.items.all() usa estas líneas
+        cart._prefetched_objects_cache = {'items': lines}
+        cart.total_price = sum((line.get_item_price() for line in lines), Decimal('0.00'))
+        cart.items_count = len(lines)
+        return cart
+
+    def set_quantity(self, user_id, product, quantity):
+        """
+        Fija la cantidad de un producto y devuelve el CartItem resultante.
+        """
+        self.load(user_id)
+        items_key, _ = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            pipe.hset(items_key, product.pk, quantity)
+            self._touch(pipe, user_id)
+            pipe.execute()
+        return CartItem(id=product.pk, product=product, quantity=quantity)
+
+    def add(self, user_id, product, quantity, available):
+        """
+        Suma `quantity` al producto con HINCRBY y devuelve el CartItem
+        resultante. Si la cantidad final supera `available` se deshace el
+        incremento propio (no los concurrentes) y se lanza InsufficientStock.
+        """
+        self.load(user_id)
+        items_key, _ = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            pipe.hincrby(items_key, product.pk, quantity)
+            self._touch(pipe, user_id)
+            new_quantity = pipe.execute()[0]
+        if new_quantity > available:
+            self.client.hincrby(items_key, product.pk, -quantity)
+            raise InsufficientStock(product.pk, available)
+        return CartItem(id=product.pk, product=product, quantity=new_quantity)
+
+    def apply(self, user_id, quantities=None, increments=None):
+        """
+        Aplica en un solo MULTI cantidades absolutas {product_id: cantidad}
+        (0 quita el producto) e incrementos {product_id: n}. Los productos
+        que no se nombran no se tocan.
+        """
+        self.load(user_id)
+        items_key, _ = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            for product_id, quantity in (quantities or {}).items():
+                if quantity > 0:
+                    pipe.hset(items_key, product_id, quantity)
+                else:
+                    pipe.hdel(items_key, product_id)
+            for product_id, amount in (increments or {}).items():
+                pipe.hincrby(items_key, product_id, amount)
+            self._touch(pipe, user_id)
+            pipe.execute()
+
+    def remove(self, user_id, product_id):
+        """
+        Quita un producto del carrito. Devuelve False si no estaba.
+        """
+        self.load(user_id)
+        items_key, _ = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            pipe.hdel(items_key, product_id)
+            self._touch(pipe, user_id)
+            removed = pipe.execute()[0]
+        return bool(removed)
+
+    def write_back(self, user_id):
+        """
+        Escribe el carrito del usuario en Cart/CartItem.
+        """
+        # Se desmarca antes de leer: un cambio posterior lo vuelve a marcar
+        self.client.srem(DIRTY_KEY, user_id)
+        items, meta = self.load(user_id)
+        try:
+            with transaction.atomic():
+                cart, _ = Cart.objects.get_or_create(user_id=user_id)
+                existing = set(Product.objects.filter(pk__in=list(items)).values_list('pk', flat=True))
+                cart.set_items({
+                    product_id: quantity
+                    for product_id, quantity in items.items()
+                    if product_id in existing
+                })
+        except Exception:
+            self.client.sadd(DIRTY_KEY, user_id)
+            raise
+
+        items_key, meta_key = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            pipe.expire(items_key, self.ttl)
+            pipe.expire(meta_key, self.ttl)
+            pipe.execute()
+
+    def flush(self, batch_size=100):
+        """
+        Escribe en la base de datos todos los carritos modificados.
+        Devuelve cuántos se escribieron.
+
+        Un carrito que falla no detiene el resto: se registra y vuelve a
+        `cart:dirty` al terminar, igual que los del lote tomado que no se
+        llegaron a procesar si el barrido se interrumpe.
+        """
+        written = 0
+        failed = []
+        pending = []
+        try:
+            while True:
+                pending = self.client.spop(DIRTY_KEY, batch_size)
+                if not pending:
+                    return written
+                while pending:
+                    user_id = pending[-1]
+                    try:
+                        self.write_back(int(user_id))
+                        written += 1
+                    except Exception:
+                        logger.exception(f"No se pudo escribir el carrito del usuario {user_id}")
+                        failed.append(user_id)
+                    pending.pop()
+        finally:
+            unwritten = failed + list(pending or [])
+            if unwritten:
+                self.client.sadd(DIRTY_KEY, *unwritten)
+
+    def forget(self, user_id):
+        """
+        Descarta la copia en Redis (p. ej. tras vaciar el carrito en la
+        base de datos al crear la orden).
+        """
+        items_key, meta_key = self._keys(user_id)
+        with self.client.pipeline() as pipe:
+            pipe.delete(items_key, meta_key)
+            pipe.srem(DIRTY_KEY, user_id)
+            pipe.execute()
+
+
+_stores = {}
+
+
+def _make_client(url):
+    if url.startswith('locmem://'):
+        return LocMemRedis()
+    if url.startswith('fakeredis://'):
+        import fakeredis
+        return fakeredis.FakeRedis(decode_responses=True)
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+def get_cart_store():
+    """
+    Devuelve el CartStore configurado, o None si CART_BACKEND es 'db'.
+    """
+    if settings.CART_BACKEND != 'redis':
+        return None
+    url = settings.CART_REDIS_URL
+    if not url:
+        raise ImproperlyConfigured('CART_BACKEND=redis requiere CART_REDIS_URL o REDIS_URL.')
+    store = _stores.get(url)
+    if store is None:
+        store = _stores[url] = CartStore(_make_client(url), settings.CART_STORE_TTL)
+    return store
@@ -0,0 +1,113 @@
+"""
+Creación de órdenes desde el carrito.
+
+Los productos del carrito se bloquean con SELECT ... FOR UPDATE en orden
+de id (dos checkouts concurrentes nunca se bloquean en orden inverso), las
+líneas se insertan con un único bulk_create y el stock se descuenta con un
+único UPDATE condicional `stock = stock - n WHERE stock - n >= reservado
+por otros carritos`: si alguna fila no cumple la condición la transacción
+se revierte, así que no se puede vender más de lo que hay ni el stock
+reservado en otros carritos.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Now
+
+from products.models import Product
+from .models import Cart, CartItem, Order, OrderItem, StockReservation
+from .reservations import available_stock, hold_order, release_expired_holds
+
+
+class CheckoutError(Exception):
+    """
+    Error de validación del checkout; `status_code` es el código HTTP.
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class _StockConflict(Exception):
+    pass
+
+
+def create_order_from_cart(user, shipping_address='', shipping_phone=''):
+    """
+    Crea la orden con el contenido del carrito de `user`, descuenta el
+    stock y vacía el carrito. Lanza CheckoutError si no es posible.
+    """
+    cart = Cart.objects.filter(user=user).only('pk').first()
+    if cart is None:
+        raise CheckoutError('Carrito no encontrado', status_code=404)
+
+    try:
+        with transaction.atomic():
+            quantities = dict(
+                CartItem.objects.filter(cart=cart).order_by('product_id').values_list('product_id', 'quantity')
+            )
+            if not quantities:
+                raise CheckoutError('El carrito está vacío')
+
+            products = list(
+                Product.objects.select_for_update()
+                .filter(pk__in=list(quantities)).order_by('pk')
+                .only('pk', 'name', 'price', 'stock')
+            )
+
+            # Validar stock descontando lo reservado en otros carritos; las
+            # reservas vencidas sin barrer se liberan para que no cuenten
+            release_expired_holds(quantities, exclude_user=user.pk)
+            available = available_stock(quantities, exclude_user=user.pk)
+            for product in products:
+                if available.get(product.pk, 0) < quantities[product.pk]:
+                    raise CheckoutError(f'Stock insuficiente para {product.name}')
+
+            order = Order.objects.create(
+                user=user,
+                total_price=sum(
+                    (product.price * quantities[product.pk] for product in products), Decimal('0.00')
+                ),
+                shipping_address=shipping_address,
+                shipping_phone=shipping_phone,
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order, product=product, quantity=quantities[product.pk],
+                    price=product.price, created_at=order.created_at,
+                )
+                for product in products
+            ])
+
+            # Las reservas propias se liberan en hold_order: no cuentan aquí
+            held = dict(
+                StockReservation.objects.filter(user=user, product_id__in=quantities)
+                .values_list('product_id', 'quantity')
+            )
+            delta = Case(
+                *[When(pk=product.pk, then=Value(quantities[product.pk])) for product in products],
+                output_field=IntegerField(),
+            )
+            needed = Case(
+                *[
+                    When(pk=product.pk, then=Value(quantities[product.pk] - held.get(product.pk, 0)))
+                    for product in products
+                ],
+                output_field=IntegerField(),
+            )
+            updated = Product.objects.filter(
+                pk__in=[product.pk for product in products],
+                stock__gte=F('reserved_stock') + needed,
+            ).update(stock=F('stock') - delta, updated_at=Now())
+            if updated != len(products):
+                raise _StockConflict()
+
+            # Las reservas del carrito pasan a la orden hasta que se pague
+            hold_order(order, {product.pk: quantities[product.pk] for product in products})
+            CartItem.objects.filter(cart=cart).delete()
+    except _StockConflict:
+        raise CheckoutError('Stock insuficiente para completar la orden')
+    return order
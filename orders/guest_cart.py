@@ -0,0 +1,155 @@
+"""
+Carritos de invitados (compradores sin sesión).
+
+Cada carrito se guarda en la base de datos (GuestCart) como
+{product_id: cantidad} bajo un token opaco que el cliente envía en la
+cabecera X-Cart-Token; no en la caché, que sin REDIS_URL es propia de cada
+worker y el carrito aparecería o no según qué proceso atendiera la
+petición. Expira tras GUEST_CART_TIMEOUT segundos sin cambios; los vencidos
+se eliminan con `manage.py prune_guest_carts`. Al iniciar sesión con esa
+cabecera el carrito se fusiona con el del usuario en una sola operación
+masiva y se descarta.
+"""
+import re
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cart_store import get_cart_store
+from .models import Cart, GuestCart
+from .reservations import InsufficientStock, available_stock, hold_cart_items
+
+GUEST_CART_HEADER = 'X-Cart-Token'
+TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def new_token():
+    return secrets.token_urlsafe(24)
+
+
+def get_token(request):
+    """
+    Devuelve el token de carrito de invitado de la petición, o None si no
+    viene o no tiene un formato válido.
+    """
+    token = request.headers.get(GUEST_CART_HEADER, '')
+    return token if TOKEN_PATTERN.match(token) else None
+
+
+def _cutoff():
+    return timezone.now() - timedelta(seconds=settings.GUEST_CART_TIMEOUT)
+
+
+def get_guest_cart(token):
+    """
+    Devuelve {product_id: cantidad} del carrito, o {} si no existe o expiró.
+    """
+    items = GuestCart.objects.filter(
+        token=token, updated_at__gte=_cutoff(),
+    ).values_list('items', flat=True).first()
+    return {int(product_id): quantity for product_id, quantity in (items or {}).items()}
+
+
+def save_guest_cart(token, quantities):
+    GuestCart.objects.update_or_create(
+        token=token,
+        defaults={
+            'items': {str(product_id): quantity for product_id, quantity in quantities.items()},
+            'updated_at': timezone.now(),
+        },
+    )
+
+
+def delete_guest_cart(token):
+    GuestCart.objects.filter(token=token).delete()
+
+
+def prune_expired(batch_size=1000):
+    """
+    Elimina por lotes los carritos de invitado vencidos. Devuelve cuántos
+    se eliminaron.
+    """
+    cutoff = _cutoff()
+    deleted = 0
+    while True:
+        ids = list(GuestCart.objects.filter(updated_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += GuestCart.objects.filter(pk__in=ids).delete()[0]
+
+
+def merge_quantities(current, guest, stock):
+    """
+    Suma las cantidades del invitado a las del usuario, limitadas al stock
+    disponible.
+    Devuelve solo los productos cuya cantidad cambia.
+    """
+    changed = {}
+    for product_id, quantity in guest.items():
+        if product_id not in stock:
+            continue
+        merged = min(current.get(product_id, 0) + quantity, stock[product_id])
+        if merged > 0 and merged != current.get(product_id):
+            changed[product_id] = merged
+    return changed
+
+
+def _merge_into(store, user_id, guest, stock):
+    if store is not None:
+        # Incrementos por producto y sin reserva (se hace al crear la orden)
+        current, _ = store.load(user_id)
+        changed = merge_quantities(current, guest, stock)
+        if changed:
+            store.apply(user_id, increments={
+                product_id: quantity - current.get(product_id, 0)
+                for product_id, quantity in changed.items()
+            })
+        return changed
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user_id=user_id)
+        Cart.objects.select_for_update().filter(pk=cart.pk).first()
+        current = dict(cart.items.values_list('product_id', 'quantity'))
+        changed = merge_quantities(current, guest, stock)
+        if changed:
+            cart.upsert_items(changed)
+            hold_cart_items(user_id, changed)
+    return changed
+
+
+def merge_guest_cart(user_id, token):
+    """
+    Fusiona el carrito de invitado `token` con el carrito del usuario y lo
+    descarta. Devuelve (número de productos cuya cantidad cambió, ids de los
+    productos que se omitieron por falta de stock). Nunca falla por stock:
+    se usa al iniciar sesión.
+    """
+    guest = get_guest_cart(token)
+    if not guest:
+        return 0, []
+    requested = list(guest)
+    stock = available_stock(guest, exclude_user=user_id)
+
+    store = get_cart_store()
+    retried, skipped = set(), set()
+    while True:
+        try:
+            changed = _merge_into(store, user_id, guest, stock)
+            break
+        except InsufficientStock as e:
+            # Otro carrito reservó entre la lectura y la reserva: se
+            # reintenta una vez limitando ese producto a lo que queda, y si
+            # vuelve a fallar se omite
+            if e.product_id in retried or stock.get(e.product_id) == e.available:
+                guest = {pk: quantity for pk, quantity in guest.items() if pk != e.product_id}
+                skipped.add(e.product_id)
+            else:
+                retried.add(e.product_id)
+                stock[e.product_id] = e.available
+
+    delete_guest_cart(token)
+    skipped.update(pk for pk in requested if stock.get(pk, 0) <= 0)
+    return len(changed), sorted(skipped)
@@ -0,0 +1,181 @@
+"""
+Soporte de la cabecera Idempotency-Key para endpoints que crean recursos.
+
+La primera petición con una clave inserta un IdempotencyRecord, ejecuta la
+vista y guarda el código y el cuerpo de la respuesta, todo en una misma
+transacción: la restricción única hace de bloqueo mientras la vista corre
+y, si el proceso muere o la vista lanza una excepción, se deshacen juntos
+el registro y el trabajo de la vista. Nunca queda un registro "en curso"
+confirmado, así que no hay bloqueos abandonados que tomar ni una petición
+lenta que se ejecute dos veces.
+
+Los reintentos con la misma clave y el mismo cuerpo reciben la respuesta
+guardada sin volver a ejecutar nada:
+
+- 409 si la petición original sigue en curso pasados
+  IDEMPOTENCY_LOCK_SECONDS de espera (en PostgreSQL el INSERT espera a que
+  la transacción original termine; `lock_timeout` acota esa espera).
+- 422 si la clave ya se usó con otra petición (huella distinta).
+
+Las respuestas 5xx no se guardan: la clave queda libre para reintentar.
+Las claves vencen tras IDEMPOTENCY_KEY_TTL_SECONDS.
+"""
+import functools
+import hashlib
+import json
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request):
+    """
+    Huella de la petición: método, ruta y cuerpo normalizado.
+    """
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    raw = f'{request.method}:{request.path}:{body}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.status_code)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def _in_progress():
+    return Response(
+        {'error': f'Hay una petición en curso con esta {IDEMPOTENCY_HEADER}.'},
+        status=status.HTTP_409_CONFLICT
+    )
+
+
+@contextmanager
+def _lock_timeout(seconds):
+    """
+    En PostgreSQL limita a `seconds` la espera por bloqueos dentro del
+    bloque (el INSERT de una clave cuya transacción sigue abierta) y
+    devuelve el valor anterior al salir; si el bloque falla, el savepoint
+    ya lo deshace.
+    """
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT current_setting('lock_timeout'), set_config('lock_timeout', %s, true)",
+            [f'{int(seconds * 1000)}ms'],
+        )
+        previous = cursor.fetchone()[0]
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('lock_timeout', %s, true)", [previous])
+
+
+def _acquire(user, scope, key, fingerprint):
+    """
+    Devuelve (registro, None) si esta petición debe ejecutarse, o
+    (None, respuesta) si debe responderse sin ejecutar la vista. Se llama
+    dentro de la transacción de la petición.
+    """
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic(), _lock_timeout(settings.IDEMPOTENCY_LOCK_SECONDS):
+                record = IdempotencyRecord.objects.create(
+                    user=user, scope=scope, key=key, fingerprint=fingerprint, created_at=now
+                )
+            return record, None
+        except IntegrityError:
+            pass
+        except OperationalError:
+            # Se agotó la espera: la petición original sigue en curso
+            return None, _in_progress()
+
+        record = IdempotencyRecord.objects.filter(user=user, scope=scope, key=key).first()
+        if record is None:
+            # Se liberó entre el INSERT y la lectura: reintentar
+            continue
+        if record.status_code is None or record.created_at < now - timedelta(
+            seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS
+        ):
+            # Vencida, o "en curso" confirmada por una versión anterior que
+            # no usaba una sola transacción: nadie la está ejecutando
+            record.delete()
+            continue
+        if record.fingerprint != fingerprint:
+            return None, Response(
+                {'error': f'La {IDEMPOTENCY_HEADER} ya se usó con una petición distinta.'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        return None, _replay(record)
+    return None, _in_progress()
+
+
+def _complete(record, response):
+    if response.status_code >= 500 or not hasattr(response, 'data'):
+        record.delete()
+        return
+    record.status_code = response.status_code
+    record.response_body = json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+    record.save(update_fields=['status_code', 'response_body'])
+
+
+def idempotent(scope):
+    """
+    Decorador para métodos de vistas DRF (post o acciones) que aplica la
+    cabecera Idempotency-Key. Sin cabecera la vista se ejecuta como siempre.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return method(view, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {'error': f'La {IDEMPOTENCY_HEADER} admite como máximo {MAX_KEY_LENGTH} caracteres.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(request)
+            # Una excepción (o un proceso muerto) deshace registro y trabajo
+            with transaction.atomic():
+                record, response = _acquire(request.user, scope, key, fingerprint)
+                if response is not None:
+                    return response
+                response = method(view, request, *args, **kwargs)
+                _complete(record, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def prune_expired(batch_size=1000):
+    """
+    Elimina por lotes las claves vencidas. Devuelve cuántas se eliminaron.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+    deleted = 0
+    while True:
+        ids = list(
+            IdempotencyRecord.objects.filter(created_at__lt=cutoff).values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += IdempotencyRecord.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,223 @@
+"""
+Banco de carga de checkouts concurrentes sobre un producto "caliente".
+
+`run_checkout_load` crea un producto con `stock` unidades y `buyers`
+compradores, y en dos fases concurrentes (hilos, una conexión por hilo):
+
+1. cada comprador añade `quantity` unidades con CartView.post;
+2. cada comprador con el producto en el carrito hace checkout
+   (orders.checkout.create_order_from_cart).
+
+Mide latencias (p50/p95/p99), throughput, interbloqueos y reintentos, y
+comprueba que stock final + unidades vendidas = stock inicial. Funciona
+con PostgreSQL o SQLite; con SQLite las escrituras se serializan.
+Se ejecuta con `manage.py loadtest_checkout`.
+"""
+import math
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from products.models import Category, Product
+from .checkout import CheckoutError, create_order_from_cart
+from .models import OrderItem
+from .views import CartView
+
+User = get_user_model()
+
+# Códigos SQLSTATE de PostgreSQL reintentables: deadlock y serialización
+RETRYABLE_PGCODES = {'40P01', '40001'}
+
+
+class OversellError(AssertionError):
+    pass
+
+
+def is_retryable(error):
+    """
+    Indica si un error de base de datos es un interbloqueo o conflicto
+    transitorio que se puede reintentar.
+    """
+    cause = error.__cause__
+    if getattr(cause, 'pgcode', None) in RETRYABLE_PGCODES:
+        return True
+    if getattr(getattr(cause, 'diag', None), 'sqlstate', None) in RETRYABLE_PGCODES:
+        return True
+    message = str(error).lower()
+    return 'deadlock' in message or 'database is locked' in message or 'database table is locked' in message
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class PhaseStats:
+    """
+    Resultados de una fase: latencias, resultados por tipo y reintentos.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.outcomes = {}
+        self.deadlocks = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, outcome, deadlocks=0, retries=0):
+        with self._lock:
+            self.latencies.append(latency)
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.deadlocks += deadlocks
+            self.retries += retries
+
+    def as_dict(self):
+        return {
+            'phase': self.name,
+            'requests': len(self.latencies),
+            'outcomes': dict(sorted(self.outcomes.items())),
+            'elapsed_s': round(self.elapsed, 3),
+            'throughput_rps': round(len(self.latencies) / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': round(percentile(self.latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(self.latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(self.latencies, 0.99) * 1000, 1),
+            'deadlocks': self.deadlocks,
+            'retries': self.retries,
+        }
+
+
+def _timed(stats, operation, max_retries):
+    """
+    Ejecuta `operation` (devuelve el resultado a registrar) reintentando
+    los errores transitorios, y registra su latencia total.
+    """
+    deadlocks = retries = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            try:
+                outcome = operation()
+                break
+            except DatabaseError as e:
+                if not is_retryable(e):
+                    outcome = f'error: {type(e).__name__}'
+                    break
+                if 'deadlock' in str(e).lower() or getattr(e.__cause__, 'pgcode', None) == '40P01':
+                    deadlocks += 1
+                if retries >= max_retries:
+                    outcome = 'gave_up'
+                    break
+                retries += 1
+                # Espera exponencial con jitter para no reintentar todos a la vez
+                time.sleep(random.uniform(0, min(0.5, 0.01 * 2 ** retries)))
+    finally:
+        connection.close()
+    stats.record(time.perf_counter() - started, outcome, deadlocks, retries)
+
+
+def _run_phase(name, users, operation, workers, max_retries):
+    stats = PhaseStats(name)
+    # Todas las tareas arrancan a la vez cuando la cola ya está llena
+    start = threading.Event()
+
+    def task(user):
+        start.wait()
+        _timed(stats, lambda: operation(user), max_retries)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(task, user) for user in users]
+        started = time.perf_counter()
+        start.set()
+        for future in futures:
+            future.result()
+    stats.elapsed = time.perf_counter() - started
+    return stats
+
+
+def seed(buyers, stock, label=None):
+    """
+    Crea el producto caliente y los compradores. Devuelve (producto, usuarios).
+    """
+    label = label or uuid.uuid4().hex[:8]
+    category, _ = Category.objects.get_or_create(name='Loadtest')
+    product = Product.objects.create(
+        name=f'Loadtest {label}', price='10.00', stock=stock, category=category
+    )
+    password = make_password(None)
+    users = User.objects.bulk_create([
+        User(username=f'loadtest_{label}_{i}', email=f'loadtest_{label}_{i}@example.com', password=password)
+        for i in range(buyers)
+    ])
+    if not all(user.pk for user in users):
+        users = list(User.objects.filter(username__startswith=f'loadtest_{label}_').order_by('pk'))
+    return product, users
+
+
+def cleanup(product, users):
+    """
+    Elimina los datos sembrados (carritos, órdenes y reservas caen en cascada).
+    """
+    User.objects.filter(pk__in=[user.pk for user in users]).delete()
+    product.delete()
+
+
+def run_checkout_load(buyers=100, stock=20, quantity=1, workers=16, max_retries=5, keep=False):
+    """
+    Ejecuta el banco de carga y devuelve el reporte (dict). Lanza
+    OversellError si no se conserva el stock.
+    """
+    product, users = seed(buyers, stock)
+    factory = APIRequestFactory()
+    cart_view = CartView.as_view()
+
+    def add_to_cart(user):
+        request = factory.post('/api/cart/', {'product_id': product.pk, 'quantity': quantity}, format='json')
+        force_authenticate(request, user=user)
+        response = cart_view(request)
+        return 'added' if response.status_code == 201 else f'http_{response.status_code}'
+
+    def checkout(user):
+        try:
+            create_order_from_cart(user)
+        except CheckoutError:
+            return 'rejected'
+        return 'ordered'
+
+    try:
+        cart_stats = _run_phase('cart', users, add_to_cart, workers, max_retries)
+        with_cart = list(
+            User.objects.filter(cart__items__product=product).order_by('pk').distinct()
+        )
+        checkout_stats = _run_phase('checkout', with_cart, checkout, workers, max_retries)
+
+        product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+        report = {
+            'database': connection.vendor,
+            'buyers': buyers,
+            'workers': workers,
+            'initial_stock': stock,
+            'final_stock': product.stock,
+            'units_sold': sold,
+            'phases': [cart_stats.as_dict(), checkout_stats.as_dict()],
+        }
+        if product.stock < 0 or product.stock + sold != stock:
+            raise OversellError(
+                f'Stock no conservado: final {product.stock} + vendido {sold} != inicial {stock}'
+            )
+        return report
+    finally:
+        if not keep:
+            cleanup(product, users)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.cart_store import get_cart_store
+
+
+class Command(BaseCommand):
+    help = (
+        'Escribe en la base de datos los carritos modificados en Redis '
+        '(CART_BACKEND=redis). Pensado para ejecutarse periódicamente.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Carritos tomados por lote (por defecto 100).',
+        )
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        if store is None:
+            raise CommandError('CART_BACKEND no es "redis": no hay carritos pendientes de escribir.')
+
+        written = store.flush(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Carritos escritos en la base de datos: {written}.'))
@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.loadtest import OversellError, run_checkout_load
+
+
+class Command(BaseCommand):
+    help = (
+        'Banco de carga de checkouts concurrentes: siembra un producto con poco '
+        'stock y muchos compradores, ejecuta en paralelo CartView.post y el '
+        'checkout, y reporta latencias p50/p95/p99, throughput, interbloqueos y '
+        'reintentos. Falla si stock final + unidades vendidas != stock inicial. '
+        'Usa la base de datos configurada (PostgreSQL o SQLite).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=100, help='Compradores concurrentes (por defecto 100).')
+        parser.add_argument('--stock', type=int, default=20, help='Stock inicial del producto (por defecto 20).')
+        parser.add_argument('--quantity', type=int, default=1, help='Unidades por comprador (por defecto 1).')
+        parser.add_argument('--workers', type=int, default=16, help='Hilos concurrentes (por defecto 16).')
+        parser.add_argument(
+            '--max-retries', type=int, default=5,
+            help='Reintentos ante interbloqueos o bloqueos de la base de datos (por defecto 5).',
+        )
+        parser.add_argument('--keep', action='store_true', help='No eliminar los datos sembrados al terminar.')
+        parser.add_argument('--json', action='store_true', help='Imprimir el reporte como JSON.')
+
+    def handle(self, *args, **options):
+        if options['buyers'] < 1 or options['workers'] < 1 or options['quantity'] < 1:
+            raise CommandError('--buyers, --workers y --quantity deben ser mayores que 0.')
+        try:
+            report = run_checkout_load(
+                buyers=options['buyers'],
+                stock=options['stock'],
+                quantity=options['quantity'],
+                workers=options['workers'],
+                max_retries=options['max_retries'],
+                keep=options['keep'],
+            )
+        except OversellError as e:
+            raise CommandError(str(e))
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"Base de datos: {report['database']}. Compradores: {report['buyers']}. "
+            f"Hilos: {report['workers']}."
+        )
+        for phase in report['phases']:
+            self.stdout.write(
+                f"[{phase['phase']}] {phase['requests']} peticiones en {phase['elapsed_s']}s "
+                f"({phase['throughput_rps']}/s) p50={phase['p50_ms']}ms p95={phase['p95_ms']}ms "
+                f"p99={phase['p99_ms']}ms interbloqueos={phase['deadlocks']} "
+                f"reintentos={phase['retries']} resultados={phase['outcomes']}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Stock conservado: inicial {report['initial_stock']} = final {report['final_stock']} "
+            f"+ vendido {report['units_sold']}."
+        ))
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.partitioning import (
+    PartitioningError,
+    add_months,
+    archive_before,
+    convert_tables,
+    describe,
+    ensure_partitions,
+    month_start,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Particionado mensual de órdenes e items por created_at (PostgreSQL, opcional). '
+        'Acciones: status (particiones actuales), convert (convierte las tablas una sola vez; '
+        'elimina las FK que apuntan a orders_order), ensure (crea las particiones de los '
+        'próximos meses; pensado para ejecutarse periódicamente) y archive (separa los meses '
+        'anteriores a --older-than-months, los guarda como CSV comprimido y los elimina). '
+        'Sin particiones, archive archiva y borra fila a fila.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['status', 'convert', 'ensure', 'archive'])
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=settings.ORDER_PARTITION_MONTHS_AHEAD,
+            help=f'Meses futuros con partición (por defecto {settings.ORDER_PARTITION_MONTHS_AHEAD}).',
+        )
+        parser.add_argument(
+            '--older-than-months',
+            type=int,
+            help='archive: meses completos que se conservan antes del mes actual.',
+        )
+        parser.add_argument(
+            '--archive-dir',
+            default=settings.ORDER_ARCHIVE_DIR,
+            help='archive: directorio de los archivos .csv.gz (por defecto ORDER_ARCHIVE_DIR).',
+        )
+        parser.add_argument(
+            '--detach-only',
+            action='store_true',
+            help='archive: solo separar las particiones, sin volcarlas ni eliminarlas.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            getattr(self, f"handle_{options['action']}")(options)
+        except PartitioningError as e:
+            raise CommandError(str(e))
+
+    def handle_status(self, options):
+        for table, partitions in describe().items():
+            if partitions:
+                self.stdout.write(f'{table}: {len(partitions)} particiones ({partitions[0]} .. {partitions[-1]})')
+            else:
+                self.stdout.write(f'{table}: sin particionar')
+
+    def handle_convert(self, options):
+        converted, dropped = convert_tables(months_ahead=options['months_ahead'])
+        for name in dropped:
+            self.stdout.write(f'Clave foránea eliminada: {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Tablas convertidas: {', '.join(converted) or 'ninguna (ya estaban particionadas)'}."
+        ))
+
+    def handle_ensure(self, options):
+        created = ensure_partitions(months_ahead=options['months_ahead'])
+        self.stdout.write(self.style.SUCCESS(f'Particiones creadas: {len(created)}.'))
+
+    def handle_archive(self, options):
+        if options['older_than_months'] is None or options['older_than_months'] < 0:
+            raise CommandError('archive requiere --older-than-months (0 o más).')
+        cutoff = add_months(month_start(timezone.now()), -options['older_than_months'])
+        archived = archive_before(cutoff, options['archive_dir'], detach_only=options['detach_only'])
+        for name, path in archived:
+            self.stdout.write(f'{name} -> {path or "separada"}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Meses anteriores a {cutoff:%Y-%m} archivados: {len(archived)} particiones o archivos.'
+        ))
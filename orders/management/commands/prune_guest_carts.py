@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from orders.guest_cart import prune_expired
+
+
+class Command(BaseCommand):
+    help = 'Elimina los carritos de invitado vencidos (GUEST_CART_TIMEOUT).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Carritos eliminados por lote (por defecto 1000).',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Carritos de invitado eliminados: {deleted}.'))
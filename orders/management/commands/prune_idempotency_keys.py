@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from orders.idempotency import prune_expired
+
+
+class Command(BaseCommand):
+    help = 'Elimina las claves de idempotencia vencidas (IDEMPOTENCY_KEY_TTL_SECONDS).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Claves eliminadas por lote (por defecto 1000).',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Claves de idempotencia eliminadas: {deleted}.'))
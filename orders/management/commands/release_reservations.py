@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from orders.reservations import DEFAULT_BATCH_SIZE, recount_reserved, release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        'Libera las reservas de stock vencidas por lotes y cancela las órdenes '
+        'PENDIENTE cuyas reservas vencieron sin pago, devolviendo su stock. '
+        'Pensado para ejecutarse periódicamente.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Reservas u órdenes procesadas por lote (por defecto {DEFAULT_BATCH_SIZE}).',
+        )
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help='Recalcula además el stock reservado de cada producto desde sus reservas.',
+        )
+
+    def handle(self, *args, **options):
+        released, cancelled = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Reservas de carrito liberadas: {released}. Órdenes canceladas: {cancelled}.'
+        ))
+        if options['recount']:
+            fixed = recount_reserved()
+            self.stdout.write(self.style.SUCCESS(f'Productos con stock reservado corregido: {fixed}.'))
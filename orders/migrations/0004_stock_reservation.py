@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_created_at_keyset_index'),
+        ('products', '0010_catalog_sync'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Cantidad')),
+                ('expires_at', models.DateTimeField(verbose_name='Vence')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Creación')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order', verbose_name='Orden')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='products.product', verbose_name='Producto')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to=settings.AUTH_USER_MODEL, verbose_name='Usuario (carrito)')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Stock',
+                'verbose_name_plural': 'Reservas de Stock',
+                'indexes': [models.Index(condition=models.Q(('user__isnull', False)), fields=['product', 'expires_at'], name='reservation_available_idx'), models.Index(fields=['expires_at'], name='reservation_expiry_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stockreservation',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_cart_reservation'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockreservation',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('order__isnull', True), ('user__isnull', False)), models.Q(('order__isnull', False), ('user__isnull', True)), _connector='OR'), name='reservation_cart_or_order'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_stock_reservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=100, verbose_name='Operación')),
+                ('key', models.CharField(max_length=255, verbose_name='Clave')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Huella de la petición')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Código de respuesta')),
+                ('response_body', models.JSONField(blank=True, null=True, verbose_name='Respuesta')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fecha de Creación')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_records', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Clave de Idempotencia',
+                'verbose_name_plural': 'Claves de Idempotencia',
+                'indexes': [models.Index(fields=['created_at'], name='idempotency_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencyrecord',
+            constraint=models.UniqueConstraint(fields=('user', 'scope', 'key'), name='unique_idempotency_key'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-16 21:07
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_order_dates(apps, schema_editor):
+    """
+    Los items existentes toman la fecha de su orden.
+    """
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    OrderItem.objects.update(
+        created_at=Subquery(Order.objects.filter(pk=OuterRef('order_id')).values('created_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fecha de Creación'),
+        ),
+        migrations.RunPython(copy_order_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-16 21:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_orderitem_created_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='payment_status',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('pagado', 'Pagado'), ('fallido', 'Fallido'), ('expirado', 'Expirado'), ('reembolsado', 'Reembolsado')], default='pendiente', max_length=20, verbose_name='Estado de Pago'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-16 22:24
+
+from django.db import migrations
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def count_reserved(apps, schema_editor):
+    """
+    reserved_stock empieza con las reservas de carrito existentes.
+    """
+    Product = apps.get_model('products', 'Product')
+    StockReservation = apps.get_model('orders', 'StockReservation')
+    held = (
+        StockReservation.objects.filter(user__isnull=False, product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    Product.objects.update(reserved_stock=Coalesce(Subquery(held, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_payment_status_expired'),
+        ('products', '0011_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_reserved, migrations.RunPython.noop),
+    ]
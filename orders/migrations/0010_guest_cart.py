@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-16 22:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_count_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuestCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, unique=True, verbose_name='Token')),
+                ('items', models.JSONField(default=dict, verbose_name='Items')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Última Actualización')),
+            ],
+            options={
+                'verbose_name': 'Carrito de Invitado',
+                'verbose_name_plural': 'Carritos de Invitado',
+                'indexes': [models.Index(fields=['updated_at'], name='guest_cart_updated_idx')],
+            },
+        ),
+    ]
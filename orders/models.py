@@ -1,11 +1,46 @@
 from django.db import models
+from django.utils import timezone
+from django.db.models import CharField, Count, DecimalField, F, IntegerField, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
-from products.models import Product
+from products.models import Brand, Category, Product
 from decimal import Decimal
 
 User = get_user_model()
 
 
+class CartQuerySet(models.QuerySet):
+    """
+    QuerySet con la ruta de lectura optimizada del carrito.
+    """
+
+    def with_totals(self):
+        """
+        Anota `total_price` e `items_count` calculados en SQL.
+        """
+        amount = DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(
+            total_price=Coalesce(
+                Sum(F('items__quantity') * F('items__product__price'), output_field=amount),
+                Value(Decimal('0.00')),
+                output_field=amount,
+            ),
+            items_count=Count('items'),
+        )
+
+    def with_items(self):
+        """
+        Precarga los items con su producto, categoría y marca (anotadas con
+        su número de productos). El costo en consultas es constante sin
+        importar cuántos items tenga el carrito.
+        """
+        items = CartItem.objects.select_related('product').prefetch_related(
+            Prefetch('product__category', queryset=Category.objects.annotate(products_count=Count('products'))),
+            Prefetch('product__brand', queryset=Brand.objects.annotate(products_count=Count('products'))),
+        ).order_by('id')
+        return self.prefetch_related(Prefetch('items', queryset=items))
+
+
 class Cart(models.Model):
     """
     Carrito de compras - Cada usuario tiene un carrito único
@@ -19,6 +54,8 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Creación')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Última Actualización')
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Carrito'
         verbose_name_plural = 'Carritos'
@@ -33,6 +70,29 @@ class Cart(models.Model):
         total = sum(item.get_item_price() for item in self.items.all())
         return Decimal(str(total))
 
+    def set_items(self, quantities):
+        """
+        Deja el carrito con exactamente los items {product_id: cantidad}:
+        borra los que sobran y hace upsert del resto.
+        """
+        self.items.exclude(product_id__in=list(quantities)).delete()
+        self.upsert_items(quantities)
+
+    def upsert_items(self, quantities):
+        """
+        Crea o actualiza los items {product_id: cantidad} en una sola sentencia.
+        """
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart=self, product_id=product_id, quantity=quantity)
+                for product_id, quantity in quantities.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity'],
+        )
+        Cart.objects.filter(pk=self.pk).update(updated_at=timezone.now())
+
 
 class CartItem(models.Model):
     """
@@ -74,6 +134,51 @@ class CartItem(models.Model):
         return Decimal(str(self.quantity)) * self.product.price
 
 
+class OrderQuerySet(models.QuerySet):
+    """
+    QuerySet con las rutas de lectura del historial de órdenes.
+    """
+
+    def with_summary(self):
+        """
+        Anota `items_count`, `first_product_name` y `thumbnail` (imagen del
+        primer producto) con subconsultas, sin cargar los items. Se unen por
+        `order_id`; `created_at >= fecha de la orden` (un item nunca es
+        anterior a su orden) solo sirve para que, con tablas particionadas,
+        no se lean las particiones de meses anteriores.
+        """
+        items = OrderItem.objects.filter(order=OuterRef('pk'), created_at__gte=OuterRef('created_at'))
+        count = items.order_by().values('order').annotate(total=Count('pk')).values('total')
+        first = items.order_by('id')
+        return self.annotate(
+            items_count=Coalesce(Subquery(count, output_field=IntegerField()), Value(0)),
+            first_product_name=Subquery(first.values('product__name')[:1], output_field=CharField()),
+            thumbnail=Subquery(first.values('product__image')[:1], output_field=CharField()),
+        )
+
+    def with_items(self):
+        """
+        Precarga los items con su producto, categoría y marca (anotadas con
+        su número de productos), con un número fijo de consultas.
+        """
+        return self.prefetch_related(items_prefetch())
+
+
+def items_prefetch(created_at=None):
+    """
+    Prefetch de los items de órdenes para el detalle. Con `created_at` (la
+    fecha de la única orden a precargar) se descartan las particiones de
+    meses anteriores; la unión sigue siendo por `order_id`.
+    """
+    items = OrderItem.objects.select_related('product').prefetch_related(
+        Prefetch('product__category', queryset=Category.objects.annotate(products_count=Count('products'))),
+        Prefetch('product__brand', queryset=Brand.objects.annotate(products_count=Count('products'))),
+    ).order_by('id')
+    if created_at is not None:
+        items = items.filter(created_at__gte=created_at)
+    return Prefetch('items', queryset=items)
+
+
 class Order(models.Model):
     """
     Orden de compra - Registro histórico de compras
@@ -89,6 +194,8 @@ class Order(models.Model):
         ('pendiente', 'Pendiente'),
         ('pagado', 'Pagado'),
         ('fallido', 'Fallido'),
+        ('expirado', 'Expirado'),
+        ('reembolsado', 'Reembolsado'),
     ]
 
     user = models.ForeignKey(
@@ -144,10 +251,18 @@ class Order(models.Model):
         verbose_name='Estado de Pago'
     )
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Orden'
         verbose_name_plural = 'Órdenes'
         ordering = ['-created_at']
+        indexes = [
+            # Soporta la paginación keyset por (-created_at, -id)
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            # Historial de un usuario: filtro por usuario + mismo orden keyset
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Orden #{self.id} - {self.user.username}"
@@ -176,6 +291,9 @@ class OrderItem(models.Model):
         decimal_places=2,
         verbose_name='Precio Unitario'
     )
+    # Copia de la fecha de la orden: clave de partición de los items
+    # (ver orders/partitioning.py)
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Fecha de Creación')
 
     class Meta:
         verbose_name = 'Item de Orden'
@@ -185,8 +303,131 @@ class OrderItem(models.Model):
         product_name = self.product.name if self.product else "Producto eliminado"
         return f"{self.quantity}x {product_name}"
 
+    def save(self, *args, **kwargs):
+        # Clave de partición: el item va en el mes de su orden
+        if self._state.adding and self.order_id:
+            self.created_at = self.order.created_at
+        super().save(*args, **kwargs)
+
     def get_item_price(self):
         """
         Calcula el precio total del item (cantidad * precio al momento de compra)
         """
         return Decimal(str(self.quantity)) * self.price
+
+
+class StockReservation(models.Model):
+    """
+    Reserva temporal de stock (ver orders/reservations.py).
+
+    - De carrito (`user`): descuenta del stock disponible hasta `expires_at`.
+    - De orden PENDIENTE (`order`): el stock ya se descontó al crear la
+      orden; si vence sin pago la orden se cancela y el stock se devuelve.
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Producto'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='stock_reservations',
+        verbose_name='Usuario (carrito)'
+    )
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservations',
+        verbose_name='Orden'
+    )
+    quantity = models.PositiveIntegerField(verbose_name='Cantidad')
+    expires_at = models.DateTimeField(verbose_name='Vence')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Creación')
+
+    class Meta:
+        verbose_name = 'Reserva de Stock'
+        verbose_name_plural = 'Reservas de Stock'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_reservation'),
+            models.CheckConstraint(
+                check=(
+                    models.Q(user__isnull=False, order__isnull=True)
+                    | models.Q(user__isnull=True, order__isnull=False)
+                ),
+                name='reservation_cart_or_order',
+            ),
+        ]
+        indexes = [
+            # Suma de reservas vigentes de carrito por producto (stock disponible)
+            models.Index(
+                fields=['product', 'expires_at'],
+                condition=models.Q(user__isnull=False),
+                name='reservation_available_idx',
+            ),
+            # Barrido por lotes de reservas vencidas
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        owner = f"orden #{self.order_id}" if self.order_id else f"carrito de usuario {self.user_id}"
+        return f"{self.quantity}x producto {self.product_id} ({owner})"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Respuesta guardada de una petición con cabecera Idempotency-Key
+    (ver orders/idempotency.py). Mientras `status_code` es nulo la
+    petición original sigue en curso y la fila actúa como bloqueo.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='idempotency_records',
+        verbose_name='Usuario'
+    )
+    scope = models.CharField(max_length=100, verbose_name='Operación')
+    key = models.CharField(max_length=255, verbose_name='Clave')
+    fingerprint = models.CharField(max_length=64, verbose_name='Huella de la petición')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Código de respuesta')
+    response_body = models.JSONField(null=True, blank=True, verbose_name='Respuesta')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Fecha de Creación')
+
+    class Meta:
+        verbose_name = 'Clave de Idempotencia'
+        verbose_name_plural = 'Claves de Idempotencia'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.user_id})"
+
+
+class GuestCart(models.Model):
+    """
+    Carrito de un invitado identificado por un token opaco (ver
+    orders/guest_cart.py). `items` es {product_id: cantidad} con las claves
+    como texto, como las guarda JSON.
+    """
+    token = models.CharField(max_length=64, unique=True, verbose_name='Token')
+    items = models.JSONField(default=dict, verbose_name='Items')
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name='Última Actualización')
+
+    class Meta:
+        verbose_name = 'Carrito de Invitado'
+        verbose_name_plural = 'Carritos de Invitado'
+        indexes = [
+            models.Index(fields=['updated_at'], name='guest_cart_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"Carrito de invitado {self.token[:8]}…"
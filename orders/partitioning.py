@@ -0,0 +1,341 @@
+"""
+Particionado mensual por `created_at` de órdenes e items (opcional, solo
+PostgreSQL) y archivado de los meses antiguos.
+
+- `convert_tables()` convierte, una sola vez, orders_order y
+  orders_orderitem en tablas PARTITION BY RANGE (created_at) con una
+  partición por mes (`<tabla>_pAAAAMM`, meses UTC) y una partición
+  DEFAULT. PostgreSQL exige que la clave primaria incluya la clave de
+  partición, así que pasa a ser (id, created_at) y ninguna clave foránea
+  puede apuntar a estas tablas. La conversión elimina esas claves foráneas
+  (items y reservas hacia la orden) y las devuelve; los modelos las siguen
+  declarando, porque sin particionar (SQLite, o PostgreSQL sin convertir)
+  se conservan, y tras convertir el borrado en cascada lo sigue haciendo el
+  ORM.
+- `ensure_partitions()` crea las particiones de los próximos meses. Si la
+  partición DEFAULT ya tiene filas de uno de esos meses (p. ej. fechas
+  futuras), las mueve a la partición nueva en la misma transacción.
+- `archive_before()` separa (DETACH) las particiones anteriores a un mes,
+  las vuelca a `<partición>.csv.gz` y las elimina. Si las tablas no están
+  particionadas (SQLite, o PostgreSQL sin convertir) archiva y borra fila
+  a fila con el mismo formato de archivo.
+
+Solo se podan particiones cuando la consulta acota `created_at`: las
+páginas siguientes del historial (el cursor da el límite superior), los
+filtros por fecha del admin, las subconsultas de items del listado y los
+items del detalle (acotados por la fecha de su orden). La primera página
+del historial no tiene límite inferior: recorre las particiones de la más
+reciente hacia atrás y se detiene al llenar la página. Buscar una orden
+solo por id (detalle, reservas, webhook de Stripe) consulta el índice de
+todas las particiones.
+Se ejecuta con `manage.py partition_orders`.
+"""
+import csv
+import gzip
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+TABLES = (Order._meta.db_table, OrderItem._meta.db_table)
+PARTITION_PATTERN = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def month_start(value):
+    """
+    Primer instante (UTC) del mes de `value`.
+    """
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+
+def is_partitioned(table):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+            [table],
+        )
+        return cursor.fetchone()[0]
+
+
+def list_partitions(table):
+    """
+    Devuelve [(nombre, mes)] de las particiones mensuales de `table`, en orden.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = to_regclass(%s)',
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_PATTERN.search(name)
+        if match:
+            partitions.append((name, datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def _create_partition(cursor, table, month):
+    qn = connection.ops.quote_name
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS {qn(partition_name(table, month))} PARTITION OF {qn(table)} '
+        'FOR VALUES FROM (%s) TO (%s)',
+        [month, add_months(month, 1)],
+    )
+
+
+def _split_default(cursor, table, month):
+    """
+    Crea la partición de `month` cuando la partición DEFAULT ya tiene filas
+    de ese mes (PostgreSQL rechazaría el CREATE ... PARTITION OF): se crea
+    como tabla suelta, se le mueven las filas y se adjunta.
+    """
+    qn = connection.ops.quote_name
+    name, default = partition_name(table, month), f'{table}_default'
+    bounds = [month, add_months(month, 1)]
+    cursor.execute(f'LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE')
+    cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {qn(default)} WHERE created_at >= %s AND created_at < %s RETURNING *) '
+        f'INSERT INTO {qn(name)} SELECT * FROM moved',
+        bounds,
+    )
+    # ATTACH crea los índices (y la clave primaria) de la tabla particionada
+    cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)', bounds)
+
+
+def _default_has_rows(cursor, table, month):
+    qn = connection.ops.quote_name
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [f'{table}_default'])
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {qn(table + "_default")} WHERE created_at >= %s AND created_at < %s)',
+        [month, add_months(month, 1)],
+    )
+    return cursor.fetchone()[0]
+
+
+def ensure_partitions(months_ahead=None):
+    """
+    Crea las particiones del mes actual y de los `months_ahead` siguientes
+    en las tablas ya particionadas. Devuelve los nombres creados.
+    """
+    if months_ahead is None:
+        months_ahead = settings.ORDER_PARTITION_MONTHS_AHEAD
+    current = month_start(timezone.now())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table in TABLES:
+            if not is_partitioned(table):
+                continue
+            existing = {name for name, _ in list_partitions(table)}
+            for offset in range(months_ahead + 1):
+                month = add_months(current, offset)
+                if partition_name(table, month) not in existing:
+                    if _default_has_rows(cursor, table, month):
+                        _split_default(cursor, table, month)
+                    else:
+                        _create_partition(cursor, table, month)
+                    created.append(partition_name(table, month))
+    return created
+
+
+def convert_tables(months_ahead=None):
+    """
+    Convierte las tablas de órdenes e items en tablas particionadas por
+    mes, copiando los datos, y elimina las claves foráneas que apuntan a
+    ellas. Devuelve (tablas convertidas, claves foráneas eliminadas); las
+    tablas que ya lo estaban se omiten.
+    """
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('El particionado de órdenes solo está disponible en PostgreSQL.')
+    if months_ahead is None:
+        months_ahead = settings.ORDER_PARTITION_MONTHS_AHEAD
+
+    converted, dropped = [], []
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Las FK diferidas con comprobaciones pendientes impiden el ALTER TABLE
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        pending = [table for table in TABLES if not is_partitioned(table)]
+        if pending:
+            dropped = _drop_foreign_keys_to(cursor, pending)
+        for table in pending:
+            _convert_table(cursor, table, months_ahead)
+            converted.append(table)
+    return converted, dropped
+
+
+def _drop_foreign_keys_to(cursor, tables):
+    """
+    Elimina las claves foráneas que apuntan a `tables` (una tabla
+    particionada no puede ser su destino). Devuelve ['tabla.restricción'].
+    """
+    qn = connection.ops.quote_name
+    cursor.execute(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+        "WHERE contype = 'f' AND confrelid IN (SELECT to_regclass(name) FROM unnest(%s::text[]) AS name) "
+        "ORDER BY 1, 2",
+        [list(tables)],
+    )
+    dropped = []
+    for table, name in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {qn(table)} DROP CONSTRAINT {qn(name)}')
+        dropped.append(f'{table}.{name}')
+    return dropped
+
+
+def _convert_table(cursor, table, months_ahead):
+    qn = connection.ops.quote_name
+    legacy = f'{table}_legacy'
+    sequence = f'{table}_part_id_seq'
+
+    # Índices y FK salientes a recrear con los mismos nombres (sin la PK
+    # ni las FK hacia tablas que se particionan)
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN ("
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p')",
+        [table, table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f' "
+        "AND confrelid NOT IN (SELECT to_regclass(name) FROM unnest(%s::text[]) AS name)",
+        [table, list(TABLES)],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(f'SELECT MIN(created_at) FROM {qn(table)}')
+    oldest = cursor.fetchone()[0] or timezone.now()
+
+    cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+    cursor.execute(
+        f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE (created_at)'
+    )
+    month, last = month_start(oldest), add_months(month_start(timezone.now()), months_ahead)
+    while month <= last:
+        _create_partition(cursor, table, month)
+        month = add_months(month, 1)
+    cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+    cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}')
+    # Las FK que apuntaban a esta tabla ya se eliminaron en convert_tables
+    cursor.execute(f'DROP TABLE {qn(legacy)}')
+
+    cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, created_at)')
+    for definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+
+    # La columna identity no se copia: el id sigue de una secuencia propia
+    cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id')
+    cursor.execute(f'SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)', [sequence])
+    cursor.execute(f'ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)', [sequence])
+    cursor.execute(f'ANALYZE {qn(table)}')
+
+
+def archive_before(cutoff, directory=None, detach_only=False):
+    """
+    Archiva las órdenes e items de los meses anteriores a `cutoff` (primer
+    día de un mes). Devuelve [(partición, archivo o None)].
+    """
+    directory = directory or settings.ORDER_ARCHIVE_DIR
+    partitioned = all(is_partitioned(table) for table in TABLES)
+    if detach_only and not partitioned:
+        raise PartitioningError('--detach-only requiere tablas particionadas.')
+    if not detach_only:
+        os.makedirs(directory, exist_ok=True)
+    if not partitioned:
+        return _archive_rows(cutoff, directory)
+
+    qn = connection.ops.quote_name
+    archived = []
+    for table in TABLES:
+        for name, month in list_partitions(table):
+            if month >= cutoff:
+                continue
+            path = None if detach_only else os.path.join(directory, f'{name}.csv.gz')
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+                if path:
+                    _copy_to_file(cursor, name, path)
+                    cursor.execute(f'DROP TABLE {qn(name)}')
+            archived.append((name, path))
+    return archived
+
+
+def _copy_to_file(cursor, table, path):
+    sql = f'COPY {connection.ops.quote_name(table)} TO STDOUT WITH (FORMAT csv, HEADER)'
+    raw = cursor.cursor
+    with gzip.open(path, 'wb') as output:
+        if hasattr(raw, 'copy_expert'):
+            # psycopg2
+            raw.copy_expert(sql, output)
+        else:
+            # psycopg 3
+            with raw.copy(sql) as copy:
+                for data in copy:
+                    output.write(data)
+
+
+def _archive_rows(cutoff, directory):
+    """
+    Alternativa sin particiones: escribe y borra, mes a mes, las órdenes
+    anteriores a `cutoff` y sus items.
+    """
+    archived = []
+    months = Order.objects.filter(created_at__lt=cutoff).datetimes('created_at', 'month', tzinfo=dt_timezone.utc)
+    for month in list(months):
+        with transaction.atomic():
+            orders = Order.objects.filter(created_at__gte=month, created_at__lt=add_months(month, 1))
+            for queryset in (orders, OrderItem.objects.filter(order__in=orders)):
+                name = partition_name(queryset.model._meta.db_table, month)
+                path = os.path.join(directory, f'{name}.csv.gz')
+                _write_rows(queryset, path)
+                archived.append((name, path))
+            orders.delete()
+    return archived
+
+
+def _write_rows(queryset, path):
+    fields = queryset.model._meta.concrete_fields
+    with gzip.open(path, 'wt', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow([field.column for field in fields])
+        rows = queryset.order_by('pk').values_list(*[field.attname for field in fields])
+        writer.writerows(rows.iterator(chunk_size=2000))
+
+
+def describe():
+    """
+    Devuelve {tabla: [particiones]} (lista vacía si no está particionada).
+    """
+    return {
+        table: [name for name, _ in list_partitions(table)] if is_partitioned(table) else []
+        for table in TABLES
+    }
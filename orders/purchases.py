@@ -0,0 +1,51 @@
+"""
+Conjunto cacheado de productos comprados (órdenes PAGADO) por usuario.
+
+Se usa para validar reseñas y para indicar en el catálogo qué productos
+puede reseñar el usuario, sin repetir el JOIN con OrderItem en cada
+petición. `orders.signals` invalida la entrada al cambiar una orden.
+
+La invalidación solo llega a los demás workers si la caché es compartida;
+con LocMemCache la entrada dura PURCHASES_LOCAL_CACHE_TIMEOUT segundos,
+así una compra recién pagada se ve enseguida en todos.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from smartsales_backend.cache import default_cache_is_shared
+from .models import OrderItem
+
+
+def _cache_key(user_id):
+    return f'orders:purchased:{user_id}'
+
+
+def _timeout():
+    if default_cache_is_shared():
+        return settings.PURCHASES_CACHE_TIMEOUT
+    return settings.PURCHASES_LOCAL_CACHE_TIMEOUT
+
+
+def purchased_product_ids(user):
+    """
+    Devuelve el frozenset de ids de productos que `user` ha comprado.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    key = _cache_key(user.pk)
+    product_ids = cache.get(key)
+    if product_ids is None:
+        product_ids = frozenset(
+            OrderItem.objects.filter(
+                order__user_id=user.pk,
+                order__status='PAGADO',
+                product_id__isnull=False,
+            ).values_list('product_id', flat=True).distinct()
+        )
+        cache.set(key, product_ids, _timeout())
+    return product_ids
+
+
+def invalidate_purchased_products(user_id):
+    cache.delete(_cache_key(user_id))
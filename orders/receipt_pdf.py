@@ -0,0 +1,46 @@
+"""
+Conversión HTML -> PDF de comprobantes, ejecutada en los procesos del
+pool de orders/receipts.py. No importa Django: los procesos hijos se
+crean con 'spawn' y solo cargan este módulo.
+"""
+import signal
+from contextlib import contextmanager
+from io import BytesIO
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Lanza TimeoutError si el bloque tarda más de `seconds`. Usa SIGALRM, así
+    que solo limita en el hilo principal de sistemas que lo tienen (como los
+    procesos del pool); en otro caso no hace nada.
+    """
+    if not seconds or not hasattr(signal, 'setitimer'):
+        yield
+        return
+
+    def expire(signum, frame):
+        raise TimeoutError(f'La generación del PDF superó {seconds} segundos')
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def html_to_pdf(html, timeout=None):
+    """
+    Devuelve el PDF (bytes) del HTML dado, en como mucho `timeout` segundos.
+    Requiere xhtml2pdf.
+    """
+    from xhtml2pdf import pisa
+
+    output = BytesIO()
+    with time_limit(timeout):
+        result = pisa.CreatePDF(html, dest=output, encoding='utf-8')
+    if result.err:
+        raise ValueError(f'No se pudo generar el PDF ({result.err} errores)')
+    return output.getvalue()
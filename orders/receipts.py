@@ -0,0 +1,166 @@
+"""
+Comprobantes de órdenes cacheados.
+
+El HTML de un comprobante (y su PDF) se cachea con la clave
+(order_id, updated_at, formato): cualquier cambio de la orden actualiza
+`updated_at`, así que una entrada nunca queda obsoleta y las anteriores
+expiran solas. Servir un comprobante cacheado cuesta una consulta por
+clave primaria (dueño y `updated_at`) y una lectura de caché.
+
+- Cuando una orden se guarda como PAGADO su comprobante se pre-renderiza
+  tras el commit (ver orders/signals.py), fuera de las peticiones de los
+  clientes: el webhook de Stripe es quien marca las órdenes pagadas.
+- El PDF es opcional (requiere xhtml2pdf) y se genera en un pool de
+  RECEIPT_PDF_WORKERS procesos; mientras tanto el endpoint responde 202.
+  Una generación que falla o no termina en RECEIPT_PDF_TIMEOUT segundos
+  (contando la espera en el pool) deja una marca de error durante
+  RECEIPT_PDF_RETRY_SECONDS: hasta entonces se responde con error en lugar
+  de volver a encolarla.
+"""
+import importlib.util
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .models import Order
+from .receipt_pdf import html_to_pdf
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_NAME = 'orders/receipt.html'
+CACHE_KEY = 'orders:receipt:{order_id}:{version}:{fmt}'
+PENDING_KEY = 'orders:receipt_pending:{order_id}:{version}'
+FAILED_KEY = 'orders:receipt_pdf_failed:{order_id}:{version}'
+
+_lock = threading.Lock()
+_processes = None
+
+
+class PdfUnavailable(Exception):
+    pass
+
+
+class PdfRenderFailed(Exception):
+    pass
+
+
+def _version(updated_at):
+    return int(updated_at.timestamp() * 1_000_000)
+
+
+def receipt_key(order_id, updated_at, fmt='html'):
+    return CACHE_KEY.format(order_id=order_id, version=_version(updated_at), fmt=fmt)
+
+
+def receipt_queryset():
+    """
+    Órdenes con lo que usa la plantilla del comprobante ya precargado.
+    """
+    return Order.objects.select_related('user').prefetch_related('items__product__brand')
+
+
+def render_receipt_html(order):
+    """
+    Renderiza el comprobante de una orden cargada con receipt_queryset().
+    """
+    return render_to_string(TEMPLATE_NAME, {'order': order})
+
+
+def get_receipt_html(order_id, updated_at):
+    """
+    Devuelve el HTML del comprobante desde la caché, renderizándolo si falta.
+    """
+    key = receipt_key(order_id, updated_at)
+    html = cache.get(key)
+    if html is None:
+        html = render_receipt_html(receipt_queryset().get(pk=order_id))
+        cache.set(key, html, settings.RECEIPT_CACHE_TIMEOUT)
+    return html
+
+
+def pdf_available():
+    return importlib.util.find_spec('xhtml2pdf') is not None
+
+
+def get_receipt_pdf(order_id, updated_at):
+    """
+    Devuelve el PDF cacheado, o None si se está generando (en ese caso se
+    encola en el pool de procesos). Lanza PdfUnavailable sin xhtml2pdf y
+    PdfRenderFailed si la generación falló o superó RECEIPT_PDF_TIMEOUT.
+    """
+    version = _version(updated_at)
+    failed = FAILED_KEY.format(order_id=order_id, version=version)
+    pdf_key = receipt_key(order_id, updated_at, 'pdf')
+    cached = cache.get_many([pdf_key, failed])
+    if pdf_key in cached:
+        return cached[pdf_key]
+    if failed in cached:
+        raise PdfRenderFailed(cached[failed])
+    if not pdf_available():
+        raise PdfUnavailable('La generación de PDF no está disponible en este servidor.')
+
+    deadline = cache.get(PENDING_KEY.format(order_id=order_id, version=version))
+    if deadline is None:
+        _render_pdf_async(order_id, updated_at, get_receipt_html(order_id, updated_at))
+    elif time.time() > deadline:
+        # El proceso que lo generaba no respondió a tiempo
+        error = f'El PDF no se generó en {settings.RECEIPT_PDF_TIMEOUT} segundos.'
+        cache.set(failed, error, settings.RECEIPT_PDF_RETRY_SECONDS)
+        raise PdfRenderFailed(error)
+    return None
+
+
+def _process_pool():
+    global _processes
+    with _lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(
+                max_workers=settings.RECEIPT_PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _processes
+
+
+def _render_pdf_async(order_id, updated_at, html):
+    version = _version(updated_at)
+    pending = PENDING_KEY.format(order_id=order_id, version=version)
+    timeout = settings.RECEIPT_PDF_TIMEOUT
+    # Una sola generación por versión aunque lleguen varias peticiones. La
+    # clave guarda el plazo y dura más que él, para que las consultas vean
+    # que venció en lugar de volver a encolar
+    if not cache.add(pending, time.time() + timeout, 2 * timeout):
+        return
+    key = receipt_key(order_id, updated_at, 'pdf')
+
+    def store(future):
+        try:
+            cache.set(key, future.result(), settings.RECEIPT_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.exception('Error generando el PDF del comprobante de la orden %s', order_id)
+            cache.set(
+                FAILED_KEY.format(order_id=order_id, version=version),
+                f'No se pudo generar el PDF: {e}',
+                settings.RECEIPT_PDF_RETRY_SECONDS,
+            )
+        finally:
+            cache.delete(pending)
+
+    _process_pool().submit(html_to_pdf, html, timeout).add_done_callback(store)
+
+
+def prerender(order_id):
+    """
+    Deja en caché el HTML (y el PDF, si está disponible) del comprobante.
+    """
+    updated_at = Order.objects.filter(pk=order_id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return
+    html = get_receipt_html(order_id, updated_at)
+    if pdf_available() and cache.get(receipt_key(order_id, updated_at, 'pdf')) is None:
+        _render_pdf_async(order_id, updated_at, html)
@@ -0,0 +1,294 @@
+"""
+Reservas temporales de stock.
+
+- Al añadir productos al carrito se reserva la cantidad durante
+  CART_RESERVATION_SECONDS (se renueva con cada cambio del carrito).
+  Las reservas de carrito se acumulan en Product.reserved_stock con un
+  UPDATE condicional `reserved_stock = reserved_stock + n WHERE
+  stock - reserved_stock >= n`: la comprobación y la reserva son una sola
+  sentencia, sin SELECT ... FOR UPDATE previo, así que dos carritos
+  concurrentes no pueden reservar el mismo stock.
+  Stock disponible = stock - reserved_stock (+ las reservas propias).
+- Una reserva vencida cuenta hasta que se barre: `release_expired` la
+  elimina periódicamente, y si una reserva no cabe se barren antes las
+  vencidas de ese producto y se reintenta.
+- Al crear la orden las reservas del carrito pasan a la orden durante
+  ORDER_RESERVATION_SECONDS. El stock ya se descontó; si la orden sigue
+  PENDIENTE al vencer, `release_expired` la cancela y devuelve el stock.
+  Al pagarse, `commit_order` elimina sus reservas. La sesión de Stripe
+  vence antes que la reserva (`extend_order_hold`), y la orden cancelada
+  queda con payment_status 'expirado'.
+
+`release_expired` procesa por lotes y se ejecuta con
+`manage.py release_reservations`; `recount_reserved` recalcula
+reserved_stock desde las reservas (p. ej. tras borrar usuarios).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+from products.models import Product
+from .models import Order, StockReservation
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class InsufficientStock(Exception):
+    """
+    La reserva de `product_id` no cabe en el stock disponible.
+    """
+
+    def __init__(self, product_id, available):
+        super().__init__(f'Stock insuficiente. Disponible: {available}')
+        self.product_id = product_id
+        self.available = available
+
+
+def _held(*conditions):
+    """
+    Subconsulta: total de reservas de carrito del producto (OuterRef('pk')).
+    """
+    held = (
+        StockReservation.objects.filter(*conditions, user__isnull=False, product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(Subquery(held, output_field=IntegerField()), Value(0))
+
+
+def with_available(queryset, exclude_user=None):
+    """
+    Anota `available_stock` (stock menos reservas de carrito vigentes).
+    Las reservas de `exclude_user` no cuentan: son las de su propio carrito.
+    Las vencidas tampoco, aunque sigan en reserved_stock hasta barrerse.
+    """
+    released = Q(expires_at__lte=Now())
+    if exclude_user is not None:
+        released |= Q(user_id=exclude_user)
+    return queryset.annotate(available_stock=F('stock') - F('reserved_stock') + _held(released))
+
+
+def available_stock(product_ids, exclude_user=None):
+    """
+    Devuelve {product_id: disponible} con una sola consulta.
+    """
+    queryset = with_available(Product.objects.filter(pk__in=list(product_ids)), exclude_user)
+    return dict(queryset.values_list('pk', 'available_stock'))
+
+
+def _for_update(queryset):
+    # Las filas que otra transacción ya está tocando se dejan para el siguiente barrido
+    if connection.features.has_select_for_update_skip_locked:
+        return queryset.select_for_update(skip_locked=True)
+    return queryset.select_for_update()
+
+
+def _release_holds(queryset):
+    """
+    Elimina las reservas de carrito de `queryset` y las descuenta de
+    reserved_stock. Devuelve el número de reservas eliminadas.
+    """
+    with transaction.atomic():
+        rows = list(_for_update(queryset.filter(user__isnull=False)).values_list('pk', 'product_id', 'quantity'))
+        if not rows:
+            return 0
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+        released = {}
+        for _, product_id, quantity in rows:
+            released[product_id] = released.get(product_id, 0) + quantity
+        Product.objects.filter(pk__in=released).update(
+            reserved_stock=F('reserved_stock') - Case(
+                *[When(pk=pk, then=Value(quantity)) for pk, quantity in released.items()],
+                output_field=IntegerField(),
+            )
+        )
+    return len(rows)
+
+
+def _reserve(product_id, delta):
+    """
+    Suma `delta` a reserved_stock si cabe en el stock. Devuelve si se reservó.
+    """
+    if delta <= 0:
+        Product.objects.filter(pk=product_id).update(reserved_stock=F('reserved_stock') + delta)
+        return True
+    return bool(
+        Product.objects.filter(pk=product_id, stock__gte=F('reserved_stock') + delta)
+        .update(reserved_stock=F('reserved_stock') + delta)
+    )
+
+
+def hold_cart_items(user_id, quantities):
+    """
+    Reserva (o renueva) {product_id: cantidad} del carrito del usuario.
+    Las cantidades 0 liberan la reserva. Lanza InsufficientStock (sin
+    reservar nada) si alguna cantidad no cabe en el stock disponible.
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_SECONDS)
+    product_ids = sorted(quantities)
+    with transaction.atomic():
+        # Crea las reservas que faltan y bloquea las del usuario (nunca las
+        # filas de producto), para que sus peticiones concurrentes vean la
+        # cantidad que ya tiene reservada
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(user_id=user_id, product_id=product_id, quantity=0, expires_at=expires_at)
+                for product_id in product_ids
+                if quantities[product_id] > 0
+            ],
+            ignore_conflicts=True,
+        )
+        held = dict(
+            StockReservation.objects.select_for_update()
+            .filter(user_id=user_id, product_id__in=product_ids).order_by('product_id')
+            .values_list('product_id', 'quantity')
+        )
+
+        for product_id in product_ids:
+            if product_id not in held:
+                continue
+            delta = quantities[product_id] - held[product_id]
+            if _reserve(product_id, delta):
+                continue
+            # Las reservas vencidas siguen contando hasta que se barren
+            release_expired_holds([product_id], exclude_user=user_id)
+            if not _reserve(product_id, delta):
+                available = available_stock([product_id], exclude_user=user_id).get(product_id, 0)
+                raise InsufficientStock(product_id, available)
+
+        released = [product_id for product_id in product_ids if quantities[product_id] <= 0]
+        StockReservation.objects.filter(user_id=user_id, product_id__in=released).delete()
+        for product_id in product_ids:
+            if quantities[product_id] > 0:
+                StockReservation.objects.filter(user_id=user_id, product_id=product_id).update(
+                    quantity=quantities[product_id], expires_at=expires_at
+                )
+
+
+def release_expired_holds(product_ids, exclude_user=None):
+    """
+    Barre ya las reservas de carrito vencidas de `product_ids`.
+    """
+    holds = StockReservation.objects.filter(product_id__in=list(product_ids), expires_at__lte=timezone.now())
+    if exclude_user is not None:
+        holds = holds.exclude(user_id=exclude_user)
+    return _release_holds(holds)
+
+
+def release_cart_items(user_id, product_ids=None):
+    """
+    Libera las reservas del carrito del usuario (todas si no se indican productos).
+    """
+    holds = StockReservation.objects.filter(user_id=user_id)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=list(product_ids))
+    _release_holds(holds)
+
+
+def hold_order(order, quantities):
+    """
+    Sustituye las reservas del carrito del dueño de la orden por reservas
+    de la orden {product_id: cantidad}.
+    """
+    release_cart_items(order.user_id)
+    expires_at = timezone.now() + timedelta(seconds=settings.ORDER_RESERVATION_SECONDS)
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def extend_order_hold(order_id, expires_at):
+    """
+    Amplía las reservas de la orden hasta `expires_at` (nunca las acorta).
+    """
+    StockReservation.objects.filter(order_id=order_id, expires_at__lt=expires_at).update(expires_at=expires_at)
+
+
+def commit_order(order_id):
+    """
+    La orden se pagó: sus reservas ya no son necesarias.
+    """
+    StockReservation.objects.filter(order_id=order_id).delete()
+
+
+def release_expired(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Elimina las reservas vencidas por lotes. Las órdenes aún PENDIENTE
+    cuyas reservas vencieron se cancelan y su stock se devuelve.
+    Devuelve (reservas de carrito liberadas, órdenes canceladas).
+    """
+    now = timezone.now()
+    released = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(user__isnull=False, expires_at__lte=now)
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        batch = _release_holds(StockReservation.objects.filter(pk__in=ids, expires_at__lte=now))
+        if not batch:
+            # Lo que queda lo están renovando otras transacciones
+            break
+        released += batch
+
+    cancelled = 0
+    while True:
+        order_ids = list(
+            StockReservation.objects.filter(order__isnull=False, expires_at__lte=now)
+            .order_by('order_id').values_list('order_id', flat=True).distinct()[:batch_size]
+        )
+        if not order_ids:
+            break
+        cancelled += _release_orders(order_ids, now)
+    return released, cancelled
+
+
+def _release_orders(order_ids, now):
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update().filter(pk__in=order_ids)
+            .order_by('pk').values_list('pk', 'status', 'payment_status')
+        )
+        # Releído con las órdenes bloqueadas: la creación de la sesión de
+        # Stripe puede haber ampliado la reserva desde la primera lectura
+        expired = set(
+            StockReservation.objects.filter(order_id__in=order_ids, expires_at__lte=now)
+            .values_list('order_id', flat=True)
+        )
+        pending = [
+            pk for pk, order_status, payment_status in orders
+            if pk in expired and order_status == 'PENDIENTE' and payment_status != 'pagado'
+        ]
+        restored = dict(
+            StockReservation.objects.filter(order_id__in=pending).order_by()
+            .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        if restored:
+            Product.objects.filter(pk__in=restored).update(
+                stock=F('stock') + Case(
+                    *[When(pk=pk, then=Value(quantity)) for pk, quantity in restored.items()],
+                    output_field=IntegerField(),
+                ),
+                updated_at=Now(),
+            )
+        if pending:
+            # Estado de pago terminal: un pago tardío ya no reactiva la orden
+            Order.objects.filter(pk__in=pending).update(
+                status='CANCELADO', payment_status='expirado', updated_at=Now()
+            )
+        StockReservation.objects.filter(order_id__in=expired).delete()
+    return len(pending)
+
+
+def recount_reserved():
+    """
+    Recalcula Product.reserved_stock a partir de las reservas de carrito.
+    Corrige las desviaciones de borrados en cascada (usuarios eliminados);
+    conviene ejecutarlo con poco tráfico. Devuelve los productos corregidos.
+    """
+    return Product.objects.annotate(held=_held()).exclude(reserved_stock=F('held')).update(reserved_stock=_held())
@@ -1,10 +1,11 @@
 from rest_framework import serializers
+from smartsales_backend.serializers import SparseFieldsMixin
 from .models import Cart, CartItem, Order, OrderItem
 from products.serializers import ProductSerializer
 from products.models import Product
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer para items del carrito
     """
@@ -19,6 +20,7 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'product_id', 'quantity', 'item_price']
+        expandable_fields = ['product']
 
     def get_item_price(self, obj):
         """
@@ -49,9 +51,10 @@ class CartItemSerializer(serializers.ModelSerializer):
         return data
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
-    Serializer para el carrito completo
+    Serializer para el carrito completo.
+    Admite ?fields= y ?expand= (items, items.product).
     """
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -61,21 +64,50 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['id', 'user', 'items', 'total_price', 'items_count', 'created_at', 'updated_at']
         read_only_fields = ['user', 'created_at', 'updated_at']
+        expandable_fields = ['items']
 
     def get_total_price(self, obj):
         """
-        Calcula el precio total del carrito
+        Calcula el precio total del carrito.
+        Usa la anotación `total_price` si el queryset la trae (Cart.objects.with_totals()).
         """
-        return obj.get_total_price()
+        total = getattr(obj, 'total_price', None)
+        if total is None:
+            total = obj.get_total_price()
+        return total
 
     def get_items_count(self, obj):
         """
-        Cuenta el número total de items en el carrito
+        Cuenta el número total de items en el carrito.
+        Usa la anotación `items_count` si el queryset la trae.
         """
-        return obj.items.count()
+        count = getattr(obj, 'items_count', None)
+        if count is None:
+            count = obj.items.count()
+        return count
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class CartOperationSerializer(serializers.Serializer):
+    """
+    Operación de un lote de carrito: `add` suma `quantity` (por defecto 1),
+    `set` fija la cantidad (0 quita el producto) y `remove` lo quita.
+    """
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, data):
+        """
+        `add` exige una cantidad de al menos 1 y `set` exige la cantidad.
+        """
+        if data['op'] == 'add' and data.get('quantity', 1) < 1:
+            raise serializers.ValidationError({'quantity': 'La cantidad debe ser al menos 1'})
+        if data['op'] == 'set' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': 'quantity es requerido para set'})
+        return data
+
+
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer para items de la orden
     """
@@ -85,6 +117,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'quantity', 'price', 'item_price']
+        expandable_fields = ['product']
 
     def get_item_price(self, obj):
         """
@@ -93,9 +126,10 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return obj.get_item_price()
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
-    Serializer para órdenes
+    Serializer para órdenes.
+    Admite ?fields= y ?expand= (items, items.product).
     """
     items = OrderItemSerializer(many=True, read_only=True)
     username = serializers.CharField(source='user.username', read_only=True)
@@ -115,6 +149,34 @@ class OrderSerializer(serializers.ModelSerializer):
             'updated_at'
         ]
         read_only_fields = ['user', 'total_price', 'created_at', 'updated_at']
+        expandable_fields = ['items']
+
+
+class OrderSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Representación compacta de una orden para el historial (listado):
+    cabecera, número de items y miniatura del primer producto, leídos de
+    las anotaciones de Order.objects.with_summary(). Los items completos
+    solo se devuelven en el detalle (OrderSerializer).
+    """
+    items_count = serializers.IntegerField(read_only=True)
+    first_product_name = serializers.CharField(read_only=True, allow_null=True)
+    thumbnail = serializers.CharField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id',
+            'status',
+            'payment_status',
+            'total_price',
+            'items_count',
+            'first_product_name',
+            'thumbnail',
+            'created_at',
+            'updated_at'
+        ]
+        read_only_fields = fields
 
 
 class OrderCreateSerializer(serializers.Serializer):
@@ -123,3 +185,29 @@ class OrderCreateSerializer(serializers.Serializer):
     """
     shipping_address = serializers.CharField(required=False, allow_blank=True)
     shipping_phone = serializers.CharField(max_length=20, required=False, allow_blank=True)
+
+
+class ReceiptExportSerializer(serializers.Serializer):
+    """
+    Selección de órdenes para la exportación de comprobantes: una lista de
+    `ids` o un rango de fechas `date_from` / `date_to` (inclusive).
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False
+    )
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        """
+        Exige exactamente uno de los dos modos y un rango completo y ordenado.
+        """
+        has_range = 'date_from' in data or 'date_to' in data
+        if ('ids' in data) == has_range:
+            raise serializers.ValidationError('Indica ids o un rango date_from / date_to.')
+        if has_range:
+            if 'date_from' not in data or 'date_to' not in data:
+                raise serializers.ValidationError('El rango requiere date_from y date_to.')
+            if data['date_from'] > data['date_to']:
+                raise serializers.ValidationError({'date_to': 'date_to debe ser posterior a date_from.'})
+        return data
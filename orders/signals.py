@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Order
+from .purchases import invalidate_purchased_products
+from .receipts import prerender
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_purchases_on_order_change(sender, instance, **kwargs):
+    """
+    Invalida los productos comprados del usuario cuando cambia una orden
+    (p. ej. al pasar a PAGADO desde el webhook de Stripe).
+    """
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_purchased_products(user_id))
+
+
+@receiver(post_save, sender=Order)
+def prerender_paid_receipt(sender, instance, **kwargs):
+    """
+    Pre-renderiza el comprobante de las órdenes pagadas tras el commit.
+    Un error al renderizar solo se registra en el log.
+    """
+    if instance.status == 'PAGADO':
+        order_id = instance.pk
+        transaction.on_commit(lambda: prerender(order_id), robust=True)
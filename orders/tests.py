@@ -1,3 +1,1179 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import signal
+import tempfile
+import zipfile
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import Future
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products.models import Brand, Category, Product
+from .cart_store import DIRTY_KEY, get_cart_store
+from .loadtest import percentile, run_checkout_load
+from .receipt_pdf import time_limit
+from . import partitioning, receipts, reservations
+from .models import Cart, CartItem, GuestCart, IdempotencyRecord, Order, OrderItem, StockReservation
+from .reservations import available_stock, release_expired
+
+User = get_user_model()
+
+
+class CartReadQueryCountTests(TestCase):
+    """
+    GET /api/cart/ debe costar un número fijo de consultas.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def _add_items(self, count):
+        start = CartItem.objects.filter(cart=self.cart).count()
+        for i in range(start, start + count):
+            product = Product.objects.create(
+                name=f'P{i}',
+                price='2.50',
+                stock=10,
+                category=Category.objects.create(name=f'C{i}'),
+                brand=Brand.objects.create(name=f'B{i}'),
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_independent_of_items(self):
+        self._add_items(1)
+        few, _ = self._count_queries()
+        self._add_items(9)
+        many, data = self._count_queries()
+        self.assertEqual(few, many)
+        # carrito + totales, items con producto, categorías, marcas
+        self.assertLessEqual(many, 4)
+        self.assertEqual(data['items_count'], 10)
+        self.assertEqual(Decimal(str(data['total_price'])), Decimal('50.00'))
+        self.assertEqual(data['items'][0]['product']['category_detail']['products_count'], 1)
+
+    def test_empty_cart_is_created(self):
+        self.cart.delete()
+        _, data = self._count_queries()
+        self.assertEqual(data['items'], [])
+        self.assertEqual(data['items_count'], 0)
+        self.assertEqual(Decimal(str(data['total_price'])), Decimal('0'))
+
+
+@override_settings(CART_BACKEND='redis', CART_REDIS_URL='locmem://')
+class RedisCartStoreTests(TestCase):
+    """
+    Carritos en Redis (sustituto en memoria) con escritura diferida.
+    """
+
+    def setUp(self):
+        cache.clear()
+        get_cart_store().client.flushall()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='P', price='3.00', stock=5, category=category)
+        self.other = Product.objects.create(name='Q', price='1.50', stock=5, category=category)
+
+    def test_mutations_stay_in_store_until_flush(self):
+        self.client.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 2}, format='json')
+        self.client.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 1}, format='json')
+        self.client.post('/api/cart/', {'product_id': self.other.pk, 'quantity': 1}, format='json')
+        self.client.put('/api/cart/', {'item_id': self.other.pk, 'quantity': 4}, format='json')
+        self.assertFalse(CartItem.objects.exists())
+
+        data = self.client.get('/api/cart/').json()
+        self.assertEqual(data['items_count'], 2)
+        self.assertEqual(Decimal(str(data['total_price'])), Decimal('15.00'))
+
+        response = self.client.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        call_command('flush_carts', stdout=StringIO())
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product_id', 'quantity')),
+            {self.product.pk: 3, self.other.pk: 4},
+        )
+
+        self.client.delete('/api/cart/', {'item_id': self.other.pk}, format='json')
+        call_command('flush_carts', stdout=StringIO())
+        self.assertEqual(list(CartItem.objects.values_list('product_id', flat=True)), [self.product.pk])
+
+    def test_checkout_writes_back_and_clears_store(self):
+        self.client.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 2}, format='json')
+        response = self.client.post('/api/orders/create_order_from_cart/', {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.get().items.get().quantity, 2)
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], [])
+
+    def test_flush_keeps_unwritten_carts_dirty(self):
+        other = User.objects.create_user(username='other', password='x')
+        store = get_cart_store()
+        store.set_quantity(self.user.pk, self.product, 1)
+        store.set_quantity(other.pk, self.product, 2)
+
+        real_write_back = store.write_back
+
+        def failing_write_back(user_id):
+            if user_id == self.user.pk:
+                raise RuntimeError('db caída')
+            real_write_back(user_id)
+
+        with mock.patch.object(store, 'write_back', side_effect=failing_write_back), \
+                self.assertLogs('orders.cart_store', 'ERROR'):
+            self.assertEqual(store.flush(), 1)
+        self.assertEqual(store.client.spop(DIRTY_KEY, 10), [str(self.user.pk)])
+
+        with mock.patch.object(store, 'write_back', side_effect=KeyboardInterrupt):
+            store.client.sadd(DIRTY_KEY, self.user.pk, other.pk)
+            with self.assertRaises(KeyboardInterrupt):
+                store.flush()
+        self.assertEqual(set(store.client.spop(DIRTY_KEY, 10)), {str(self.user.pk), str(other.pk)})
+
+    def test_concurrent_adds_are_not_lost(self):
+        store = get_cart_store()
+        store.load(self.user.pk)
+        product = Product.objects.create(name='R', price='1.00', stock=50, category=self.product.category)
+
+        def add():
+            store.add(self.user.pk, product, 1, available=50)
+
+        threads = [threading.Thread(target=add) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.load(self.user.pk)[0], {product.pk: 20})
+
+    def test_rejected_add_keeps_cart_and_reserves_nothing(self):
+        self.client.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 4}, format='json')
+        response = self.client.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Stock insuficiente. Disponible: 5')
+        self.client.put('/api/cart/', {'item_id': self.product.pk, 'quantity': 5}, format='json')
+        self.client.post('/api/cart/batch/', {'operations': [{'op': 'add', 'product_id': self.other.pk}]}, format='json')
+
+        self.assertEqual(get_cart_store().load(self.user.pk)[0], {self.product.pk: 5, self.other.pk: 1})
+        # La reserva se hace al crear la orden
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).reserved_stock, 0)
+
+    @override_settings(CART_REDIS_URL='')
+    def test_missing_url_is_a_configuration_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_cart_store()
+
+
+class CartBatchTests(TestCase):
+    """
+    POST /api/cart/batch/ aplica el lote completo o nada.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='General')
+        self.products = [
+            Product.objects.create(name=f'P{i}', price='2.00', stock=3, category=category)
+            for i in range(4)
+        ]
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[3], quantity=1)
+
+    def _batch(self, operations):
+        return self.client.post('/api/cart/batch/', {'operations': operations}, format='json')
+
+    def _quantities(self):
+        return dict(CartItem.objects.values_list('product_id', 'quantity'))
+
+    def test_applies_operations_in_one_request(self):
+        p0, p1, p2, p3 = (p.pk for p in self.products)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._batch([
+                {'op': 'add', 'product_id': p0, 'quantity': 2},
+                {'op': 'add', 'product_id': p0},
+                {'op': 'set', 'product_id': p1, 'quantity': 2},
+                {'op': 'add', 'product_id': p2},
+                {'op': 'remove', 'product_id': p2},
+                {'op': 'set', 'product_id': p3, 'quantity': 0},
+            ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._quantities(), {p0: 3, p1: 2})
+        self.assertEqual(response.json()['items_count'], 2)
+        product_queries = [
+            q for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT') and 'FROM "products_product"' in q['sql'].split('WHERE')[0]
+        ]
+        # Una consulta de stock para el lote y la del carrito resultante
+        self.assertLessEqual(len(product_queries), 2)
+
+    def test_rejects_whole_batch_on_error(self):
+        p0, p1 = self.products[0].pk, self.products[1].pk
+        response = self._batch([
+            {'op': 'add', 'product_id': p0, 'quantity': 1},
+            {'op': 'set', 'product_id': p1, 'quantity': 4},
+            {'op': 'add', 'product_id': 999999},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 2)
+        self.assertEqual(self._quantities(), {self.products[3].pk: 1})
+
+    @override_settings(CART_BACKEND='redis', CART_REDIS_URL='locmem://')
+    def test_store_backend(self):
+        get_cart_store().client.flushall()
+        p0 = self.products[0].pk
+        response = self._batch([{'op': 'set', 'product_id': p0, 'quantity': 2}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {item['product']['id']: item['quantity'] for item in response.json()['items']},
+            {p0: 2, self.products[3].pk: 1},
+        )
+        # Aún no escrito en la base de datos
+        self.assertEqual(self._quantities(), {self.products[3].pk: 1})
+
+
+class GuestCartTests(TestCase):
+    """
+    Carritos de invitado con token y fusión al iniciar sesión.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='P', price='2.00', stock=5, category=category)
+        self.other = Product.objects.create(name='Q', price='1.00', stock=5, category=category)
+        self.user = User.objects.create_user(username='buyer', password='secret-pass')
+
+    def _guest_add(self, token=None, **quantities):
+        headers = {'HTTP_X_CART_TOKEN': token} if token else {}
+        operations = [
+            {'op': 'add', 'product_id': getattr(self, name).pk, 'quantity': quantity}
+            for name, quantity in quantities.items()
+        ]
+        return self.client.post('/api/cart/guest/', {'operations': operations}, format='json', **headers)
+
+    def test_guest_cart_round_trip(self):
+        response = self._guest_add(product=2)
+        token = response['X-Cart-Token']
+        self.assertEqual(response.json()['token'], token)
+
+        self._guest_add(token, product=1, other=1)
+        data = self.client.get('/api/cart/guest/', HTTP_X_CART_TOKEN=token).json()
+        self.assertEqual(data['items_count'], 2)
+        self.assertEqual(Decimal(str(data['total_price'])), Decimal('7.00'))
+
+        self.assertEqual(self._guest_add(token, product=3).status_code, 400)
+
+    def test_login_merges_guest_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=4)
+        token = self._guest_add(product=3, other=2)['X-Cart-Token']
+
+        response = self.client.post(
+            '/api/token/',
+            {'username': 'buyer', 'password': 'secret-pass'},
+            format='json',
+            HTTP_X_CART_TOKEN=token,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cart_merged_items'], 2)
+        # Las cantidades se suman y se limitan al stock
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product_id', 'quantity')),
+            {self.product.pk: 5, self.other.pk: 2},
+        )
+        self.assertEqual(self.client.get('/api/cart/guest/', HTTP_X_CART_TOKEN=token).json()['items'], [])
+
+    def _login(self, token):
+        return self.client.post(
+            '/api/token/',
+            {'username': 'buyer', 'password': 'secret-pass'},
+            format='json',
+            HTTP_X_CART_TOKEN=token,
+        )
+
+    def test_login_succeeds_when_stock_runs_out_during_merge(self):
+        token = self._guest_add(product=2, other=2)['X-Cart-Token']
+        # Otro comprador se lleva todo `other` entre la lectura y la reserva
+        rival = User.objects.create_user(username='rival', password='x')
+        reservations.hold_cart_items(rival.pk, {self.other.pk: 5})
+        stale = {self.product.pk: 5, self.other.pk: 5}
+        with mock.patch('orders.guest_cart.available_stock', return_value=stale):
+            response = self._login(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        self.assertEqual(response.json()['cart_merged_items'], 1)
+        self.assertEqual(response.json()['cart_skipped_items'], [self.other.pk])
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')), {self.product.pk: 2})
+
+    def test_login_skips_products_that_keep_failing(self):
+        token = self._guest_add(other=2)['X-Cart-Token']
+        error = reservations.InsufficientStock(self.other.pk, 1)
+        with mock.patch('orders.guest_cart.hold_cart_items', side_effect=error):
+            response = self._login(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        self.assertEqual(response.json()['cart_merged_items'], 0)
+        self.assertEqual(response.json()['cart_skipped_items'], [self.other.pk])
+
+    def test_guest_cart_does_not_depend_on_the_cache(self):
+        token = self._guest_add(product=2)['X-Cart-Token']
+        # Otro worker con su propia caché local ve el mismo carrito
+        cache.clear()
+        data = self.client.get('/api/cart/guest/', HTTP_X_CART_TOKEN=token).json()
+        self.assertEqual(data['items_count'], 1)
+
+    def test_expired_guest_carts_are_ignored_and_pruned(self):
+        token = self._guest_add(product=2)['X-Cart-Token']
+        fresh = self._guest_add(other=1)['X-Cart-Token']
+        GuestCart.objects.filter(token=token).update(
+            updated_at=timezone.now() - timedelta(seconds=settings.GUEST_CART_TIMEOUT + 1)
+        )
+        self.assertEqual(self.client.get('/api/cart/guest/', HTTP_X_CART_TOKEN=token).json()['items'], [])
+
+        out = StringIO()
+        call_command('prune_guest_carts', stdout=out)
+        self.assertIn('eliminados: 1', out.getvalue())
+        self.assertEqual(list(GuestCart.objects.values_list('token', flat=True)), [fresh])
+
+
+class StockReservationTests(TestCase):
+    """
+    Reservas temporales de stock de carritos y órdenes pendientes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='P', price='2.00', stock=5, category=category)
+        self.buyer = User.objects.create_user(username='buyer', password='x')
+        self.other = User.objects.create_user(username='other', password='x')
+
+    def _client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def _add(self, user, quantity):
+        return self._client(user).post(
+            '/api/cart/', {'product_id': self.product.pk, 'quantity': quantity}, format='json'
+        )
+
+    def test_cart_holds_reduce_availability_for_others(self):
+        self.assertEqual(self._add(self.buyer, 3).status_code, 201)
+        response = self._add(self.other, 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Disponible: 2', response.json()['error'])
+        # El propio carrito no cuenta contra el comprador
+        self.assertEqual(available_stock([self.product.pk], exclude_user=self.buyer.pk), {self.product.pk: 5})
+
+        # Una reserva vencida cuenta hasta que se barre; si otra no cabe, se barre antes
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self._add(self.other, 3).status_code, 201)
+        self.assertEqual(list(StockReservation.objects.values_list('user_id', flat=True)), [self.other.pk])
+        self._assert_reserved(3)
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired(batch_size=1), (1, 0))
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(available_stock([self.product.pk]), {self.product.pk: 5})
+
+    def _assert_reserved(self, quantity):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, quantity)
+
+    def test_reserved_stock_follows_cart_changes(self):
+        self._add(self.buyer, 2)
+        self._add(self.buyer, 1)
+        self._assert_reserved(3)
+
+        # Un save() completo con la instancia antigua no pisa el contador
+        stale = Product.objects.get(pk=self.product.pk)
+        self._add(self.other, 2)
+        stale.name = 'Renombrado'
+        stale.save()
+        self._assert_reserved(5)
+
+        item = CartItem.objects.get(cart__user=self.buyer)
+        response = self._client(self.buyer).put('/api/cart/', {'item_id': item.pk, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self._assert_reserved(3)
+        self._client(self.other).delete('/api/cart/', {'item_id': CartItem.objects.get(cart__user=self.other).pk}, format='json')
+        self._assert_reserved(1)
+
+        # Al crear la orden la reserva de carrito pasa a la orden
+        self._client(self.buyer).post('/api/orders/create_order_from_cart/', {}, format='json')
+        self._assert_reserved(0)
+        self.assertEqual(self.product.stock, 4)
+
+    def test_expired_pending_order_is_cancelled_and_stock_restored(self):
+        self._add(self.buyer, 2)
+        response = self._client(self.buyer).post('/api/orders/create_order_from_cart/', {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        reservation = StockReservation.objects.get()
+        self.assertEqual((reservation.order_id, reservation.user_id), (response.json()['id'], None))
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(release_expired(), (0, 1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        order = Order.objects.get()
+        self.assertEqual((order.status, order.payment_status), ('CANCELADO', 'expirado'))
+
+    def test_release_rechecks_expiry_and_cancels_failed_payments(self):
+        extended, failed = self._checkout_order(), self._checkout_order()
+        Order.objects.filter(pk=failed.pk).update(payment_status='fallido')
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        release_orders = reservations._release_orders
+
+        def extend_then_release(order_ids, now):
+            # La reserva se amplía después de que el barrido eligió la orden
+            StockReservation.objects.filter(order=extended).update(expires_at=timezone.now() + timedelta(hours=1))
+            return release_orders(order_ids, now)
+
+        with mock.patch('orders.reservations._release_orders', side_effect=extend_then_release):
+            self.assertEqual(release_expired(), (0, 1))
+
+        extended.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual(extended.status, 'PENDIENTE')
+        self.assertTrue(StockReservation.objects.filter(order=extended).exists())
+        self.assertEqual((failed.status, failed.payment_status), ('CANCELADO', 'expirado'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def _checkout_order(self):
+        self._add(self.buyer, 2)
+        response = self._client(self.buyer).post('/api/orders/create_order_from_cart/', {}, format='json')
+        return Order.objects.get(pk=response.json()['id'])
+
+    def _completed_webhook(self, order):
+        event = {
+            'type': 'checkout.session.completed',
+            'data': {'object': {'metadata': {'order_id': str(order.pk)}, 'payment_intent': 'pi_test'}},
+        }
+        with mock.patch('orders.views.stripe.Webhook.construct_event', return_value=event), \
+                mock.patch('orders.views.stripe.Refund.create') as refund:
+            response = APIClient().post('/api/stripe/webhook/', b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return refund
+
+    def test_checkout_session_expires_before_order_hold(self):
+        order = self._checkout_order()
+        session = mock.Mock(id='cs_test', url='https://checkout.test/cs_test')
+        with mock.patch('orders.views.stripe.checkout.Session.create', return_value=session) as create:
+            response = self._client(self.buyer).post(
+                '/api/stripe/create-checkout-session/', {'order_id': order.pk}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        expires_at = create.call_args.kwargs['expires_at']
+        self.assertGreaterEqual(expires_at, timezone.now().timestamp() + 30 * 60 - 5)
+        self.assertLessEqual(expires_at, StockReservation.objects.get(order=order).expires_at.timestamp())
+
+    def test_webhook_pays_pending_order(self):
+        order = self._checkout_order()
+        refund = self._completed_webhook(order)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('PAGADO', 'pagado'))
+        self.assertFalse(StockReservation.objects.exists())
+        refund.assert_not_called()
+
+    def test_late_payment_of_cancelled_order_is_refunded(self):
+        order = self._checkout_order()
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        release_expired()
+
+        refund = self._completed_webhook(order)
+        refund.assert_called_once_with(payment_intent='pi_test', idempotency_key='refund-pi_test')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('CANCELADO', 'reembolsado'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+        # Un evento reenviado no reembolsa otra vez
+        self._completed_webhook(order).assert_not_called()
+
+    def test_successful_retry_after_failed_payment_is_not_refunded(self):
+        order = self._checkout_order()
+        Order.objects.filter(pk=order.pk).update(payment_status='fallido')
+        self._completed_webhook(order).assert_not_called()
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('PAGADO', 'pagado'))
+
+    def _create_session(self, order, session):
+        with mock.patch('orders.views.stripe.checkout.Session.create', return_value=session) as create, \
+                mock.patch('orders.views.stripe.checkout.Session.retrieve', return_value=session):
+            response = self._client(self.buyer).post(
+                '/api/stripe/create-checkout-session/', {'order_id': order.pk}, format='json'
+            )
+        return response, create
+
+    @override_settings(ORDER_MAX_RESERVATION_SECONDS=3600)
+    def test_checkout_session_cannot_hold_stock_indefinitely(self):
+        order = self._checkout_order()
+        session = mock.Mock(id='cs_test', url='https://checkout.test/cs_test', status='open')
+        self.assertEqual(self._create_session(order, session)[0].status_code, 200)
+        hold = StockReservation.objects.get(order=order).expires_at
+
+        # Con la sesión abierta se devuelve la misma, sin ampliar la reserva
+        response, create = self._create_session(order, session)
+        self.assertEqual(response.json(), {'url': 'https://checkout.test/cs_test'})
+        create.assert_not_called()
+        self.assertEqual(StockReservation.objects.get(order=order).expires_at, hold)
+
+        # Vencida la sesión, una nueva no puede pasar del máximo desde la creación
+        session.status = 'expired'
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(minutes=30))
+        response, create = self._create_session(order, session)
+        self.assertEqual(response.status_code, 409)
+        create.assert_not_called()
+        self.assertEqual(StockReservation.objects.get(order=order).expires_at, hold)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+@skipUnless(connection.vendor == 'postgresql', 'SQLite serializa las escrituras: no hay checkouts concurrentes')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Checkouts concurrentes del mismo producto: nunca se vende más que el stock.
+    """
+    buyers = 20
+    stock = 7
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='Hot', price='5.00', stock=self.stock, category=category)
+        self.users = []
+        for i in range(self.buyers):
+            user = User.objects.create_user(username=f'buyer{i}', password='x')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.users.append(user)
+
+    def _checkout(self, user, barrier, results):
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            barrier.wait()
+            response = client.post('/api/orders/create_order_from_cart/', {}, format='json')
+            results.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_no_oversell(self):
+        barrier = threading.Barrier(self.buyers)
+        results = []
+        threads = [
+            threading.Thread(target=self._checkout, args=(user, barrier, results))
+            for user in self.users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=self.product).aggregate(total=Sum('quantity'))['total']
+        self.assertEqual(results.count(201), self.stock)
+        self.assertEqual(results.count(400), self.buyers - self.stock)
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(sold, self.stock)
+
+
+class OrderHistoryTests(TestCase):
+    """
+    Historial de órdenes: listado compacto paginado y detalle con items.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='General')
+        self.products = [
+            Product.objects.create(
+                name=f'P{i}', price='10.00', stock=10, category=category, image=f'image/upload/v1/p{i}.jpg'
+            )
+            for i in range(3)
+        ]
+
+    def _create_orders(self, count, user=None):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(user=user or self.user, total_price='30.00')
+            # Como en el checkout: los items llevan la fecha de su orden
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order, product=product, quantity=1, price=product.price, created_at=order.created_at,
+                )
+                for product in self.products
+            ])
+            orders.append(order)
+        return orders
+
+    def test_list_is_compact(self):
+        order = self._create_orders(1)[0]
+        self._create_orders(1, user=User.objects.create_user(username='other', password='x'))
+
+        response = self.client.get('/api/orders/')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['id'], order.id)
+        self.assertNotIn('items', results[0])
+        self.assertEqual(results[0]['items_count'], 3)
+        self.assertEqual(results[0]['first_product_name'], 'P0')
+        self.assertEqual(results[0]['thumbnail'], 'image/upload/v1/p0.jpg')
+
+    def test_list_query_count_is_constant(self):
+        self._create_orders(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/api/orders/')
+        self._create_orders(8)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get('/api/orders/')
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(len(few), len(many))
+
+    def test_items_are_joined_by_order_not_date(self):
+        order = self._create_orders(1)[0]
+        # Un item con fecha propia (bulk_create / update sin copiar la de la orden)
+        OrderItem.objects.filter(order=order).update(created_at=order.created_at + timedelta(seconds=5))
+        results = self.client.get('/api/orders/').json()['results']
+        self.assertEqual(results[0]['items_count'], 3)
+        response = self.client.get(f'/api/orders/{order.id}/')
+        self.assertEqual(len(response.json()['items']), 3)
+
+    def test_retrieve_includes_items(self):
+        order = self._create_orders(1)[0]
+        response = self.client.get(f'/api/orders/{order.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['product']['name'] for item in response.json()['items']], ['P0', 'P1', 'P2'])
+
+    def test_pagination_by_created_at_and_id(self):
+        orders = self._create_orders(5)
+        # Misma fecha: el id desempata
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(created_at=timezone.now())
+
+        seen = []
+        url = '/api/orders/?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            seen.extend(result['id'] for result in page['results'])
+            url = page['next']
+        self.assertEqual(seen, sorted((order.id for order in orders), reverse=True))
+
+
+class OrderArchiveTests(TestCase):
+    """
+    Archivado de meses antiguos de órdenes (con y sin particiones).
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='P', price='10.00', stock=10, category=category)
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: [os.remove(os.path.join(self.archive_dir, name)) for name in os.listdir(self.archive_dir)])
+        self.current = partitioning.month_start(timezone.now())
+
+    def _create_order(self, months_ago):
+        created_at = partitioning.add_months(self.current, -months_ago) + timedelta(days=3)
+        order = Order.objects.create(user=self.user, total_price='10.00')
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price='10.00')
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        OrderItem.objects.filter(order=order).update(created_at=created_at)
+        return order
+
+    def _read(self, name):
+        with gzip.open(os.path.join(self.archive_dir, f'{name}.csv.gz'), 'rt', newline='') as archive:
+            return list(csv.DictReader(archive))
+
+    def test_archive_without_partitions(self):
+        old, recent = self._create_order(14), self._create_order(1)
+
+        call_command(
+            'partition_orders', 'archive', older_than_months=12, archive_dir=self.archive_dir, stdout=StringIO()
+        )
+
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [recent.pk])
+        month = partitioning.add_months(self.current, -14)
+        orders = self._read(partitioning.partition_name('orders_order', month))
+        items = self._read(partitioning.partition_name('orders_orderitem', month))
+        self.assertEqual([row['id'] for row in orders], [str(old.pk)])
+        self.assertEqual([row['order_id'] for row in items], [str(old.pk)])
+
+    def test_checkout_copies_order_date_to_items(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/orders/create_order_from_cart/', {}, format='json')
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertEqual(list(order.items.values_list('created_at', flat=True)), [order.created_at])
+
+        item = OrderItem.objects.create(order=order, product=self.product, quantity=1, price='10.00')
+        self.assertEqual(item.created_at, order.created_at)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Particionado solo en PostgreSQL')
+    def test_convert_prune_and_archive_partitions(self):
+        old, recent = self._create_order(14), self._create_order(0)
+
+        # Las FK solo se eliminan al convertir
+        self.assertTrue(OrderItem._meta.get_field('order').db_constraint)
+        converted, dropped = partitioning.convert_tables(months_ahead=2)
+        self.assertEqual(converted, ['orders_order', 'orders_orderitem'])
+        self.assertEqual({name.split('.')[0] for name in dropped}, {'orders_orderitem', 'orders_stockreservation'})
+        self.assertTrue(partitioning.is_partitioned('orders_order'))
+        partitions = partitioning.describe()['orders_order']
+        self.assertEqual(len(partitions), 17)
+        self.assertEqual(partitioning.ensure_partitions(months_ahead=3), [
+            partitioning.partition_name(table, partitioning.add_months(self.current, 3))
+            for table in partitioning.TABLES
+        ])
+
+        # El ORM sigue funcionando: ids nuevos, items y borrado en cascada
+        order = Order.objects.create(user=self.user, total_price='10.00')
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price='10.00')
+        self.assertGreater(order.pk, recent.pk)
+        self.assertEqual(Order.objects.with_summary().get(pk=order.pk).items_count, 1)
+
+        # Las consultas por mes reciente solo leen esa partición
+        queryset = Order.objects.filter(user=self.user, created_at__gte=self.current)
+        plan = queryset.explain()
+        self.assertIn(partitioning.partition_name('orders_order', self.current), plan)
+        self.assertNotIn(partitioning.partition_name('orders_order', partitioning.add_months(self.current, -14)), plan)
+        # Los items del detalle se filtran por la fecha de su orden
+        plan = OrderItem.objects.filter(order=order, created_at=order.created_at).explain()
+        self.assertNotIn(partitioning.partition_name('orders_orderitem', partitioning.add_months(self.current, -14)), plan)
+
+        archived = partitioning.archive_before(partitioning.add_months(self.current, -12), self.archive_dir)
+        # Los meses -14 y -13 (vacío) de ambas tablas
+        self.assertEqual(len(archived), 4)
+        self.assertEqual(partitioning.describe()['orders_order'][0], partitioning.partition_name(
+            'orders_order', partitioning.add_months(self.current, -12)
+        ))
+        self.assertFalse(Order.objects.filter(pk=old.pk).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id=old.pk).exists())
+        self.assertTrue(Order.objects.filter(pk=recent.pk).exists())
+        month = partitioning.add_months(self.current, -14)
+        orders = self._read(partitioning.partition_name('orders_order', month))
+        self.assertEqual([row['id'] for row in orders], [str(old.pk)])
+
+        order.delete()
+        self.assertFalse(OrderItem.objects.filter(order_id=order.pk).exists())
+
+        # Filas en DEFAULT de un mes sin partición: ensure las mueve
+        future = partitioning.add_months(self.current, 6)
+        order = Order.objects.create(user=self.user, total_price='10.00')
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price='10.00')
+        Order.objects.filter(pk=order.pk).update(created_at=future + timedelta(days=1))
+        OrderItem.objects.filter(order=order).update(created_at=future + timedelta(days=1))
+        created = partitioning.ensure_partitions(months_ahead=6)
+        self.assertIn(partitioning.partition_name('orders_order', future), created)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {partitioning.partition_name("orders_order", future)}')
+            self.assertEqual(cursor.fetchall(), [(order.pk,)])
+            cursor.execute('SELECT COUNT(*) FROM orders_orderitem_default')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(Order.objects.with_summary().get(pk=order.pk).items_count, 1)
+
+
+class _InlinePool:
+    """
+    Sustituto del pool de procesos que ejecuta la tarea en el acto.
+    """
+
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class OrderReceiptTests(TestCase):
+    """
+    Comprobantes cacheados por (orden, updated_at) y PDF en segundo plano.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='General')
+        product = Product.objects.create(name='Monitor', price='100.00', stock=5, category=category)
+        self.order = Order.objects.create(user=self.user, total_price='100.00')
+        OrderItem.objects.create(order=self.order, product=product, quantity=1, price='100.00')
+        self.url = f'/api/receipt/{self.order.id}/'
+
+    def test_cached_receipt_costs_one_query(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Monitor', first.content.decode())
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(len(queries), 1)
+
+    def test_order_change_renders_new_version(self):
+        self.client.get(self.url)
+        self.order.shipping_address = 'Av. Siempre Viva 742'
+        self.order.save()
+        self.assertIn('Av. Siempre Viva 742', self.client.get(self.url).content.decode())
+
+    def test_permissions(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', password='x'))
+        self.assertEqual(other.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get('/api/receipt/999999/').status_code, 404)
+
+    def test_paid_order_is_prerendered(self):
+        with mock.patch('orders.receipts.pdf_available', return_value=False), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'PAGADO'
+            self.order.save()
+        self.order.refresh_from_db()
+        self.assertIsNotNone(cache.get(receipts.receipt_key(self.order.id, self.order.updated_at)))
+
+    def test_pdf_unavailable(self):
+        with mock.patch('orders.receipts.pdf_available', return_value=False):
+            response = self.client.get(f'{self.url}pdf/')
+        self.assertEqual(response.status_code, 501)
+
+    def test_pdf_rendered_in_pool(self):
+        with mock.patch('orders.receipts.pdf_available', return_value=True), \
+                mock.patch('orders.receipts._process_pool', return_value=_InlinePool()), \
+                mock.patch('orders.receipts.html_to_pdf', return_value=b'%PDF-1.4 receipt') as render:
+            pending = self.client.get(f'{self.url}pdf/')
+            ready = self.client.get(f'{self.url}pdf/')
+        self.assertEqual(pending.status_code, 202)
+        self.assertEqual(ready.status_code, 200)
+        self.assertEqual(ready['Content-Type'], 'application/pdf')
+        self.assertEqual(ready.content, b'%PDF-1.4 receipt')
+        self.assertEqual(render.call_count, 1)
+
+    def test_failed_pdf_is_reported_without_requeueing(self):
+        with mock.patch('orders.receipts.pdf_available', return_value=True), \
+                mock.patch('orders.receipts._process_pool', return_value=_InlinePool()), \
+                mock.patch('orders.receipts.html_to_pdf', side_effect=ValueError('boom')) as render, \
+                self.assertLogs('orders.receipts', 'ERROR'):
+            first = self.client.get(f'{self.url}pdf/')
+            second = self.client.get(f'{self.url}pdf/')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 503)
+        self.assertEqual(second['Retry-After'], str(settings.RECEIPT_PDF_RETRY_SECONDS))
+        self.assertEqual(render.call_count, 1)
+
+    def test_hung_pdf_render_times_out(self):
+        pool = mock.Mock()
+        with mock.patch('orders.receipts.pdf_available', return_value=True), \
+                mock.patch('orders.receipts._process_pool', return_value=pool):
+            self.assertEqual(self.client.get(f'{self.url}pdf/').status_code, 202)
+            self.assertEqual(pool.submit.call_args.args[2], settings.RECEIPT_PDF_TIMEOUT)
+            self.assertEqual(self.client.get(f'{self.url}pdf/').status_code, 202)
+            with mock.patch('orders.receipts.time.time', return_value=time.time() + settings.RECEIPT_PDF_TIMEOUT + 1):
+                self.assertEqual(self.client.get(f'{self.url}pdf/').status_code, 503)
+            self.assertEqual(self.client.get(f'{self.url}pdf/').status_code, 503)
+        self.assertEqual(pool.submit.call_count, 1)
+
+    @skipUnless(hasattr(signal, 'setitimer'), 'requiere SIGALRM')
+    def test_time_limit_interrupts_render(self):
+        with self.assertRaises(TimeoutError):
+            with time_limit(0.05):
+                while True:
+                    pass
+
+
+class ReceiptExportTests(TestCase):
+    """
+    Exportación masiva de comprobantes en un ZIP en streaming (solo staff).
+    """
+    url = '/api/receipt/export/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='staff', password='x', is_staff=True))
+        self.buyer = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(name='General')
+        brand = Brand.objects.create(name='Acme')
+        self.product = Product.objects.create(name='Monitor', price='100.00', stock=5, category=category, brand=brand)
+
+    def _create_orders(self, count):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(user=self.buyer, total_price='100.00')
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price='100.00')
+            orders.append(order)
+        return orders
+
+    def _export(self, data):
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        chunks = list(response.streaming_content)
+        return zipfile.ZipFile(BytesIO(b''.join(chunks))), chunks
+
+    def test_export_by_ids(self):
+        orders = self._create_orders(3)
+        archive, chunks = self._export({'ids': [orders[2].id, orders[0].id]})
+        self.assertEqual(archive.namelist(), [f'comprobante-{orders[0].id}.html', f'comprobante-{orders[2].id}.html'])
+        self.assertIn('Monitor', archive.read(f'comprobante-{orders[0].id}.html').decode())
+        self.assertGreater(len(chunks), 1)
+
+    def test_export_by_date_range(self):
+        old, recent = self._create_orders(2)
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=40))
+        today = timezone.localdate()
+        archive, _ = self._export({'date_from': str(today - timedelta(days=1)), 'date_to': str(today)})
+        self.assertEqual(archive.namelist(), [f'comprobante-{recent.id}.html'])
+
+    @override_settings(RECEIPT_EXPORT_BATCH_SIZE=50)
+    def test_query_count_is_constant_and_cache_is_reused(self):
+        ids = [order.id for order in self._create_orders(3)]
+        with CaptureQueriesContext(connection) as few:
+            self._export({'ids': ids})
+        self._create_orders(10)
+        cache.clear()
+        ids = list(Order.objects.values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as many:
+            archive, _ = self._export({'ids': ids})
+        self.assertEqual(len(archive.namelist()), 13)
+        self.assertEqual(len(few), len(many))
+
+        # Con todo cacheado solo queda la consulta de selección
+        with CaptureQueriesContext(connection) as cached:
+            self._export({'ids': ids})
+        self.assertEqual(len(cached), 1)
+
+    @override_settings(RECEIPT_EXPORT_BATCH_SIZE=2)
+    def test_small_batches(self):
+        orders = self._create_orders(5)
+        archive, _ = self._export({'ids': [order.id for order in orders]})
+        self.assertEqual(len(archive.namelist()), 5)
+        self.assertIsNone(archive.testzip())
+
+    def test_validation_and_permissions(self):
+        self.assertEqual(self.client.post(self.url, {}, format='json').status_code, 400)
+        both = {'ids': [1], 'date_from': '2024-01-01', 'date_to': '2024-01-31'}
+        self.assertEqual(self.client.post(self.url, both, format='json').status_code, 400)
+        reversed_range = {'date_from': '2024-02-01', 'date_to': '2024-01-01'}
+        self.assertEqual(self.client.post(self.url, reversed_range, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'ids': [999999]}, format='json').status_code, 404)
+        with override_settings(RECEIPT_EXPORT_MAX_ORDERS=1):
+            ids = [order.id for order in self._create_orders(2)]
+            self.assertEqual(self.client.post(self.url, {'ids': ids}, format='json').status_code, 400)
+
+        customer = APIClient()
+        customer.force_authenticate(self.buyer)
+        self.assertEqual(customer.post(self.url, {'ids': [1]}, format='json').status_code, 403)
+
+
+class CheckoutLoadTestTests(TransactionTestCase):
+    """
+    Banco de carga de checkouts: reporte y conservación del stock.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_percentile(self):
+        values = [0.1 * i for i in range(1, 101)]
+        self.assertAlmostEqual(percentile(values, 0.50), 5.0)
+        self.assertAlmostEqual(percentile(values, 0.99), 9.9)
+        self.assertEqual(percentile([], 0.95), 0.0)
+
+    def test_sequential_run_conserves_stock(self):
+        report = run_checkout_load(buyers=6, stock=4, workers=1)
+
+        cart, checkout = report['phases']
+        self.assertEqual(cart['outcomes'], {'added': 4, 'http_400': 2})
+        self.assertEqual(checkout['outcomes'], {'ordered': 4})
+        self.assertEqual((report['final_stock'], report['units_sold']), (0, 4))
+        # Los datos sembrados se eliminan al terminar
+        self.assertFalse(Product.objects.filter(name__startswith='Loadtest').exists())
+        self.assertFalse(User.objects.filter(username__startswith='loadtest_').exists())
+
+    def test_command_json_report(self):
+        out = StringIO()
+        call_command('loadtest_checkout', buyers=3, stock=5, quantity=2, workers=1, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['units_sold'], 4)
+        self.assertEqual(report['final_stock'], 1)
+        self.assertEqual([phase['phase'] for phase in report['phases']], ['cart', 'checkout'])
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_cart_holds_never_exceed_stock(self):
+        report = run_checkout_load(buyers=30, stock=8, workers=10)
+
+        cart, checkout = report['phases']
+        self.assertEqual(cart['outcomes'].get('added'), 8)
+        self.assertEqual(checkout['outcomes'], {'ordered': 8})
+        self.assertEqual(report['final_stock'], 0)
+
+
+class IdempotencyKeyTests(TestCase):
+    """
+    Reintentos con Idempotency-Key: se repite la respuesta sin repetir el trabajo.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='P', price='4.00', stock=10, category=category)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+
+    def _create_order(self, key, **data):
+        return self.client.post(
+            '/api/orders/create_order_from_cart/', data, format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_order_creation(self):
+        first = self._create_order('key-1', shipping_phone='123')
+        second = self._create_order('key-1', shipping_phone='123')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+        self.assertEqual(self._create_order('key-1', shipping_phone='999').status_code, 422)
+
+    def test_leftover_in_progress_record_is_replaced(self):
+        # Registro "en curso" confirmado por una versión anterior: nadie lo ejecuta
+        IdempotencyRecord.objects.create(
+            user=self.user,
+            scope='orders.create_order_from_cart',
+            key='busy',
+            fingerprint='x',
+        )
+        with mock.patch('orders.idempotency.request_fingerprint', return_value='x'):
+            self.assertEqual(self._create_order('busy').status_code, 201)
+        self.assertEqual(IdempotencyRecord.objects.get().status_code, 201)
+
+    def test_exception_rolls_back_record_and_work(self):
+        with mock.patch('orders.views.OrderViewSet.get_serializer', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self._create_order('key-1')
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+        self.assertEqual(self._create_order('key-1').status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_checkout_session_is_created_once(self):
+        order = Order.objects.create(user=self.user, total_price='8.00')
+        session = mock.Mock(id='cs_test', url='https://checkout.test/cs_test')
+        with mock.patch('orders.views.stripe.checkout.Session.create', return_value=session) as create:
+            for _ in range(3):
+                response = self.client.post(
+                    '/api/stripe/create-checkout-session/',
+                    {'order_id': order.pk},
+                    format='json',
+                    HTTP_IDEMPOTENCY_KEY='checkout-1',
+                )
+                self.assertEqual(response.json(), {'url': 'https://checkout.test/cs_test'})
+        self.assertEqual(create.call_count, 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Los reintentos esperan al INSERT en curso solo en PostgreSQL')
+@override_settings(IDEMPOTENCY_LOCK_SECONDS=1)
+class IdempotencyInFlightTests(TransactionTestCase):
+    """
+    Una petición en curso no se vuelve a ejecutar aunque tarde, y si su
+    proceso muere la clave queda libre sin dejar nada a medias.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(name='General')
+        product = Product.objects.create(name='P', price='4.00', stock=10, category=category)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+    def _create_order(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('orders.idempotency.request_fingerprint', return_value='x'):
+            return client.post(
+                '/api/orders/create_order_from_cart/', {}, format='json', HTTP_IDEMPOTENCY_KEY='slow'
+            )
+
+    def test_retry_waits_for_the_original_and_never_takes_it_over(self):
+        inserted, release = threading.Event(), threading.Event()
+
+        def original():
+            # Petición original sin confirmar que acaba muriendo
+            try:
+                with transaction.atomic():
+                    IdempotencyRecord.objects.create(
+                        user=self.user, scope='orders.create_order_from_cart', key='slow', fingerprint='x'
+                    )
+                    inserted.set()
+                    release.wait(10)
+                    raise RuntimeError('proceso muerto')
+            except RuntimeError:
+                pass
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=original)
+        thread.start()
+        try:
+            self.assertTrue(inserted.wait(10))
+            self.assertEqual(self._create_order().status_code, 409)
+            self.assertFalse(Order.objects.exists())
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertEqual(self._create_order().status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
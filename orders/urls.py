@@ -1,14 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CartView, OrderViewSet, CreateCheckoutSessionView, StripeWebhookView, OrderReceiptView
+from .views import CartView, CartBatchView, CartMergeView, GuestCartView, OrderViewSet, CreateCheckoutSessionView, StripeWebhookView, OrderReceiptView, ReceiptExportView
 
 router = DefaultRouter()
 router.register(r'orders', OrderViewSet, basename='order')
 
 urlpatterns = [
     path('cart/', CartView.as_view(), name='cart'),
+    path('cart/batch/', CartBatchView.as_view(), name='cart-batch'),
+    path('cart/guest/', GuestCartView.as_view(), name='cart-guest'),
+    path('cart/merge/', CartMergeView.as_view(), name='cart-merge'),
     path('stripe/create-checkout-session/', CreateCheckoutSessionView.as_view(), name='create-checkout-session'),
     path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
+    path('receipt/export/', ReceiptExportView.as_view(), name='order-receipt-export'),
     path('receipt/<int:order_id>/', OrderReceiptView.as_view(), name='order-receipt-api'),
+    path('receipt/<int:order_id>/pdf/', OrderReceiptView.as_view(), {'fmt': 'pdf'}, name='order-receipt-pdf-api'),
     path('', include(router.urls)),
 ]
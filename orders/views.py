@@ -2,42 +2,135 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
-from django.db import transaction
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.shortcuts import render, get_object_or_404
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, HttpResponseForbidden, Http404
-from django.template.loader import render_to_string
+from django.http import HttpResponse, HttpResponseForbidden, Http404, StreamingHttpResponse
 from django.conf import settings
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 import stripe
 import logging
-
-from .models import Cart, CartItem, Order, OrderItem
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from .cart_batch import apply_cart_batch, apply_operations, load_products
+from .cart_store import get_cart_store
+from . import receipts
+from .checkout import CheckoutError, create_order_from_cart
+from .idempotency import idempotent
+from .receipt_export import stream_receipts_zip
+from .guest_cart import (
+    GUEST_CART_HEADER,
+    delete_guest_cart,
+    get_guest_cart,
+    get_token,
+    merge_guest_cart,
+    new_token,
+    save_guest_cart,
+)
+from .models import Cart, CartItem, Order, items_prefetch
+from .reservations import (
+    InsufficientStock,
+    available_stock,
+    commit_order,
+    extend_order_hold,
+    hold_cart_items,
+    release_cart_items,
+    with_available,
+)
 from .serializers import (
     CartSerializer,
     CartItemSerializer,
+    CartOperationSerializer,
     OrderSerializer,
-    OrderCreateSerializer
+    OrderCreateSerializer,
+    OrderSummarySerializer,
+    ReceiptExportSerializer
 )
 from products.models import Product
+from smartsales_backend.conditional import ConditionalGetMixin
+from smartsales_backend.pagination import KeysetPagination
+from smartsales_backend.serializers import is_field_requested
 
 logger = logging.getLogger(__name__)
 
 
+def cart_data(request):
+    """
+    Serializa el carrito del usuario (base de datos o CartStore) con un
+    número fijo de consultas.
+    """
+    store = get_cart_store()
+    if store is not None:
+        cart = store.get_cart(request.user.id)
+    else:
+        queryset = Cart.objects.with_totals().filter(user=request.user)
+        if is_field_requested(request, 'items', expandable=True):
+            queryset = queryset.with_items()
+        cart = queryset.first()
+        if cart is None:
+            Cart.objects.get_or_create(user=request.user)
+            cart = queryset.get()
+    return CartSerializer(cart, context={'request': request}).data
+
+
+def validated_operations(request, max_operations):
+    """
+    Valida la lista `operations` del cuerpo. Devuelve (operaciones, None) o
+    (None, respuesta de error).
+    """
+    operations = request.data.get('operations') if isinstance(request.data, dict) else None
+    if not isinstance(operations, list):
+        return None, Response(
+            {'error': 'operations es requerido y debe ser una lista'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(operations) > max_operations:
+        return None, Response(
+            {'error': f'Máximo {max_operations} operaciones por petición.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    serializer = CartOperationSerializer(data=operations, many=True)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data, None
+
+
+def guest_cart_data(token, quantities):
+    """
+    Serializa un carrito de invitado {product_id: cantidad}.
+    """
+    products = Product.objects.with_catalog_details().in_bulk(list(quantities))
+    lines = [
+        CartItem(id=product_id, product=products[product_id], quantity=quantity)
+        for product_id, quantity in sorted(quantities.items())
+        if product_id in products
+    ]
+    return {
+        'token': token,
+        'items': CartItemSerializer(lines, many=True).data,
+        'total_price': sum((line.get_item_price() for line in lines), Decimal('0.00')),
+        'items_count': len(lines),
+    }
+
+
 class CartView(APIView):
     """
-    Vista para gestionar el carrito de compras del usuario
+    Vista para gestionar el carrito de compras del usuario.
+    Con CART_BACKEND='redis' el carrito vive en Redis (ver orders/cart_store.py),
+    el `item_id` de PUT/DELETE es el id del producto y el stock no se
+    reserva hasta crear la orden.
     """
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
         """
-        Obtiene o crea el carrito del usuario autenticado
+        Obtiene o crea el carrito del usuario autenticado.
+        Totales e items se leen con un número fijo de consultas.
         """
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return Response(cart_data(request))
 
     def post(self, request):
         """
@@ -53,41 +146,59 @@ class CartView(APIView):
             )
 
         try:
-            product = Product.objects.get(id=product_id)
+            product = with_available(Product.objects.all(), exclude_user=request.user.id).get(id=product_id)
         except Product.DoesNotExist:
             return Response(
                 {'error': 'Producto no encontrado'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Validar stock
-        if quantity > product.stock:
+        # Validar stock (descontando lo reservado en otros carritos)
+        available = product.available_stock
+        if quantity > available:
             return Response(
-                {'error': f'Stock insuficiente. Disponible: {product.stock}'},
+                {'error': f'Stock insuficiente. Disponible: {available}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Obtener o crear el carrito
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-
-        # Verificar si el producto ya está en el carrito
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
+        store = get_cart_store()
+        if store is not None:
+            # HINCRBY atómico y sin reserva: en modo redis se reserva al crear la orden
+            try:
+                cart_item = store.add(request.user.id, product, quantity, available)
+            except InsufficientStock as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            serializer = CartItemSerializer(cart_item)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if not created:
-            # Si ya existe, actualizar la cantidad
-            new_quantity = cart_item.quantity + quantity
-            if new_quantity > product.stock:
-                return Response(
-                    {'error': f'Stock insuficiente. Disponible: {product.stock}'},
-                    status=status.HTTP_400_BAD_REQUEST
+        try:
+            with transaction.atomic():
+                # Obtener o crear el carrito
+                cart, _ = Cart.objects.get_or_create(user=request.user)
+
+                # Verificar si el producto ya está en el carrito
+                cart_item, created = CartItem.objects.get_or_create(
+                    cart=cart,
+                    product=product,
+                    defaults={'quantity': quantity}
                 )
-            cart_item.quantity = new_quantity
-            cart_item.save()
 
+                if not created:
+                    # Si ya existe, actualizar la cantidad
+                    new_quantity = cart_item.quantity + quantity
+                    if new_quantity > available:
+                        return Response(
+                            {'error': f'Stock insuficiente. Disponible: {available}'},
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
+                    cart_item.quantity = new_quantity
+                    cart_item.save()
+
+                # Reserva condicional: la comprobación definitiva frente a
+                # carritos concurrentes; si no cabe se revierte el item
+                hold_cart_items(request.user.id, {product.pk: cart_item.quantity})
+        except InsufficientStock as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = CartItemSerializer(cart_item)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -104,11 +215,15 @@ class CartView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        store = get_cart_store()
         try:
-            cart_item = CartItem.objects.get(
-                id=item_id,
-                cart__user=request.user
-            )
+            if store is not None:
+                cart_item = self._get_stored_item(store, request.user.id, item_id)
+            else:
+                cart_item = CartItem.objects.get(
+                    id=item_id,
+                    cart__user=request.user
+                )
         except CartItem.DoesNotExist:
             return Response(
                 {'error': 'Item no encontrado en tu carrito'},
@@ -122,15 +237,25 @@ class CartView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Validar stock
-        if quantity > cart_item.product.stock:
+        # Validar stock (descontando lo reservado en otros carritos)
+        available = available_stock([cart_item.product_id], exclude_user=request.user.id).get(cart_item.product_id, 0)
+        if quantity > available:
             return Response(
-                {'error': f'Stock insuficiente. Disponible: {cart_item.product.stock}'},
+                {'error': f'Stock insuficiente. Disponible: {available}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        cart_item.quantity = quantity
-        cart_item.save()
+        if store is not None:
+            # Sin reserva: en modo redis se reserva al crear la orden
+            cart_item = store.set_quantity(request.user.id, cart_item.product, quantity)
+        else:
+            try:
+                with transaction.atomic():
+                    hold_cart_items(request.user.id, {cart_item.product_id: quantity})
+                    cart_item.quantity = quantity
+                    cart_item.save()
+            except InsufficientStock as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         serializer = CartItemSerializer(cart_item)
         return Response(serializer.data)
@@ -147,105 +272,220 @@ class CartView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        store = get_cart_store()
         try:
-            cart_item = CartItem.objects.get(
-                id=item_id,
-                cart__user=request.user
-            )
-            cart_item.delete()
+            if store is not None:
+                if not store.remove(request.user.id, int(item_id)):
+                    raise CartItem.DoesNotExist
+            else:
+                cart_item = CartItem.objects.get(
+                    id=item_id,
+                    cart__user=request.user
+                )
+                cart_item.delete()
+                release_cart_items(request.user.id, [cart_item.product_id])
             return Response(
                 {'message': 'Item eliminado del carrito'},
                 status=status.HTTP_204_NO_CONTENT
             )
-        except CartItem.DoesNotExist:
+        except (CartItem.DoesNotExist, ValueError, TypeError):
             return Response(
                 {'error': 'Item no encontrado en tu carrito'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
+    @staticmethod
+    def _get_stored_item(store, user_id, item_id):
+        """
+        Devuelve el CartItem (no guardado) del carrito en Redis cuyo id de
+        producto es `item_id`.
+        """
+        try:
+            product_id = int(item_id)
+        except (TypeError, ValueError):
+            raise CartItem.DoesNotExist
+        items, _ = store.load(user_id)
+        if product_id not in items:
+            raise CartItem.DoesNotExist
+        product = Product.objects.filter(pk=product_id).first()
+        if product is None:
+            raise CartItem.DoesNotExist
+        return CartItem(id=product_id, product=product, quantity=items[product_id])
+
+
+class CartBatchView(APIView):
+    """
+    Aplica varias operaciones al carrito en una sola petición y transacción.
+    POST /api/cart/batch/
+    Cuerpo: {"operations": [{"op": "add", "product_id": 1, "quantity": 2},
+                            {"op": "set", "product_id": 2, "quantity": 1},
+                            {"op": "remove", "product_id": 3}]}
+    Devuelve el carrito actualizado; si alguna operación es inválida no se
+    aplica ninguna y se reportan en `errors`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_operations = 500
+
+    def post(self, request):
+        operations, error = validated_operations(request, self.max_operations)
+        if error is not None:
+            return error
+
+        errors = apply_cart_batch(request.user, operations, store=get_cart_store())
+        if errors:
+            return Response(
+                {'error': 'No se aplicó ninguna operación', 'errors': errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(cart_data(request))
+
+
+class GuestCartView(APIView):
+    """
+    Carrito de invitado identificado por la cabecera X-Cart-Token.
+    GET: contenido del carrito.
+    POST: aplica un lote de operaciones (mismo formato que /api/cart/batch/);
+    si no se envía token se crea uno y se devuelve en `token` y en la cabecera.
+    DELETE: descarta el carrito.
+    Al iniciar sesión con la cabecera el carrito se fusiona con el del usuario.
+    """
+    permission_classes = [permissions.AllowAny]
+    max_operations = 500
+
+    def get(self, request):
+        token = get_token(request)
+        quantities = get_guest_cart(token) if token else {}
+        return Response(guest_cart_data(token if quantities else None, quantities))
+
+    def post(self, request):
+        operations, error = validated_operations(request, self.max_operations)
+        if error is not None:
+            return error
+
+        token = get_token(request) or new_token()
+        quantities = get_guest_cart(token)
+        result, errors = apply_operations(quantities, operations, load_products(operations))
+        if errors:
+            return Response(
+                {'error': 'No se aplicó ninguna operación', 'errors': errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        save_guest_cart(token, result)
+        response = Response(guest_cart_data(token, result))
+        response[GUEST_CART_HEADER] = token
+        return response
+
+    def delete(self, request):
+        token = get_token(request)
+        if token:
+            delete_guest_cart(token)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+class CartMergeView(APIView):
     """
-    ViewSet para ver órdenes del usuario
+    Fusiona el carrito de invitado de la cabecera X-Cart-Token con el del
+    usuario autenticado (p. ej. tras registrarse) y devuelve el carrito.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        token = get_token(request)
+        if token is None:
+            return Response(
+                {'error': f'La cabecera {GUEST_CART_HEADER} es requerida'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        merge_guest_cart(request.user.id, token)
+        return Response(cart_data(request))
+
+
+class OrderViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet para ver órdenes del usuario (con ETag/Last-Modified).
+    El listado usa la representación compacta (OrderSummarySerializer)
+    paginada por (created_at, id); el detalle incluye los items.
     """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderSummarySerializer
+        return OrderSerializer
 
     def get_queryset(self):
         """
-        Retorna solo las órdenes del usuario autenticado
+        Retorna solo las órdenes del usuario autenticado.
+        En el listado el número de items y la miniatura son anotaciones; en
+        el detalle los items solo se precargan si la respuesta los incluye
+        (?fields= / ?expand=).
         """
-        return Order.objects.filter(user=self.request.user).prefetch_related('items__product')
+        queryset = Order.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            return queryset.with_summary()
+        return queryset
+
+    def get_object(self):
+        """
+        Precarga los items (si la respuesta los incluye) con la fecha de la
+        orden como cota: con tablas particionadas no se leen meses anteriores.
+        """
+        order = super().get_object()
+        if is_field_requested(self.request, 'items', expandable=True):
+            prefetch_related_objects([order], items_prefetch(order.created_at))
+        return order
 
     @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    @idempotent('orders.create_order_from_cart')
     def create_order_from_cart(self, request):
         """
         Crea una orden desde el carrito actual del usuario
-        (antes de procesar el pago con Stripe)
+        (antes de procesar el pago con Stripe).
+        Admite la cabecera Idempotency-Key para reintentos seguros.
         """
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items = cart.items.all()
-
-            if not cart_items.exists():
-                return Response(
-                    {'error': 'El carrito está vacío'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            with transaction.atomic():
-                # Validar stock ANTES de crear la orden
-                for item in cart_items:
-                    if item.product.stock < item.quantity:
-                        return Response(
-                            {'error': f'Stock insuficiente para {item.product.name}'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                # Crear la orden
-                order = Order.objects.create(
-                    user=request.user,
-                    total_price=cart.get_total_price(),
-                    shipping_address=request.data.get('shipping_address', ''),
-                    shipping_phone=request.data.get('shipping_phone', '')
-                )
+        store = get_cart_store()
+        if store is not None:
+            # El carrito vivo está en Redis: escribirlo antes de leerlo
+            store.write_back(request.user.id)
 
-                # Crear OrderItems y reducir stock
-                for item in cart_items:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=item.product,
-                        quantity=item.quantity,
-                        price=item.product.price
-                    )
-                    # Reducir stock
-                    item.product.stock -= item.quantity
-                    item.product.save()
-
-                # Vaciar carrito
-                cart_items.delete()
-
-            serializer = self.get_serializer(order)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        except Cart.DoesNotExist:
-            return Response(
-                {'error': 'Carrito no encontrado'},
-                status=status.HTTP_404_NOT_FOUND
+        try:
+            order = create_order_from_cart(
+                request.user,
+                shipping_address=request.data.get('shipping_address', ''),
+                shipping_phone=request.data.get('shipping_phone', ''),
             )
+        except CheckoutError as e:
+            return Response({'error': e.message}, status=e.status_code)
         except Exception as e:
             return Response(
                 {'error': f'Error al crear la orden: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        if store is not None:
+            store.forget(request.user.id)
+
+        serializer = self.get_serializer(order)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+# Stripe exige que una sesión de checkout venza entre 30 minutos y 24 horas
+STRIPE_SESSION_MIN_SECONDS = 30 * 60
+STRIPE_SESSION_MAX_SECONDS = 24 * 60 * 60
+# Margen de la reserva tras vencer la sesión para recibir el webhook
+STRIPE_WEBHOOK_GRACE_SECONDS = 5 * 60
+
 
 class CreateCheckoutSessionView(APIView):
     """
-    Vista para crear una sesión de checkout de Stripe para una orden
+    Vista para crear una sesión de checkout de Stripe para una orden.
+    Admite la cabecera Idempotency-Key para reintentos seguros.
     """
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent('orders.create_checkout_session')
     def post(self, request, *args, **kwargs):
         order_id = request.data.get('order_id')
         
@@ -256,12 +496,42 @@ class CreateCheckoutSessionView(APIView):
             )
 
         try:
-            order = Order.objects.get(
-                id=order_id,
-                user=request.user,
-                status='PENDIENTE'
+            order = Order.objects.get(id=order_id, user=request.user, status='PENDIENTE')
+        except (Order.DoesNotExist, ValueError):
+            order = None
+        if order is None or order.payment_status == 'pagado':
+            return Response(
+                {'error': 'Orden no válida o no encontrada'},
+                status=status.HTTP_404_NOT_FOUND
             )
-        except Order.DoesNotExist:
+
+        # Una sesión aún abierta se reutiliza: ni se amplía la reserva ni
+        # se abren dos sesiones que podrían pagarse las dos
+        open_session = self._open_session(order)
+        if open_session is not None:
+            return Response({'url': open_session.url})
+
+        # La sesión vence antes que la reserva de la orden: un pago no puede
+        # completarse después de devolver el stock. La reserva nunca pasa de
+        # ORDER_MAX_RESERVATION_SECONDS desde la creación de la orden.
+        expires_at = timezone.now() + timedelta(seconds=min(
+            max(settings.ORDER_RESERVATION_SECONDS, STRIPE_SESSION_MIN_SECONDS),
+            STRIPE_SESSION_MAX_SECONDS,
+        ))
+        hold_until = expires_at + timedelta(seconds=STRIPE_WEBHOOK_GRACE_SECONDS)
+        if hold_until > order.created_at + timedelta(seconds=settings.ORDER_MAX_RESERVATION_SECONDS):
+            return Response(
+                {'error': 'La reserva de esta orden está por vencer; crea una nueva orden.'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        with transaction.atomic():
+            locked = Order.objects.select_for_update().filter(
+                pk=order.pk, status='PENDIENTE'
+            ).exclude(payment_status='pagado').exists()
+            if locked:
+                extend_order_hold(order.id, hold_until)
+        if not locked:
             return Response(
                 {'error': 'Orden no válida o no encontrada'},
                 status=status.HTTP_404_NOT_FOUND
@@ -291,11 +561,12 @@ class CreateCheckoutSessionView(APIView):
                 metadata={
                     'order_id': order.id
                 },
+                expires_at=int(expires_at.timestamp()),
             )
 
             # Guardar el ID de la sesión en la orden
             order.stripe_checkout_id = checkout_session.id
-            order.save()
+            order.save(update_fields=['stripe_checkout_id', 'updated_at'])
 
             # Devolver la URL de la sesión de checkout
             return Response({'url': checkout_session.url})
@@ -306,6 +577,18 @@ class CreateCheckoutSessionView(APIView):
             )
 
 
+    @staticmethod
+    def _open_session(order):
+        if not order.stripe_checkout_id:
+            return None
+        try:
+            session = stripe.checkout.Session.retrieve(order.stripe_checkout_id)
+        except stripe.error.StripeError as e:
+            logger.warning(f"No se pudo consultar la sesión {order.stripe_checkout_id} de la orden {order.id}: {e}")
+            return None
+        return session if session.status == 'open' else None
+
+
 class StripeWebhookView(APIView):
     """
     Vista para recibir y procesar webhooks de Stripe
@@ -344,17 +627,33 @@ class StripeWebhookView(APIView):
             payment_intent_id = session.get('payment_intent')
 
             try:
-                order = Order.objects.get(id=order_id)
-                
-                # Evitar procesar dos veces
-                if order.payment_status == 'pendiente':
-                    order.status = 'PAGADO'
-                    order.payment_status = 'pagado'
-                    order.stripe_payment_intent_id = payment_intent_id
-                    order.save()
-                    
-                    print(f"✅ Orden {order_id} marcada como PAGADO.")
-                    
+                refund = False
+                with transaction.atomic():
+                    # Bloqueo compartido con release_expired: o se paga o se cancela
+                    order = Order.objects.select_for_update().get(id=order_id)
+
+                    # Evitar procesar dos veces; un reintento tras un pago
+                    # fallido sí marca la orden como pagada
+                    if order.status == 'PENDIENTE' and order.payment_status != 'pagado':
+                        order.status = 'PAGADO'
+                        order.payment_status = 'pagado'
+                        order.stripe_payment_intent_id = payment_intent_id
+                        order.save()
+                        commit_order(order.id)
+
+                        print(f"✅ Orden {order_id} marcada como PAGADO.")
+                    elif order.status == 'CANCELADO' and order.payment_status == 'expirado' and payment_intent_id:
+                        # Pago tardío de una orden vencida: su stock ya se
+                        # devolvió, así que se reembolsa en vez de reactivarla
+                        order.stripe_payment_intent_id = payment_intent_id
+                        order.save(update_fields=['stripe_payment_intent_id', 'updated_at'])
+                        refund = True
+
+                # Fuera de la transacción: la fila no queda bloqueada durante
+                # la llamada a Stripe
+                if refund:
+                    self._refund(order, payment_intent_id)
+
             except Order.DoesNotExist:
                 print(f"❌ Error: Orden {order_id} no encontrada para evento webhook.")
                 return Response(
@@ -384,31 +683,49 @@ class StripeWebhookView(APIView):
 
         return Response(status=status.HTTP_200_OK)
 
+    def _refund(self, order, payment_intent_id):
+        """
+        Reembolsa el pago tardío de una orden vencida. La clave de
+        idempotencia evita un segundo reembolso si Stripe reenvía el evento
+        en paralelo. Si Stripe falla la orden queda 'expirado' con su
+        payment_intent para revisarla.
+        """
+        try:
+            stripe.Refund.create(payment_intent=payment_intent_id, idempotency_key=f'refund-{payment_intent_id}')
+        except stripe.error.StripeError as e:
+            logger.error(f"Pago {payment_intent_id} de la orden {order.id} ({order.status}) sin reembolsar: {e}")
+            return
+        Order.objects.filter(pk=order.pk, payment_status='expirado').update(
+            payment_status='reembolsado', updated_at=timezone.now()
+        )
+        print(f"↩️ Pago tardío de la orden {order.id} ({order.status}) reembolsado.")
+
 
 class OrderReceiptView(APIView):
     """
-    Vista para generar comprobante HTML de una orden.
+    Vista para generar comprobante HTML (o PDF) de una orden.
     Requiere autenticación JWT pero devuelve HTML renderizado.
+    El comprobante se sirve desde la caché por (orden, updated_at); ver
+    orders/receipts.py. El PDF responde 202 mientras se genera.
     """
     permission_classes = [IsAuthenticated]
-    template_name = 'orders/receipt.html'
+    template_name = receipts.TEMPLATE_NAME
 
-    def get(self, request, order_id, format=None):
+    def get(self, request, order_id, fmt='html', format=None):
         logger.debug(f"Intentando obtener recibo API para orden {order_id} por usuario {request.user.id} (JWT)")
-        
+
         try:
-            # Obtener la orden con items y productos precargados
-            order = Order.objects.select_related('user').prefetch_related(
-                'items',
-                'items__product',
-                'items__product__brand'
-            ).get(id=order_id)
+            # Solo dueño y versión: el comprobante sale de la caché
+            row = Order.objects.filter(id=order_id).values_list('user_id', 'updated_at').first()
+            if row is None:
+                raise Order.DoesNotExist
+            owner_id, updated_at = row
 
             # Verificar permisos: solo el dueño de la orden o staff
-            if order.user != request.user and not request.user.is_staff:
+            if owner_id != request.user.id and not request.user.is_staff:
                 logger.warning(
                     f"Acceso denegado API: Usuario {request.user.id} intentó ver orden {order_id} "
-                    f"de usuario {order.user.id}"
+                    f"de usuario {owner_id}"
                 )
                 # Devolver error DRF
                 return Response(
@@ -416,10 +733,19 @@ class OrderReceiptView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
 
-            logger.debug(f"Orden {order_id} encontrada API (JWT). Renderizando template a HTML.")
-            context = {'order': order}
-            # Renderiza el template a una string HTML
-            html_content = render_to_string(self.template_name, context, request=request)
+            if fmt == 'pdf':
+                pdf = receipts.get_receipt_pdf(order_id, updated_at)
+                if pdf is None:
+                    return Response(
+                        {"detail": "El comprobante PDF se está generando. Reintenta en unos segundos."},
+                        status=status.HTTP_202_ACCEPTED,
+                        headers={'Retry-After': '2'}
+                    )
+                response = HttpResponse(pdf, content_type='application/pdf')
+                response['Content-Disposition'] = f'inline; filename="comprobante-{order_id}.pdf"'
+                return response
+
+            html_content = receipts.get_receipt_html(order_id, updated_at)
             # Devuelve el HTML en una HttpResponse estándar
             return HttpResponse(html_content, content_type='text/html')
 
@@ -429,6 +755,14 @@ class OrderReceiptView(APIView):
                 {"detail": "Pedido no encontrado."},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except receipts.PdfUnavailable as e:
+            return Response({"detail": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        except receipts.PdfRenderFailed as e:
+            return Response(
+                {"detail": str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.RECEIPT_PDF_RETRY_SECONDS)}
+            )
         except Exception as e:
             logger.error(
                 f"Error inesperado API (JWT) al obtener recibo para orden {order_id}: {e}",
@@ -438,3 +772,44 @@ class OrderReceiptView(APIView):
                 {"detail": "Ocurrió un error inesperado al generar el comprobante."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class ReceiptExportView(APIView):
+    """
+    Exportación masiva de comprobantes (solo staff).
+    POST /api/receipt/export/ con {"ids": [...]} o
+    {"date_from": "AAAA-MM-DD", "date_to": "AAAA-MM-DD"}.
+    Devuelve un ZIP (un HTML por orden) generado en streaming; ver
+    orders/receipt_export.py.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        serializer = ReceiptExportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        orders = Order.objects.order_by('id')
+        if 'ids' in data:
+            orders = orders.filter(id__in=data['ids'])
+        else:
+            start = timezone.make_aware(datetime.combine(data['date_from'], time.min))
+            end = timezone.make_aware(datetime.combine(data['date_to'] + timedelta(days=1), time.min))
+            orders = orders.filter(created_at__gte=start, created_at__lt=end)
+
+        limit = settings.RECEIPT_EXPORT_MAX_ORDERS
+        rows = list(orders.values_list('id', 'updated_at')[:limit + 1])
+        if len(rows) > limit:
+            return Response(
+                {'error': f'Máximo {limit} órdenes por exportación.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not rows:
+            return Response(
+                {'error': 'No hay órdenes para exportar'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        response = StreamingHttpResponse(stream_receipts_zip(rows), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="comprobantes.zip"'
+        return response
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Count
 from .models import Category, Product, Brand, Review
 
 
@@ -11,11 +12,14 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     ordering = ['name']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(products_count=Count('products'))
+
     def get_products_count(self, obj):
         """
         Muestra el número de productos en la categoría.
         """
-        return obj.products.count()
+        return obj.products_count
     
     get_products_count.short_description = 'Número de Productos'
 
@@ -43,11 +47,14 @@ class BrandAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(products_count=Count('products'))
+
     def get_products_count(self, obj):
         """
         Muestra el número de productos de esta marca.
         """
-        return obj.products.count()
+        return obj.products_count
     
     get_products_count.short_description = 'Número de Productos'
 
@@ -59,13 +66,13 @@ class ProductAdmin(admin.ModelAdmin):
     """
     list_display = ['name', 'category', 'brand', 'price', 'stock', 'image', 'created_at']
     list_filter = ['category', 'brand', 'created_at']
-    search_fields = ['name', 'description', 'brand__name']
+    search_fields = ['name', 'sku', 'description', 'brand__name']
     ordering = ['-created_at']
     readonly_fields = ['created_at', 'updated_at']
     
     fieldsets = (
         ('Información Básica', {
-            'fields': ('name', 'description', 'category', 'brand', 'image')
+            'fields': ('name', 'sku', 'description', 'category', 'brand', 'image')
         }),
         ('Precios e Inventario', {
             'fields': ('price', 'stock')
@@ -0,0 +1,217 @@
+"""
+Caché versionada de las lecturas del catálogo (categorías, marcas, productos).
+
+Cada entrada incluye en su clave la versión actual del catálogo. Las señales
+de `products.signals` (y la importación masiva) incrementan esa versión al
+guardar o borrar un producto, categoría o marca, con lo que todas las
+entradas anteriores dejan de usarse sin tener que borrarlas una a una.
+
+El stock y los agregados de reseñas cambian con cada compra, ajuste o
+reseña mediante UPDATE directos que no pasan por las señales ni cambian la
+versión: son `live_fields` de la vista, que se releen de la base de datos
+(una consulta por pk) al servir una respuesta desde la caché. Así el
+catálogo sigue cacheado en una tienda con mucho movimiento y los checkouts
+no compiten por la fila de CatalogVersion.
+
+La versión se guarda en la base de datos (CatalogVersion), no en la caché:
+sin REDIS_URL la caché es LocMemCache, una por worker de gunicorn, y un
+contador en ella solo cambiaría en el worker que hizo la escritura. Así
+todos los workers invalidan a la vez y generan los mismos ETag, aunque
+cada uno tenga sus propias entradas cacheadas.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from smartsales_backend.conditional import ConditionalGetMixin
+from .models import CatalogVersion
+
+HITS_KEY = 'catalog:metrics:hits'
+MISSES_KEY = 'catalog:metrics:misses'
+
+
+def catalog_state():
+    """
+    Devuelve (versión, fecha del último cambio) del catálogo.
+
+    Si la fila no existe (primer uso) se crea con la hora actual en
+    milisegundos como versión, que siempre es mayor que cualquier versión
+    anterior que pudiera quedar en una caché persistente.
+    """
+    row = CatalogVersion.objects.filter(pk=1).values_list('version', 'changed_at').first()
+    if row is None:
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': int(time.time() * 1000)})
+        row = CatalogVersion.objects.filter(pk=1).values_list('version', 'changed_at').first()
+    return row
+
+
+def catalog_version():
+    """
+    Versión actual del catálogo.
+    """
+    return catalog_state()[0]
+
+
+def bump_catalog_version():
+    """
+    Invalida todas las entradas cacheadas del catálogo.
+    """
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1, changed_at=timezone.now()):
+        catalog_state()
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1, changed_at=timezone.now())
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def record_hit():
+    _incr(HITS_KEY)
+
+
+def record_miss():
+    _incr(MISSES_KEY)
+
+
+def cache_stats():
+    """
+    Métricas de aciertos y fallos de la caché del catálogo.
+    """
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'version': catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def params_digest(params):
+    """
+    Hash estable de los query params (ordenados, sin valores vacíos).
+    """
+    items = sorted(
+        (name, value)
+        for name, values in params.lists()
+        for value in values
+        if value != ''
+    )
+    return hashlib.md5(urlencode(items).encode()).hexdigest()
+
+
+def view_catalog_state(view):
+    """
+    catalog_state() leído una sola vez por petición (la vista es por petición).
+    """
+    if not hasattr(view, '_catalog_state'):
+        view._catalog_state = catalog_state()
+    return view._catalog_state
+
+
+class CatalogCacheMixin:
+    """
+    Mixin para ViewSets del catálogo: cachea las respuestas de `list` y
+    `retrieve` por versión del catálogo y query params normalizados.
+    Añade la cabecera `X-Cache: HIT|MISS`.
+
+    `live_fields` son campos que cambian sin cambiar la versión; en una
+    respuesta cacheada se sustituyen por sus valores actuales.
+    """
+    cache_timeout = settings.CATALOG_CACHE_TIMEOUT
+    live_fields = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def get_cache_key(self, request):
+        # El host forma parte de la clave porque la paginación genera
+        # enlaces absolutos (`next` / `previous`).
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')
+        return 'catalog:v{version}:{name}:{action}:{lookup}:{host}:{params}'.format(
+            version=view_catalog_state(self)[0],
+            name=self.basename,
+            action=self.action,
+            lookup=lookup,
+            host=request.get_host(),
+            params=params_digest(request.query_params),
+        )
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            record_hit()
+            self.refresh_live_fields(data)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        record_miss()
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def refresh_live_fields(self, data):
+        """
+        Sustituye en `data` (detalle o página del listado) los `live_fields`
+        por los valores actuales, con una consulta por pk.
+        """
+        items = data.get('results', data) if isinstance(data, dict) else data
+        if isinstance(items, dict):
+            items = [items]
+        fields = self.get_serializer().fields
+        names = [name for name in self.live_fields if name in fields]
+        ids = [item['id'] for item in items if 'id' in item]
+        if not names or not ids:
+            return
+        model = self.get_queryset().model
+        current = model.objects.in_bulk(ids)
+        for item in items:
+            obj = current.get(item.get('id'))
+            if obj is None:
+                continue
+            for name in names:
+                if name in item:
+                    field = fields[name]
+                    item[name] = field.to_representation(field.get_attribute(obj))
+
+
+class CatalogConditionalMixin(ConditionalGetMixin):
+    """
+    GET condicional para el catálogo: el ETag incluye la versión del
+    catálogo y Last-Modified es la fecha de su último cambio, así ambos
+    cambian también cuando se modifica una categoría o marca anidada en la
+    respuesta o se borra una fila. Los cambios de stock y reseñas no mueven
+    la versión pero sí `updated_at`, que también cuenta.
+    """
+
+    def get_etag_salt(self):
+        return view_catalog_state(self)[0]
+
+    def get_last_modified(self, last_modified):
+        # Cualquier cambio del catálogo (borrados, categorías o marcas
+        # anidadas, SET_NULL al borrar una marca) mueve esta fecha
+        changed_at = view_catalog_state(self)[1]
+        return max(changed_at, last_modified) if last_modified else changed_at
@@ -0,0 +1,107 @@
+"""
+Exportación completa del catálogo en streaming (JSONL o MessagePack).
+
+Los productos se leen con `values()` e `.iterator(chunk_size=...)` (cursor
+del lado del servidor en PostgreSQL) y cada registro se codifica y envía en
+cuanto se lee, así que la memoria usada no depende del tamaño del catálogo.
+"""
+import json
+
+import msgpack
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+from .models import Product
+
+EXPORT_FIELDS = (
+    'id', 'sku', 'name', 'description', 'price', 'stock', 'image',
+    'category_id', 'category__name', 'brand_id', 'brand__name',
+    'rating_avg', 'rating_count', 'created_at', 'updated_at',
+)
+
+# Bytes acumulados antes de enviar un bloque de la respuesta
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Nombres de salida para los campos de relaciones
+RENAMED_FIELDS = {'category__name': 'category_name', 'brand__name': 'brand_name'}
+
+
+class JSONLinesRenderer(BaseRenderer):
+    """
+    Un objeto JSON por línea (application/x-ndjson).
+    Solo se usa para la negociación de contenido de la exportación.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return encode_jsonl(data)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Secuencia de objetos MessagePack concatenados (application/x-msgpack).
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return msgpack.packb(data, default=_msgpack_default)
+
+
+def _msgpack_default(value):
+    # Decimal como cadena (igual que DRF) y fechas en ISO 8601
+    return DjangoJSONEncoder().default(value)
+
+
+def encode_jsonl(record):
+    return (json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def get_encoder(fmt):
+    """
+    Devuelve una función registro -> bytes para el formato indicado.
+    """
+    if fmt == 'jsonl':
+        return encode_jsonl
+    if fmt == 'msgpack':
+        return msgpack.Packer(default=_msgpack_default).pack
+    raise ValueError(f'Formato no soportado: {fmt}')
+
+
+def iter_catalog(chunk_size=None):
+    """
+    Itera los productos del catálogo como dicts planos, ordenados por id.
+    """
+    chunk_size = chunk_size or settings.CATALOG_EXPORT_CHUNK_SIZE
+    rows = Product.objects.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    keys = [RENAMED_FIELDS.get(field, field) for field in EXPORT_FIELDS]
+    image_index = EXPORT_FIELDS.index('image')
+    for row in rows:
+        row = list(row)
+        # CloudinaryField devuelve un recurso; se exporta su public_id como en la API
+        row[image_index] = str(row[image_index]) if row[image_index] else None
+        yield dict(zip(keys, row))
+
+
+def stream_catalog(fmt, chunk_size=None):
+    """
+    Genera los bytes de la exportación en el formato indicado ('jsonl' o
+    'msgpack'), agrupando varios registros por bloque enviado.
+    """
+    encode = get_encoder(fmt)
+    buffer = []
+    size = 0
+    for record in iter_catalog(chunk_size):
+        data = encode(record)
+        buffer.append(data)
+        size += len(data)
+        if size >= STREAM_BLOCK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
@@ -0,0 +1,122 @@
+"""
+Facetas del catálogo: conteos por categoría, marca, rango de precio y stock.
+
+Se calculan con tres consultas agregadas (categorías, marcas y una
+agregación condicional para precios) y se cachean por combinación de
+filtros y versión del catálogo. Los conteos de stock cambian sin cambiar la
+versión (compras, ajustes), así que se calculan en cada petición.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+
+from .cache import catalog_version
+from .filters import CATALOG_FILTER_PARAMS, filter_products
+from .models import Product
+
+# Límites inferiores de los rangos de precio; el último rango es abierto
+PRICE_BUCKETS = (0, 50, 100, 250, 500, 1000)
+
+
+def normalize_filters(params):
+    """
+    Devuelve los filtros del catálogo presentes en `params` en forma canónica.
+    """
+    normalized = {}
+    for name in CATALOG_FILTER_PARAMS:
+        value = params.get(name, '').strip()
+        if name == 'q':
+            value = ' '.join(value.lower().split())
+        if value:
+            normalized[name] = value
+    return normalized
+
+
+def facets_cache_key(filters):
+    """
+    Clave de caché estable para una combinación de filtros normalizada,
+    ligada a la versión actual del catálogo.
+    """
+    digest = hashlib.md5(urlencode(sorted(filters.items())).encode()).hexdigest()
+    return f'catalog:v{catalog_version()}:facets:{digest}'
+
+
+def _price_ranges():
+    bounds = list(PRICE_BUCKETS) + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def compute_facets(filters):
+    """
+    Calcula las facetas para los filtros dados.
+
+    Las facetas de categoría y marca ignoran su propio filtro para que el
+    cliente pueda mostrar las alternativas disponibles.
+    """
+    base = Product.objects.order_by()
+
+    categories = filter_products(base, filters, exclude=('category',), ranked=False).values(
+        'category_id', 'category__name'
+    ).annotate(count=Count('id')).order_by('category__name')
+
+    brands = filter_products(base, filters, exclude=('brand',), ranked=False).filter(
+        brand__isnull=False
+    ).values('brand_id', 'brand__name').annotate(count=Count('id')).order_by('brand__name')
+
+    aggregates = {
+        'total': Count('id'),
+        'min_price': Min('price'),
+        'max_price': Max('price'),
+    }
+    price_ranges = _price_ranges()
+    for index, (low, high) in enumerate(price_ranges):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'price_{index}'] = Count('id', filter=condition)
+    totals = filter_products(base, filters, ranked=False).aggregate(**aggregates)
+
+    return {
+        'filters': filters,
+        'total': totals['total'],
+        'min_price': totals['min_price'],
+        'max_price': totals['max_price'],
+        'categories': [
+            {'id': row['category_id'], 'name': row['category__name'], 'count': row['count']}
+            for row in categories
+        ],
+        'brands': [
+            {'id': row['brand_id'], 'name': row['brand__name'], 'count': row['count']}
+            for row in brands
+        ],
+        'price_ranges': [
+            {'min': low, 'max': high, 'count': totals[f'price_{index}']}
+            for index, (low, high) in enumerate(price_ranges)
+        ],
+    }
+
+
+def stock_counts(filters):
+    """
+    Productos con y sin stock para los filtros dados (sin caché).
+    """
+    totals = filter_products(Product.objects.order_by(), filters, ranked=False).aggregate(
+        total=Count('id'), in_stock=Count('id', filter=Q(stock__gt=0)),
+    )
+    return {'in_stock': totals['in_stock'], 'out_of_stock': totals['total'] - totals['in_stock']}
+
+
+def get_facets(params):
+    """
+    Devuelve las facetas para `params`, usando la caché si están disponibles.
+    """
+    filters = normalize_filters(params)
+    key = facets_cache_key(filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, settings.CATALOG_FACETS_CACHE_TIMEOUT)
+    return dict(facets, **stock_counts(filters))
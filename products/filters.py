@@ -0,0 +1,29 @@
+"""
+Filtros del catálogo compartidos por el listado de productos y las facetas.
+"""
+from .search import search_products
+
+# Parámetros de consulta que filtran el catálogo
+CATALOG_FILTER_PARAMS = ('category', 'brand', 'q')
+
+
+def filter_products(queryset, params, exclude=(), ranked=True):
+    """
+    Aplica los filtros del catálogo presentes en `params` (query params).
+    `exclude` permite omitir filtros, p. ej. para calcular la faceta de
+    categorías sin restringir por la categoría seleccionada.
+    """
+    category_id = params.get('category', None)
+    brand_id = params.get('brand', None)
+    term = params.get('q', '')
+
+    if category_id is not None and 'category' not in exclude:
+        queryset = queryset.filter(category_id=category_id)
+
+    if brand_id is not None and 'brand' not in exclude:
+        queryset = queryset.filter(brand_id=brand_id)
+
+    if term.strip() and 'q' not in exclude:
+        queryset = search_products(queryset, term, ranked=ranked)
+
+    return queryset
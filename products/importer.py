@@ -0,0 +1,289 @@
+"""
+Importación masiva (upsert por SKU) de productos desde CSV o JSONL.
+
+Las filas se leen en streaming, se validan por lotes y se escriben con
+`bulk_create(update_conflicts=True)`, un lote por transacción. Un error en
+una fila o en un lote se reporta sin abortar el resto de la importación.
+Categorías y marcas se resuelven por nombre sin distinguir mayúsculas con
+un mapa en memoria; las que faltan se crean con `ignore_conflicts` sobre la
+restricción única de LOWER(name), así que dos importaciones concurrentes
+(o "Audio" y "audio") no crean duplicados.
+"""
+import codecs
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .cache import bump_catalog_version
+from .models import Brand, Category, Product
+
+# Máximo de errores de fila incluidos en el reporte
+MAX_REPORTED_ERRORS = 500
+
+UPDATE_FIELDS = ['name', 'description', 'price', 'stock', 'category', 'brand', 'updated_at']
+
+
+class ImportReport:
+    """
+    Resultado de una importación: filas procesadas, escritas y errores.
+    """
+
+    def __init__(self):
+        self.processed = 0
+        self.upserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row_number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'processed': self.processed,
+            'upserted': self.upserted,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _decoded_lines(stream, bad_lines):
+    """
+    Decodifica `stream` (binario) línea a línea como UTF-8. Las líneas que
+    no son UTF-8 válido se decodifican con reemplazo y su número se anota en
+    `bad_lines`, para reportar la fila en lugar de abortar la importación.
+    El stream no se cierra.
+    """
+    for line_number, raw in enumerate(stream, start=1):
+        if line_number == 1 and raw.startswith(codecs.BOM_UTF8):
+            raw = raw[len(codecs.BOM_UTF8):]
+        try:
+            yield raw.decode('utf-8')
+        except UnicodeDecodeError:
+            bad_lines.add(line_number)
+            yield raw.decode('utf-8', errors='replace')
+
+
+def _encoding_error(line_number):
+    return {'__error__': f'La línea {line_number} no es texto UTF-8 válido.'}
+
+
+def iter_rows(stream, fmt):
+    """
+    Itera las filas (dicts) de `stream` (binario) en formato 'csv' o 'jsonl'.
+    Los errores de formato o de codificación de una fila se devuelven como
+    filas con la clave especial '__error__'.
+    """
+    bad_lines = set()
+    lines = _decoded_lines(stream, bad_lines)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        last_line = reader.line_num
+        for row in reader:
+            # Una fila puede ocupar varias líneas (campos entre comillas)
+            bad = sorted(n for n in bad_lines if last_line < n <= reader.line_num)
+            last_line = reader.line_num
+            yield _encoding_error(bad[0]) if bad else row
+        return
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(lines, start=1):
+            if line_number in bad_lines:
+                yield _encoding_error(line_number)
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield {'__error__': f'JSON inválido: {e}'}
+                continue
+            yield row if isinstance(row, dict) else {'__error__': 'Cada línea debe ser un objeto JSON.'}
+        return
+    raise ValueError(f'Formato no soportado: {fmt}')
+
+
+def detect_format(filename, default='csv'):
+    """
+    Deduce el formato a partir de la extensión del archivo.
+    """
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+class ProductImporter:
+    """
+    Importa productos por lotes resolviendo categoría y marca por nombre.
+
+    Con `create_missing=True` las categorías y marcas desconocidas se crean;
+    si no, la fila se rechaza.
+    """
+    default_batch_size = 1000
+    max_batch_size = 5000
+
+    def __init__(self, batch_size=default_batch_size, create_missing=False):
+        self.batch_size = batch_size
+        self.create_missing = create_missing
+        self.categories = {name.lower(): pk for pk, name in Category.objects.values_list('pk', 'name')}
+        self.brands = {name.lower(): pk for pk, name in Brand.objects.values_list('pk', 'name')}
+
+    def run(self, rows):
+        report = ImportReport()
+        batch = []
+        for row_number, row in enumerate(rows, start=1):
+            report.processed += 1
+            batch.append((row_number, row))
+            if len(batch) >= self.batch_size:
+                self._process_batch(batch, report)
+                batch = []
+        if batch:
+            self._process_batch(batch, report)
+
+        if report.upserted:
+            transaction.on_commit(bump_catalog_version)
+        return report
+
+    def _process_batch(self, batch, report):
+        valid = {}
+        for row_number, row in batch:
+            cleaned, errors = self._clean_row(row)
+            if errors:
+                report.add_error(row_number, errors)
+            else:
+                # Un SKU repetido dentro del lote: gana la última fila
+                valid[cleaned['sku']] = (row_number, cleaned)
+        if not valid:
+            return
+
+        self._resolve_names(valid, report)
+        if not valid:
+            return
+
+        products = [
+            Product(
+                sku=cleaned['sku'],
+                name=cleaned['name'],
+                description=cleaned['description'],
+                price=cleaned['price'],
+                stock=cleaned['stock'],
+                category_id=self.categories[cleaned['category'].lower()],
+                brand_id=self.brands[cleaned['brand'].lower()] if cleaned['brand'] else None,
+            )
+            for _, cleaned in valid.values()
+        ]
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(
+                    products,
+                    update_conflicts=True,
+                    unique_fields=['sku'],
+                    update_fields=UPDATE_FIELDS,
+                )
+        except DatabaseError as e:
+            for row_number, _ in valid.values():
+                report.add_error(row_number, {'non_field_errors': [f'Error al guardar el lote: {e}']})
+            return
+        report.upserted += len(products)
+
+    def _resolve_names(self, valid, report):
+        """
+        Asegura que las categorías/marcas de las filas existan en los mapas,
+        creándolas si `create_missing`; si no, descarta las filas afectadas.
+        """
+        rows = [cleaned for _, cleaned in valid.values()]
+        missing_categories = {row['category'] for row in rows if row['category'].lower() not in self.categories}
+        missing_brands = {row['brand'] for row in rows if row['brand'] and row['brand'].lower() not in self.brands}
+
+        if self.create_missing:
+            self._create_missing(Category, missing_categories, self.categories)
+            self._create_missing(Brand, missing_brands, self.brands)
+            return
+
+        missing_categories = {name.lower() for name in missing_categories}
+        missing_brands = {name.lower() for name in missing_brands}
+        for sku, (row_number, cleaned) in list(valid.items()):
+            errors = {}
+            if cleaned['category'].lower() in missing_categories:
+                errors['category'] = [f'Categoría no encontrada: {cleaned["category"]}']
+            if cleaned['brand'] and cleaned['brand'].lower() in missing_brands:
+                errors['brand'] = [f'Marca no encontrada: {cleaned["brand"]}']
+            if errors:
+                report.add_error(row_number, errors)
+                del valid[sku]
+
+    @staticmethod
+    def _create_missing(model, names, mapping):
+        """
+        Crea las categorías/marcas `names` que no existan y las añade a
+        `mapping`. Las que ya existen con otra capitalización, o que creó
+        otra importación entre tanto, chocan con la restricción única de
+        LOWER(name) y se ignoran; la consulta posterior las encuentra.
+        """
+        if not names:
+            return
+        unique_names = {name.lower(): name for name in names}
+        model.objects.bulk_create([model(name=name) for name in unique_names.values()], ignore_conflicts=True)
+        # `name__in` además de LOWER: en SQLite LOWER solo convierte ASCII
+        existing = model.objects.annotate(lowered=Lower('name')).filter(
+            Q(lowered__in=list(unique_names)) | Q(name__in=list(unique_names.values()))
+        )
+        for pk, name in existing.order_by('pk').values_list('pk', 'name'):
+            mapping.setdefault(name.lower(), pk)
+
+    @staticmethod
+    def _clean_row(row):
+        """
+        Valida y normaliza una fila. Devuelve (datos, errores).
+        """
+        if '__error__' in row:
+            return None, {'non_field_errors': [row['__error__']]}
+
+        def text(name):
+            value = row.get(name)
+            return str(value).strip() if value is not None else ''
+
+        errors = {}
+        cleaned = {
+            'sku': text('sku'),
+            'name': text('name'),
+            'description': text('description') or None,
+            'category': text('category'),
+            'brand': text('brand'),
+        }
+        for name in ('sku', 'name', 'category'):
+            if not cleaned[name]:
+                errors[name] = ['Este campo es requerido.']
+        if len(cleaned['sku']) > 64:
+            errors['sku'] = ['Máximo 64 caracteres.']
+        if len(cleaned['name']) > 255:
+            errors['name'] = ['Máximo 255 caracteres.']
+
+        try:
+            cleaned['price'] = Decimal(text('price'))
+            if not cleaned['price'].is_finite() or cleaned['price'] < 0:
+                errors['price'] = ['El precio debe ser un valor positivo.']
+            elif cleaned['price'] >= Decimal('100000000'):
+                errors['price'] = ['El precio es demasiado grande.']
+            else:
+                cleaned['price'] = cleaned['price'].quantize(Decimal('0.01'))
+        except InvalidOperation:
+            errors['price'] = ['Precio inválido.']
+
+        try:
+            cleaned['stock'] = int(text('stock') or 0)
+            if cleaned['stock'] < 0:
+                errors['stock'] = ['El stock no puede ser negativo.']
+        except ValueError:
+            errors['stock'] = ['Stock inválido.']
+
+        return cleaned, errors
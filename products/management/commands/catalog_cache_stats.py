@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Muestra las métricas de aciertos/fallos de la caché del catálogo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reinicia los contadores después de mostrarlos.',
+        )
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        for name, value in stats.items():
+            self.stdout.write(f'{name}: {value}')
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Contadores reiniciados.'))
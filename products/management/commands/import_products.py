@@ -0,0 +1,57 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import ProductImporter, detect_format, iter_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa/actualiza productos por SKU desde un archivo CSV o JSONL '
+        '(columnas: sku, name, description, price, stock, category, brand).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Ruta del archivo, o "-" para leer de stdin.')
+        parser.add_argument(
+            '--format',
+            dest='file_format',
+            choices=['csv', 'jsonl'],
+            help='Formato del archivo (por defecto se deduce de la extensión).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ProductImporter.default_batch_size,
+            help='Filas por lote/transacción.',
+        )
+        parser.add_argument(
+            '--create-missing',
+            action='store_true',
+            help='Crea las categorías y marcas que no existan.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['file_format'] or detect_format(path)
+        importer = ProductImporter(
+            batch_size=max(1, options['batch_size']),
+            create_missing=options['create_missing'],
+        )
+
+        if path == '-':
+            report = importer.run(iter_rows(sys.stdin.buffer, fmt))
+        else:
+            try:
+                with open(path, 'rb') as stream:
+                    report = importer.run(iter_rows(stream, fmt))
+            except OSError as e:
+                raise CommandError(f'No se pudo abrir {path}: {e}')
+
+        for error in report.errors:
+            self.stderr.write(f"Fila {error['row']}: {error['errors']}")
+        summary = f'Procesadas: {report.processed}, guardadas: {report.upserted}, con error: {report.failed}'
+        if report.failed:
+            self.stdout.write(self.style.WARNING(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.models import CatalogTombstone
+
+
+class Command(BaseCommand):
+    help = 'Elimina los registros de borrado del catálogo más antiguos que la retención configurada.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.CATALOG_TOMBSTONE_RETENTION_DAYS,
+            help='Días a conservar (por defecto CATALOG_TOMBSTONE_RETENTION_DAYS).',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = CatalogTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Eliminados {deleted} registros de borrado.'))
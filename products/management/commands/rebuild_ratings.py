@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula desde las reseñas el promedio, conteo e histograma de '
+        'calificaciones de cada producto y reporta las desviaciones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Solo detecta desviaciones, sin corregirlas (sale con error si hay).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Productos procesados por lote (por defecto 1000).',
+        )
+
+    def handle(self, *args, **options):
+        drifted = rebuild_ratings(batch_size=options['batch_size'], dry_run=options['check'])
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Los agregados de reseñas están al día.'))
+            return
+
+        sample = ', '.join(str(pk) for pk in drifted[:20])
+        if options['check']:
+            raise CommandError(f'{len(drifted)} productos con agregados desviados (ids: {sample}).')
+        self.stdout.write(self.style.WARNING(
+            f'Corregidos {len(drifted)} productos con agregados desviados (ids: {sample}).'
+        ))
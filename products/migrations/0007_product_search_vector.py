@@ -0,0 +1,95 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:32
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# El vector combina nombre (A), marca y categoría (B) y descripción (C).
+# Los triggers sobre marca y categoría recalculan los productos afectados
+# cuando cambia su nombre.
+POSTGRES_FORWARD_SQL = """
+CREATE OR REPLACE FUNCTION products_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('spanish', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(
+            (SELECT name FROM products_brand WHERE id = NEW.brand_id), '')), 'B') ||
+        setweight(to_tsvector('spanish', coalesce(
+            (SELECT name FROM products_category WHERE id = NEW.category_id), '')), 'B') ||
+        setweight(to_tsvector('spanish', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description, brand_id, category_id
+    ON products_product
+    FOR EACH ROW EXECUTE FUNCTION products_product_search_vector_update();
+
+CREATE OR REPLACE FUNCTION products_brand_search_vector_refresh() RETURNS trigger AS $$
+BEGIN
+    UPDATE products_product SET name = name WHERE brand_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_brand_search_vector_trigger
+    AFTER UPDATE OF name ON products_brand
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION products_brand_search_vector_refresh();
+
+CREATE OR REPLACE FUNCTION products_category_search_vector_refresh() RETURNS trigger AS $$
+BEGIN
+    UPDATE products_product SET name = name WHERE category_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_category_search_vector_trigger
+    AFTER UPDATE OF name ON products_category
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION products_category_search_vector_refresh();
+
+CREATE INDEX product_search_vector_gin ON products_product USING GIN (search_vector);
+
+UPDATE products_product SET name = name;
+"""
+
+POSTGRES_REVERSE_SQL = """
+DROP INDEX IF EXISTS product_search_vector_gin;
+DROP TRIGGER IF EXISTS products_category_search_vector_trigger ON products_category;
+DROP FUNCTION IF EXISTS products_category_search_vector_refresh();
+DROP TRIGGER IF EXISTS products_brand_search_vector_trigger ON products_brand;
+DROP FUNCTION IF EXISTS products_brand_search_vector_refresh();
+DROP TRIGGER IF EXISTS products_product_search_vector_trigger ON products_product;
+DROP FUNCTION IF EXISTS products_product_search_vector_update();
+"""
+
+
+def create_search_triggers(apps, schema_editor):
+    """
+    Crea triggers e índice GIN solo en PostgreSQL.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_FORWARD_SQL)
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_REVERSE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_created_at_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Vector de búsqueda'),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:37
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_ratings(apps, schema_editor):
+    """
+    Calcula los agregados de reseñas de los productos existentes.
+    """
+    Product = apps.get_model('products', 'Product')
+    Review = apps.get_model('products', 'Review')
+    aggregates = {f'rating_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)}
+    rows = Review.objects.order_by().values('product_id').annotate(**aggregates)
+    for row in rows:
+        product_id = row.pop('product_id')
+        count = sum(row.values())
+        total = sum(stars * row[f'rating_{stars}'] for stars in range(1, 6))
+        Product.objects.filter(pk=product_id).update(
+            rating_count=count,
+            rating_avg=round(total / count, 2),
+            **row
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, verbose_name='Reseñas de 1 estrella'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, verbose_name='Reseñas de 2 estrellas'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, verbose_name='Reseñas de 3 estrellas'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, verbose_name='Reseñas de 4 estrellas'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, verbose_name='Reseñas de 5 estrellas'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=3, verbose_name='Calificación promedio'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Número de reseñas'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Código único del producto; clave para importaciones masivas.', max_length=64, null=True, unique=True, verbose_name='SKU'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.6 on 2026-10-16 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('product', 'Producto'), ('category', 'Categoría'), ('brand', 'Marca')], max_length=20, verbose_name='Modelo')),
+                ('object_id', models.BigIntegerField(verbose_name='ID del objeto')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de borrado')),
+            ],
+            options={
+                'verbose_name': 'Registro de borrado',
+                'verbose_name_plural': 'Registros de borrado',
+                'ordering': ['deleted_at', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Última actualización'),
+        ),
+        migrations.AddIndex(
+            model_name='brand',
+            index=models.Index(fields=['updated_at', 'id'], name='brand_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['updated_at', 'id'], name='category_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at', 'id'], name='product_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogtombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstone_sync_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-16 22:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved_stock',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Stock reservado'),
+        ),
+    ]
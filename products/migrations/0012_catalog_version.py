@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-16 22:31
+
+import time
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    """
+    La versión empieza en la hora actual en milisegundos, mayor que las
+    versiones que usaba la caché.
+    """
+    CatalogVersion = apps.get_model('products', 'CatalogVersion')
+    CatalogVersion.objects.get_or_create(pk=1, defaults={'version': int(time.time() * 1000)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(verbose_name='Versión')),
+                ('changed_at', models.DateTimeField(auto_now=True, verbose_name='Último cambio')),
+            ],
+            options={
+                'verbose_name': 'Versión del catálogo',
+                'verbose_name_plural': 'Versión del catálogo',
+            },
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:17
+
+from django.db import migrations
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+
+def merge_case_duplicates(apps, schema_editor):
+    """
+    Antes de la restricción única de LOWER(name) (migración siguiente),
+    fusiona las categorías y marcas cuyo nombre solo difiere en mayúsculas:
+    los productos pasan a la más antigua y las demás se eliminan dejando su
+    registro de borrado para la sincronización.
+    """
+    Product = apps.get_model('products', 'Product')
+    CatalogTombstone = apps.get_model('products', 'CatalogTombstone')
+    CatalogVersion = apps.get_model('products', 'CatalogVersion')
+    merged = False
+    for model_name, field in (('category', 'category_id'), ('brand', 'brand_id')):
+        model = apps.get_model('products', model_name)
+        keep = {}
+        for pk, lowered in model.objects.annotate(lowered=Lower('name')).order_by('pk').values_list('pk', 'lowered'):
+            target = keep.setdefault(lowered, pk)
+            if target == pk:
+                continue
+            Product.objects.filter(**{field: pk}).update(**{field: target, 'updated_at': timezone.now()})
+            model.objects.filter(pk=pk).delete()
+            CatalogTombstone.objects.create(model=model_name, object_id=pk)
+            merged = True
+    if merged:
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1, changed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_case_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:17
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_merge_case_duplicate_names'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='brand',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='brand_name_ci_unique', violation_error_message='Ya existe una marca con este nombre.'),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='category_name_ci_unique', violation_error_message='Ya existe una categoría con este nombre.'),
+        ),
+    ]
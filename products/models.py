@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models import Count, Prefetch
+from django.db.models.functions import Lower
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 from cloudinary.models import CloudinaryField
 
@@ -18,11 +21,27 @@ class Category(models.Model):
         null=True,
         verbose_name='Descripción'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Última actualización'
+    )
     
     class Meta:
         verbose_name = 'Categoría'
         verbose_name_plural = 'Categorías'
         ordering = ['name']
+        indexes = [
+            # Soporta la sincronización incremental por (updated_at, id)
+            models.Index(fields=['updated_at', 'id'], name='category_sync_idx'),
+        ]
+        constraints = [
+            # "Audio" y "audio" son la misma categoría (importaciones incluidas)
+            models.UniqueConstraint(
+                Lower('name'),
+                name='category_name_ci_unique',
+                violation_error_message='Ya existe una categoría con este nombre.',
+            ),
+        ]
     
     def __str__(self):
         return self.name
@@ -66,15 +85,49 @@ class Brand(models.Model):
         verbose_name = 'Marca'
         verbose_name_plural = 'Marcas'
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='brand_sync_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                Lower('name'),
+                name='brand_name_ci_unique',
+                violation_error_message='Ya existe una marca con este nombre.',
+            ),
+        ]
     
     def __str__(self):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    """
+    QuerySet con rutas de lectura optimizadas para productos.
+    """
+
+    def with_catalog_details(self):
+        """
+        Precarga categoría y marca anotadas con su número de productos.
+        El costo en consultas es constante sin importar cuántos productos haya.
+        """
+        return self.prefetch_related(
+            Prefetch('category', queryset=Category.objects.annotate(products_count=Count('products'))),
+            Prefetch('brand', queryset=Brand.objects.annotate(products_count=Count('products'))),
+        )
+
+
 class Product(models.Model):
     """
     Modelo para los productos del sistema.
     """
+    sku = models.CharField(
+        max_length=64,
+        unique=True,
+        blank=True,
+        null=True,
+        verbose_name='SKU',
+        help_text='Código único del producto; clave para importaciones masivas.'
+    )
     name = models.CharField(
         max_length=255,
         verbose_name='Nombre'
@@ -93,6 +146,13 @@ class Product(models.Model):
         default=0,
         verbose_name='Stock'
     )
+    # Reservas de carrito sin liberar, mantenido con UPDATE condicionales
+    # por orders.reservations (ver comando release_reservations --recount)
+    reserved_stock = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Stock reservado'
+    )
     category = models.ForeignKey(
         Category,
         on_delete=models.CASCADE,
@@ -120,15 +180,63 @@ class Product(models.Model):
         auto_now=True,
         verbose_name='Última actualización'
     )
+    # Agregados de reseñas, mantenidos por products.ratings al crear,
+    # editar o borrar reseñas (ver comando rebuild_ratings)
+    rating_avg = models.DecimalField(
+        max_digits=3,
+        decimal_places=2,
+        default=0,
+        verbose_name='Calificación promedio'
+    )
+    rating_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Número de reseñas'
+    )
+    rating_1 = models.PositiveIntegerField(default=0, verbose_name='Reseñas de 1 estrella')
+    rating_2 = models.PositiveIntegerField(default=0, verbose_name='Reseñas de 2 estrellas')
+    rating_3 = models.PositiveIntegerField(default=0, verbose_name='Reseñas de 3 estrellas')
+    rating_4 = models.PositiveIntegerField(default=0, verbose_name='Reseñas de 4 estrellas')
+    rating_5 = models.PositiveIntegerField(default=0, verbose_name='Reseñas de 5 estrellas')
+    # Mantenido por un trigger de PostgreSQL (ver migración 0007) junto con su
+    # índice GIN. En SQLite queda vacío y la búsqueda usa icontains.
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Vector de búsqueda'
+    )
+
+    objects = ProductQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
         ordering = ['-created_at']
+        indexes = [
+            # Soporta la paginación keyset por (-created_at, -id)
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='product_sync_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Un save() completo con una instancia leída antes no debe pisar el
+        # contador de reservas, que cambia de forma concurrente
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'reserved_stock'
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        """
+        Número de reseñas por estrellas (1 a 5).
+        """
+        return {str(stars): getattr(self, f'rating_{stars}') for stars in range(1, 6)}
+
 
 class Review(models.Model):
     """
@@ -170,6 +278,64 @@ class Review(models.Model):
         # Evitar que un usuario deje más de una reseña por producto
         unique_together = ('product', 'user')
         ordering = ['-created_at']
+        indexes = [
+            # Soporta la paginación keyset por (-created_at, -id)
+            models.Index(fields=['-created_at', '-id'], name='review_created_idx'),
+        ]
 
     def __str__(self):
         return f'Reseña de {self.user.username} para {self.product.name} ({self.rating} estrellas)'
+
+
+class CatalogTombstone(models.Model):
+    """
+    Registro de borrado de un producto, categoría o marca, para que los
+    clientes de sincronización incremental puedan eliminarlo localmente.
+    """
+    MODEL_CHOICES = [
+        ('product', 'Producto'),
+        ('category', 'Categoría'),
+        ('brand', 'Marca'),
+    ]
+
+    model = models.CharField(
+        max_length=20,
+        choices=MODEL_CHOICES,
+        verbose_name='Modelo'
+    )
+    object_id = models.BigIntegerField(verbose_name='ID del objeto')
+    deleted_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Fecha de borrado'
+    )
+
+    class Meta:
+        verbose_name = 'Registro de borrado'
+        verbose_name_plural = 'Registros de borrado'
+        ordering = ['deleted_at', 'id']
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_sync_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} #{self.object_id} borrado'
+
+
+class CatalogVersion(models.Model):
+    """
+    Versión del catálogo (una sola fila). Vive en la base de datos y no en
+    la caché para que todos los workers la compartan aunque la caché sea
+    local a cada proceso (ver products.cache).
+    """
+    version = models.BigIntegerField(verbose_name='Versión')
+    changed_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Último cambio'
+    )
+
+    class Meta:
+        verbose_name = 'Versión del catálogo'
+        verbose_name_plural = 'Versión del catálogo'
+
+    def __str__(self):
+        return f'Catálogo v{self.version}'
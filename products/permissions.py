@@ -1,5 +1,5 @@
 from rest_framework import permissions
-from orders.models import Order, OrderItem
+from orders.purchases import purchased_product_ids
 from .models import Review
 
 
@@ -30,13 +30,10 @@ class HasPurchasedProduct(permissions.BasePermission):
         return True  # Simplificamos aquí, validación real en create()
 
     # Método extra para validar en la creación (llamado desde el ViewSet)
+    # Usa el conjunto cacheado de productos comprados (órdenes PAGADO)
     @staticmethod
     def check_purchase(user, product_id):
-        return OrderItem.objects.filter(
-            order__user=user,
-            order__status='PAGADO',  # O el estado que indique compra completada
-            product_id=product_id
-        ).exists()
+        return int(product_id) in purchased_product_ids(user)
 
 
 class IsReviewAuthorOrReadOnly(permissions.BasePermission):
@@ -0,0 +1,112 @@
+"""
+Agregados de reseñas desnormalizados en Product.
+
+`apply_rating_change` actualiza promedio, conteo e histograma con un solo
+UPDATE basado en expresiones F(), sin leer la fila del producto, por lo que
+es seguro ante reseñas concurrentes. `rebuild_ratings` recalcula los valores
+desde Review por lotes y detecta desviaciones.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, FloatField, Q, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Now
+
+from .models import Product, Review
+
+STARS = range(1, 6)
+RATING_FIELDS = ['rating_avg', 'rating_count'] + [f'rating_{stars}' for stars in STARS]
+
+
+def _histogram_delta(added, removed):
+    delta = {stars: 0 for stars in STARS}
+    if added is not None:
+        delta[added] += 1
+    if removed is not None:
+        delta[removed] -= 1
+    return delta
+
+
+def apply_rating_change(product_id, added=None, removed=None):
+    """
+    Aplica a un producto el alta (`added`), baja (`removed`) o cambio
+    (ambos) de una calificación de 1 a 5 estrellas.
+    """
+    delta = _histogram_delta(added, removed)
+    if not any(delta.values()):
+        return
+    count_delta = sum(delta.values())
+
+    new_buckets = {stars: F(f'rating_{stars}') + delta[stars] for stars in STARS}
+    new_count = F('rating_count') + count_delta
+    new_sum = sum(stars * new_buckets[stars] for stars in STARS)
+
+    decimal_field = DecimalField(max_digits=3, decimal_places=2)
+    updates = {f'rating_{stars}': new_buckets[stars] for stars in STARS if delta[stars]}
+    updates['rating_count'] = new_count
+    updates['rating_avg'] = Coalesce(
+        Cast(
+            Cast(new_sum, FloatField()) / NullIf(new_count, 0),
+            decimal_field,
+        ),
+        Value(Decimal('0.00')),
+        output_field=decimal_field,
+    )
+    updates['updated_at'] = Now()
+
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def compute_ratings(product_ids):
+    """
+    Calcula desde Review los agregados de los productos indicados.
+    """
+    aggregates = {f'rating_{stars}': Count('id', filter=Q(rating=stars)) for stars in STARS}
+    rows = Review.objects.filter(product_id__in=product_ids).order_by().values(
+        'product_id'
+    ).annotate(**aggregates)
+
+    result = {}
+    for row in rows:
+        buckets = {f'rating_{stars}': row[f'rating_{stars}'] for stars in STARS}
+        count = sum(buckets.values())
+        total = sum(stars * row[f'rating_{stars}'] for stars in STARS)
+        avg = (Decimal(total) / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if count else Decimal('0.00')
+        result[row['product_id']] = dict(buckets, rating_count=count, rating_avg=avg)
+    return result
+
+
+def rebuild_ratings(batch_size=1000, dry_run=False):
+    """
+    Recalcula los agregados de todos los productos por lotes.
+
+    Devuelve la lista de ids de productos cuyos valores almacenados no
+    coincidían con los calculados. Con `dry_run` solo detecta la desviación.
+    """
+    empty = dict({f'rating_{stars}': 0 for stars in STARS}, rating_count=0, rating_avg=Decimal('0.00'))
+    drifted = []
+    last_id = 0
+
+    while True:
+        products = list(
+            Product.objects.filter(pk__gt=last_id).order_by('pk').only('pk', *RATING_FIELDS)[:batch_size]
+        )
+        if not products:
+            break
+        last_id = products[-1].pk
+
+        computed = compute_ratings([product.pk for product in products])
+        changed = []
+        for product in products:
+            expected = computed.get(product.pk, empty)
+            if any(getattr(product, field) != expected[field] for field in RATING_FIELDS):
+                for field in RATING_FIELDS:
+                    setattr(product, field, expected[field])
+                changed.append(product)
+
+        drifted.extend(product.pk for product in changed)
+        if changed and not dry_run:
+            with transaction.atomic():
+                Product.objects.bulk_update(changed, RATING_FIELDS)
+
+    return drifted
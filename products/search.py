@@ -0,0 +1,39 @@
+"""
+Búsqueda de productos por texto.
+
+En PostgreSQL usa el `search_vector` mantenido por trigger (índice GIN) y
+ordena por relevancia. En otros motores (SQLite en desarrollo/tests) cae a
+`icontains` sobre nombre, descripción, marca y categoría.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+
+# Debe coincidir con la configuración usada por el trigger (migración 0007)
+SEARCH_CONFIG = 'spanish'
+
+
+def search_products(queryset, term, ranked=True):
+    """
+    Filtra `queryset` por `term` y lo ordena por relevancia cuando es posible.
+    Con `ranked=False` solo filtra (útil para agregaciones).
+    """
+    term = term.strip()
+    if not term:
+        return queryset
+
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+        queryset = queryset.filter(search_vector=query)
+        if ranked:
+            queryset = queryset.annotate(
+                search_rank=SearchRank(F('search_vector'), query)
+            ).order_by('-search_rank', '-id')
+        return queryset
+
+    return queryset.filter(
+        Q(name__icontains=term)
+        | Q(description__icontains=term)
+        | Q(brand__name__icontains=term)
+        | Q(category__name__icontains=term)
+    )
@@ -1,8 +1,10 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from smartsales_backend.serializers import SparseFieldsMixin
 from .models import Category, Product, Brand, Review
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer para el modelo Category.
     """
@@ -12,15 +14,26 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', 'description', 'products_count']
         read_only_fields = ['id']
+        # Misma regla que la restricción única de LOWER(name)
+        extra_kwargs = {
+            'name': {'validators': [UniqueValidator(
+                queryset=Category.objects.all(), lookup='iexact',
+                message='Ya existe una categoría con este nombre.',
+            )]},
+        }
     
     def get_products_count(self, obj):
         """
         Retorna el número de productos en esta categoría.
+        Usa la anotación `products_count` si el queryset la trae precargada.
         """
-        return obj.products.count()
+        count = getattr(obj, 'products_count', None)
+        if count is None:
+            count = obj.products.count()
+        return count
 
 
-class BrandSerializer(serializers.ModelSerializer):
+class BrandSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer para el modelo Brand.
     """
@@ -30,18 +43,29 @@ class BrandSerializer(serializers.ModelSerializer):
         model = Brand
         fields = ['id', 'name', 'description', 'warranty_info', 'warranty_duration_months', 'products_count', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        extra_kwargs = {
+            'name': {'validators': [UniqueValidator(
+                queryset=Brand.objects.all(), lookup='iexact',
+                message='Ya existe una marca con este nombre.',
+            )]},
+        }
     
     def get_products_count(self, obj):
         """
         Retorna el número de productos de esta marca.
+        Usa la anotación `products_count` si el queryset la trae precargada.
         """
-        return obj.products.count()
+        count = getattr(obj, 'products_count', None)
+        if count is None:
+            count = obj.products.count()
+        return count
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer para el modelo Product.
     Muestra detalles de categoría y marca.
+    Admite ?fields= y ?expand= (category_detail, brand).
     """
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_detail = CategorySerializer(source='category', read_only=True)
@@ -60,10 +84,13 @@ class ProductSerializer(serializers.ModelSerializer):
         allow_null=True
     )
     
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    
     class Meta:
         model = Product
         fields = [
             'id',
+            'sku',
             'name',
             'description',
             'price',
@@ -75,10 +102,17 @@ class ProductSerializer(serializers.ModelSerializer):
             'brand',
             'brand_id',
             'image',
+            'rating_avg',
+            'rating_count',
+            'rating_histogram',
             'created_at',
             'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'category_name', 'category_detail', 'brand']
+        read_only_fields = [
+            'id', 'created_at', 'updated_at', 'category_name', 'category_detail', 'brand',
+            'rating_avg', 'rating_count',
+        ]
+        expandable_fields = ['category_detail', 'brand']
     
     def validate_price(self, value):
         """
@@ -96,6 +130,62 @@ class ProductSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("El stock no puede ser negativo.")
         return value
 
+    def validate_sku(self, value):
+        """
+        Normaliza el SKU: vacío equivale a sin SKU.
+        """
+        if value is None:
+            return None
+        return value.strip() or None
+
+
+class CategorySyncSerializer(serializers.ModelSerializer):
+    """
+    Representación plana de Category para la sincronización incremental.
+    """
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'description', 'updated_at']
+
+
+class BrandSyncSerializer(serializers.ModelSerializer):
+    """
+    Representación plana de Brand para la sincronización incremental.
+    """
+    class Meta:
+        model = Brand
+        fields = ['id', 'name', 'description', 'warranty_info', 'warranty_duration_months', 'updated_at']
+
+
+class ProductSyncSerializer(serializers.ModelSerializer):
+    """
+    Representación plana de Product (relaciones por id) para la
+    sincronización incremental.
+    """
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'sku', 'name', 'description', 'price', 'stock', 'category', 'brand',
+            'image', 'rating_avg', 'rating_count', 'created_at', 'updated_at',
+        ]
+
+
+class StockAdjustmentSerializer(serializers.Serializer):
+    """
+    Ajuste de stock de un producto: `delta` (relativo) o `absolute`.
+    """
+    product_id = serializers.IntegerField()
+    delta = serializers.IntegerField(required=False)
+    absolute = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, data):
+        """
+        Exige exactamente uno de `delta` o `absolute`.
+        """
+        if ('delta' in data) == ('absolute' in data):
+            raise serializers.ValidationError("Indica exactamente uno de 'delta' o 'absolute'.")
+        return data
+
 
 class ReviewSerializer(serializers.ModelSerializer):
     """
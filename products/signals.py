@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .models import Brand, CatalogTombstone, Category, Product, Review
+from .ratings import apply_rating_change
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def invalidate_catalog_cache(sender, **kwargs):
+    """
+    Incrementa la versión del catálogo cuando la transacción se confirma.
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Brand)
+def record_tombstone(sender, instance, **kwargs):
+    """
+    Registra el borrado para la sincronización incremental del catálogo.
+    """
+    CatalogTombstone.objects.create(model=sender._meta.model_name, object_id=instance.pk)
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, **kwargs):
+    """
+    Guarda producto y calificación anteriores para ajustar los agregados.
+    """
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = Review.objects.filter(pk=instance.pk).values_list(
+            'product_id', 'rating'
+        ).first()
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        apply_rating_change(instance.product_id, added=instance.rating)
+        return
+
+    previous_product_id, previous_rating = previous
+    if previous_product_id == instance.product_id:
+        apply_rating_change(instance.product_id, added=instance.rating, removed=previous_rating)
+    else:
+        apply_rating_change(previous_product_id, removed=previous_rating)
+        apply_rating_change(instance.product_id, added=instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    apply_rating_change(instance.product_id, removed=instance.rating)
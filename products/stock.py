@@ -0,0 +1,73 @@
+"""
+Ajustes masivos de stock.
+
+Cada lote bloquea sus productos (SELECT ... FOR UPDATE en orden de id),
+calcula el stock resultante en memoria y lo escribe con un único
+UPDATE ... CASE. Los ajustes que dejarían el stock en negativo se rechazan
+individualmente sin afectar al resto.
+"""
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Now
+
+from .models import Product
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def adjust_stock(entries, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Aplica `entries` (dicts con product_id y delta o absolute) y devuelve
+    (resultados, errores). Las entradas de un mismo producto se aplican en
+    orden dentro del mismo lote.
+    """
+    by_product = {}
+    for index, entry in enumerate(entries):
+        by_product.setdefault(entry['product_id'], []).append((index, entry))
+
+    results = {}
+    errors = []
+    product_ids = sorted(by_product)
+    for batch_ids in _batches(product_ids, batch_size):
+        with transaction.atomic():
+            current = dict(
+                Product.objects.select_for_update().filter(pk__in=batch_ids)
+                .order_by('pk').values_list('pk', 'stock')
+            )
+            final = {}
+            for product_id in batch_ids:
+                if product_id not in current:
+                    for index, _ in by_product[product_id]:
+                        errors.append({'index': index, 'product_id': product_id, 'error': 'Producto no encontrado'})
+                    continue
+                stock = current[product_id]
+                for index, entry in by_product[product_id]:
+                    new_stock = entry['absolute'] if entry.get('absolute') is not None else stock + entry['delta']
+                    if new_stock < 0:
+                        errors.append({
+                            'index': index,
+                            'product_id': product_id,
+                            'error': f'El stock no puede ser negativo. Disponible: {stock}',
+                        })
+                        continue
+                    stock = new_stock
+                if stock != current[product_id]:
+                    final[product_id] = stock
+                results[product_id] = stock
+
+            if final:
+                Product.objects.filter(pk__in=final).update(
+                    stock=Case(
+                        *[When(pk=pk, then=Value(stock)) for pk, stock in final.items()],
+                        output_field=IntegerField(),
+                    ),
+                    updated_at=Now(),
+                )
+
+    errors.sort(key=lambda error: error['index'])
+    return [{'product_id': pk, 'stock': stock} for pk, stock in results.items()], errors
@@ -0,0 +1,183 @@
+"""
+Sincronización incremental del catálogo.
+
+Los cambios de categorías, marcas, productos y borrados (CatalogTombstone)
+forman una única secuencia ordenada por (fecha, tipo, id). El cursor es la
+última posición entregada; cada página lee como máximo `limit + 1` filas
+de cada flujo usando los índices (updated_at, id), por lo que ponerse al
+día cuesta O(cambios) y no O(catálogo).
+
+El cursor también lleva `synced_at`: todo borrado anterior a esa fecha ya
+se entregó al cliente o afecta a filas que nunca recibió. Es el horizonte
+de la última página sin `has_more`, o el inicio de una sincronización
+completa, y se conserva mientras quedan páginas. La caducidad se mide con
+esa fecha y no con la del último cambio, que puede ser muy antigua en un
+catálogo que apenas cambia.
+
+Horizonte: solo se entregan cambios con fecha <= horizonte. Las escrituras
+fechan `updated_at` con Now(), que es el inicio de su transacción, así que
+una transacción larga confirma filas con una fecha anterior a otras ya
+entregadas; si el horizonte las hubiera pasado, el cliente no las vería
+nunca. En PostgreSQL el horizonte es el `xact_start` más antiguo de las
+transacciones abiertas en la base de datos (pg_stat_activity) menos
+CATALOG_SYNC_SAFETY_SECONDS, que cubre las fechas que se calculan en Python
+(auto_now) antes de la primera sentencia y el desfase de reloj entre
+servidores. Limitaciones:
+
+- Una transacción que queda abierta (p. ej. "idle in transaction") frena
+  el horizonte: los clientes no reciben cambios nuevos hasta que termine,
+  pero no pierden ninguno.
+- El usuario de la base de datos debe poder ver las sesiones de los demás
+  procesos de la aplicación (mismo rol o pg_read_all_stats).
+- En otras bases de datos el horizonte es solo "ahora menos
+  CATALOG_SYNC_SAFETY_SECONDS": una transacción de escritura más larga que
+  ese margen puede perder cambios.
+"""
+import base64
+import binascii
+import heapq
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Brand, CatalogTombstone, Category, Product
+from .serializers import BrandSyncSerializer, CategorySyncSerializer, ProductSyncSerializer
+
+# Orden de desempate entre flujos con la misma fecha
+STREAMS = (
+    ('categories', Category, 'updated_at', CategorySyncSerializer),
+    ('brands', Brand, 'updated_at', BrandSyncSerializer),
+    ('products', Product, 'updated_at', ProductSyncSerializer),
+    ('deleted', CatalogTombstone, 'deleted_at', None),
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorExpired(Exception):
+    """
+    El cursor es anterior a la retención de registros de borrado: el
+    cliente debe hacer una sincronización completa.
+    """
+
+
+def encode_cursor(position, synced_at=None):
+    timestamp, rank, pk = position
+    synced_at = synced_at or timestamp
+    raw = f'{timestamp.isoformat()}|{rank}|{pk}|{synced_at.isoformat()}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Devuelve ((fecha, rank, id), synced_at). Los cursores sin `synced_at`
+    (emitidos antes de añadirlo) usan la fecha de la posición.
+    """
+    try:
+        parts = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        if len(parts) == 3:
+            parts.append(parts[0])
+        timestamp, rank, pk, synced_at = parts
+        timestamp = datetime.fromisoformat(timestamp)
+        return (timestamp, int(rank), int(pk)), datetime.fromisoformat(synced_at)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor('Cursor inválido.')
+
+
+def _after(field, rank, position):
+    """
+    Condición "(fecha, rank, id) > posición" para un flujo con `rank` fijo.
+    """
+    timestamp, cursor_rank, pk = position
+    condition = Q(**{f'{field}__gt': timestamp})
+    if rank > cursor_rank:
+        condition |= Q(**{field: timestamp})
+    elif rank == cursor_rank:
+        condition |= Q(**{field: timestamp, 'pk__gt': pk})
+    return condition
+
+
+def _tombstone_representation(tombstone):
+    return {'type': tombstone.model, 'id': tombstone.object_id, 'deleted_at': tombstone.deleted_at}
+
+
+def sync_horizon():
+    """
+    Fecha hasta la que se pueden entregar cambios sin saltarse filas de
+    transacciones aún sin confirmar (ver el docstring del módulo).
+    """
+    safety = timedelta(seconds=settings.CATALOG_SYNC_SAFETY_SECONDS)
+    if connection.vendor != 'postgresql':
+        return timezone.now() - safety
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT LEAST(clock_timestamp(), MIN(xact_start)) FROM pg_stat_activity '
+            'WHERE datname = current_database() AND pid <> pg_backend_pid() '
+            'AND xact_start IS NOT NULL'
+        )
+        oldest = cursor.fetchone()[0]
+    # `updated_at <= horizonte`: la transacción más antigua queda fuera
+    return oldest - safety - timedelta(microseconds=1)
+
+
+def get_changes(cursor=None, limit=500):
+    """
+    Devuelve la siguiente página de cambios posteriores a `cursor`.
+
+    Los cambios posteriores a `sync_horizon()` no se entregan todavía, para
+    no saltarse filas de transacciones aún sin confirmar con una fecha
+    anterior a la de otras ya confirmadas.
+    """
+    now = timezone.now()
+    horizon = sync_horizon()
+
+    if cursor:
+        position, synced_at = decode_cursor(cursor)
+        retention = now - timedelta(days=settings.CATALOG_TOMBSTONE_RETENTION_DAYS)
+        if synced_at < retention:
+            raise CursorExpired()
+    else:
+        # Los borrados anteriores no afectan a un cliente que empieza de cero
+        position, synced_at = None, now
+
+    candidates = []
+    has_more = False
+    for rank, (name, model, field, _) in enumerate(STREAMS):
+        queryset = model.objects.filter(**{f'{field}__lte': horizon})
+        if position is not None:
+            queryset = queryset.filter(_after(field, rank, position))
+        rows = list(queryset.order_by(field, 'pk')[:limit + 1])
+        if len(rows) > limit:
+            has_more = True
+            rows = rows[:limit]
+        candidates.append([(getattr(row, field), rank, row.pk, row) for row in rows])
+
+    page = list(heapq.merge(*candidates, key=lambda item: item[:3]))
+    if len(page) > limit:
+        has_more = True
+        page = page[:limit]
+
+    result = {name: [] for name, _, _, _ in STREAMS}
+    for timestamp, rank, pk, row in page:
+        name, _, _, serializer_class = STREAMS[rank]
+        if serializer_class is None:
+            result[name].append(_tombstone_representation(row))
+        else:
+            result[name].append(serializer_class(row).data)
+
+    if page:
+        next_position = page[-1][:3]
+    else:
+        next_position = position
+
+    if not has_more:
+        # Se entregó todo hasta el horizonte, borrados incluidos
+        synced_at = max(synced_at, horizon)
+    result['next_cursor'] = encode_cursor(next_position, synced_at) if next_position else None
+    result['has_more'] = has_more
+    return result
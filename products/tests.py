@@ -1,3 +1,762 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.functions import Now
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.models import Order, OrderItem
+from orders.purchases import purchased_product_ids
+from .cache import bump_catalog_version, catalog_version
+from .models import Category, Brand, CatalogTombstone, CatalogVersion, Product, Review
+from .importer import ProductImporter, iter_rows
+from .ratings import apply_rating_change, rebuild_ratings
+from .stock import adjust_stock
+from .sync import decode_cursor, encode_cursor
+
+
+class ProductListQueryCountTests(TestCase):
+    """
+    El listado de productos debe costar un número constante de consultas.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def _create_products(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_products_uncommitted(count)
+
+    def _create_products_uncommitted(self, count):
+        for i in range(count):
+            category = Category.objects.create(name=f'Categoría {Category.objects.count()}')
+            brand = Brand.objects.create(name=f'Marca {Brand.objects.count()}')
+            Product.objects.create(
+                name=f'Producto {i}',
+                price='10.00',
+                stock=5,
+                category=category,
+                brand=brand,
+            )
+
+    def _count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_catalog(self):
+        self._create_products(2)
+        small = self._count_list_queries()
+
+        self._create_products(10)
+        large = self._count_list_queries()
+
+        self.assertEqual(small, large)
+
+    def test_nested_products_count(self):
+        self._create_products(1)
+        category = Category.objects.get()
+        Product.objects.create(name='Extra', price='1.00', category=category)
+
+        response = self.client.get('/api/products/')
+        for item in response.json()['results']:
+            self.assertEqual(item['category_detail']['products_count'], 2)
+
+
+class ProductPaginationTests(TestCase):
+    """
+    Paginación keyset del listado de productos.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='General')
+        for i in range(5):
+            Product.objects.create(name=f'Producto {i}', price='1.00', category=category)
+
+    def test_cursor_walks_all_products_once(self):
+        seen = []
+        url = '/api/products/?page_size=2'
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(item['id'] for item in data['results'])
+            url = data['next']
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list('id', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_unpaginated_opt_in(self):
+        response = self.client.get('/api/products/?paginate=false')
+        self.assertEqual(len(response.json()), 5)
+
+
+class ProductSearchTests(TestCase):
+    """
+    Búsqueda ?q= (en SQLite usa el fallback icontains).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        laptops = Category.objects.create(name='Laptops')
+        phones = Category.objects.create(name='Celulares')
+        acme = Brand.objects.create(name='Acme')
+        Product.objects.create(name='Portátil Pro', price='900.00', category=laptops)
+        Product.objects.create(name='Teléfono X', price='500.00', category=phones, brand=acme)
+        Product.objects.create(name='Funda', description='Compatible con Teléfono X', price='5.00', category=phones)
+
+    def _search(self, term):
+        response = self.client.get('/api/products/', {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['name'] for item in response.json()['results'])
+
+    def test_matches_name_description_brand_and_category(self):
+        self.assertEqual(self._search('teléfono'), ['Funda', 'Teléfono X'])
+        self.assertEqual(self._search('acme'), ['Teléfono X'])
+        self.assertEqual(self._search('laptops'), ['Portátil Pro'])
+
+    def test_search_is_page_number_paginated(self):
+        response = self.client.get('/api/products/', {'q': 'teléfono', 'page_size': 1})
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(len(data['results']), 1)
+
+
+class ProductFacetsTests(TestCase):
+    """
+    Endpoint de facetas del catálogo.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.laptops = Category.objects.create(name='Laptops')
+        self.phones = Category.objects.create(name='Celulares')
+        self.acme = Brand.objects.create(name='Acme')
+        Product.objects.create(name='A', price='20.00', stock=0, category=self.laptops, brand=self.acme)
+        Product.objects.create(name='B', price='120.00', stock=3, category=self.laptops)
+        Product.objects.create(name='C', price='2000.00', stock=1, category=self.phones, brand=self.acme)
+
+    def test_counts(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/products/facets/').json()
+        # Versión del catálogo + tres agregados + conteo de stock (sin caché)
+        self.assertEqual(len(ctx.captured_queries), 5)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['in_stock'], 2)
+        self.assertEqual(
+            {c['name']: c['count'] for c in data['categories']},
+            {'Laptops': 2, 'Celulares': 1},
+        )
+        self.assertEqual(data['brands'], [{'id': self.acme.id, 'name': 'Acme', 'count': 2}])
+        self.assertEqual([r['count'] for r in data['price_ranges']], [1, 0, 1, 0, 0, 1])
+
+    def test_category_filter_keeps_category_alternatives(self):
+        data = self.client.get('/api/products/facets/', {'category': self.laptops.id}).json()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(len(data['categories']), 2)
+        self.assertEqual(data['brands'][0]['count'], 1)
+
+    def test_cached_per_filter_combination(self):
+        self.client.get('/api/products/facets/', {'category': self.laptops.id})
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/products/facets/', {'category': self.laptops.id})
+        # Solo la versión del catálogo y el conteo de stock
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+
+class CatalogCacheTests(TestCase):
+    """
+    Caché versionada de las lecturas del catálogo.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='General')
+
+    def test_hit_after_miss(self):
+        first = self.client.get('/api/categories/')
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get('/api/categories/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        # Versión del catálogo y validadores del GET condicional
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(first.json(), second.json())
+
+    def test_version_is_shared_across_processes(self):
+        # La versión no vive en la caché (local a cada worker sin Redis)
+        version = catalog_version()
+        cache.clear()
+        self.assertEqual(catalog_version(), version)
+        bump_catalog_version()
+        self.assertEqual(catalog_version(), version + 1)
+
+    def test_invalidated_on_save_and_delete(self):
+        self.client.get(f'/api/categories/{self.category.id}/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Renombrada'
+            self.category.save()
+        response = self.client.get(f'/api/categories/{self.category.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'Renombrada')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Nueva')
+        self.assertEqual(len(self.client.get('/api/categories/').json()), 2)
+
+    def test_stock_and_ratings_are_live_without_bumping_the_version(self):
+        product = Product.objects.create(name='A', price='1.00', stock=5, category=self.category)
+        url = f'/api/products/{product.id}/'
+        self.client.get(url)
+        self.client.get('/api/products/')
+        version = catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock([{'product_id': product.id, 'delta': -2}])
+            apply_rating_change(product.id, added=4)
+        self.assertEqual(catalog_version(), version)
+
+        detail = self.client.get(url)
+        self.assertEqual(detail['X-Cache'], 'HIT')
+        self.assertEqual(detail.json()['stock'], 3)
+        self.assertEqual(detail.json()['rating_count'], 1)
+        self.assertEqual(detail.json()['rating_histogram']['4'], 1)
+        listing = self.client.get('/api/products/')
+        self.assertEqual(listing['X-Cache'], 'HIT')
+        self.assertEqual(listing.json()['results'][0]['stock'], 3)
+        facets = self.client.get('/api/products/facets/').json()
+        self.assertEqual(facets['in_stock'], 1)
+
+    def test_params_are_normalized(self):
+        self.client.get('/api/products/?brand=1&category=2')
+        response = self.client.get('/api/products/?category=2&brand=1')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+
+class ConditionalGetTests(TestCase):
+    """
+    ETag / Last-Modified en las lecturas del catálogo.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='A', price='1.00', category=category)
+
+    def test_list_not_modified(self):
+        first = self.client.get('/api/products/')
+        self.assertIn('ETag', first)
+        self.assertIn('Last-Modified', first)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_detail_etag_changes_on_update(self):
+        url = f'/api/products/{self.product.id}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.stock = 10
+            self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_detail_is_404(self):
+        self.assertEqual(self.client.get('/api/products/0/').status_code, 404)
+        self.assertEqual(self.client.get('/api/products/abc/').status_code, 404)
+
+    def test_list_last_modified_moves_on_delete(self):
+        CatalogVersion.objects.update(changed_at=timezone.now() - timedelta(hours=1))
+        Product.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        first = self.client.get('/api/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        response = self.client.get('/api/products/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+
+    def test_non_catalog_lists_have_no_last_modified(self):
+        response = self.client.get('/api/reviews/')
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+
+class ProductRatingAggregateTests(TestCase):
+    """
+    Agregados de reseñas desnormalizados en Product.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        self.users = [User.objects.create_user(username=f'u{i}', password='x') for i in range(3)]
+        category = Category.objects.create(name='General')
+        self.product = Product.objects.create(name='A', price='1.00', category=category)
+
+    def _refresh(self):
+        self.product.refresh_from_db()
+        return self.product
+
+    def test_create_update_delete(self):
+        Review.objects.create(product=self.product, user=self.users[0], rating=5)
+        review = Review.objects.create(product=self.product, user=self.users[1], rating=4)
+        Review.objects.create(product=self.product, user=self.users[2], rating=4)
+        product = self._refresh()
+        self.assertEqual(product.rating_count, 3)
+        self.assertEqual(product.rating_avg, Decimal('4.33'))
+        self.assertEqual(product.rating_histogram, {'1': 0, '2': 0, '3': 0, '4': 2, '5': 1})
+
+        review.rating = 1
+        review.save()
+        product = self._refresh()
+        self.assertEqual(product.rating_count, 3)
+        self.assertEqual(product.rating_avg, Decimal('3.33'))
+        self.assertEqual(product.rating_1, 1)
+        self.assertEqual(product.rating_4, 1)
+
+        review.delete()
+        product = self._refresh()
+        self.assertEqual(product.rating_count, 2)
+        self.assertEqual(product.rating_avg, Decimal('4.50'))
+        self.assertEqual(rebuild_ratings(dry_run=True), [])
+
+    def test_rebuild_fixes_drift(self):
+        Review.objects.create(product=self.product, user=self.users[0], rating=3)
+        Product.objects.filter(pk=self.product.pk).update(rating_count=7, rating_avg=1)
+
+        self.assertEqual(rebuild_ratings(dry_run=True), [self.product.pk])
+        self.assertEqual(rebuild_ratings(), [self.product.pk])
+        product = self._refresh()
+        self.assertEqual(product.rating_count, 1)
+        self.assertEqual(product.rating_avg, Decimal('3.00'))
+
+
+class ReviewablePurchasesTests(TestCase):
+    """
+    Conjunto cacheado de productos comprados y endpoint /reviews/reviewable/.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='buyer', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='General')
+        self.products = [
+            Product.objects.create(name=f'P{i}', price='1.00', category=category) for i in range(3)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = Order.objects.create(user=self.user, total_price='2.00')
+            for product in self.products[:2]:
+                OrderItem.objects.create(order=self.order, product=product, quantity=1, price='1.00')
+
+    def _reviewable(self):
+        ids = ','.join(str(p.id) for p in self.products)
+        response = self.client.get('/api/reviews/reviewable/', {'product_ids': ids})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['reviewable']
+
+    def test_only_paid_and_unreviewed_products(self):
+        self.assertEqual(self._reviewable(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'PAGADO'
+            self.order.save()
+        self.assertEqual(self._reviewable(), [self.products[0].id, self.products[1].id])
+
+        Review.objects.create(product=self.products[0], user=self.user, rating=5)
+        self.assertEqual(self._reviewable(), [self.products[1].id])
+
+    def test_purchase_lookup_is_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'PAGADO'
+            self.order.save()
+        self._reviewable()
+        with CaptureQueriesContext(connection) as ctx:
+            self._reviewable()
+        # Solo la consulta de reseñas existentes
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    @override_settings(PURCHASES_CACHE_TIMEOUT=86400, PURCHASES_LOCAL_CACHE_TIMEOUT=30)
+    def test_process_local_cache_uses_short_timeout(self):
+        # Con LocMemCache la invalidación no llega a los demás workers
+        for shared, timeout in ((False, 30), (True, 86400)):
+            with mock.patch('orders.purchases.default_cache_is_shared', return_value=shared), \
+                    mock.patch('orders.purchases.cache') as purchases_cache:
+                purchases_cache.get.return_value = None
+                purchased_product_ids(self.user)
+            self.assertEqual(purchases_cache.set.call_args.args[2], timeout)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/reviews/reviewable/', {'product_ids': '1'})
+        self.assertEqual(response.status_code, 401)
+
+
+class ProductImportTests(TestCase):
+    """
+    Importación masiva de productos (upsert por SKU).
+    """
+
+    def setUp(self):
+        cache.clear()
+        admin = get_user_model().objects.create_user(username='admin', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        Category.objects.create(name='Laptops')
+
+    def _import(self, name, content, **params):
+        upload = SimpleUploadedFile(name, content if isinstance(content, bytes) else content.encode())
+        query = '&'.join(f'{k}={v}' for k, v in params.items())
+        response = self.client.post(f'/api/products/import/?{query}', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_csv_upsert_with_row_errors(self):
+        report = self._import('feed.csv', (
+            'sku,name,price,stock,category,brand\n'
+            'A1,Portátil,900.00,3,laptops,\n'
+            'A2,Sin precio,,1,Laptops,\n'
+            'A3,Otra,10,1,Inexistente,\n'
+        ))
+        self.assertEqual(report['processed'], 3)
+        self.assertEqual(report['upserted'], 1)
+        self.assertEqual([e['row'] for e in report['errors']], [2, 3])
+
+        report = self._import('feed.csv', 'sku,name,price,stock,category,brand\nA1,Portátil 2,800,5,Laptops,Acme\n',
+                              create_missing='true')
+        self.assertEqual(report['upserted'], 1)
+        product = Product.objects.get(sku='A1')
+        self.assertEqual(product.name, 'Portátil 2')
+        self.assertEqual(product.stock, 5)
+        self.assertEqual(product.brand.name, 'Acme')
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_jsonl_batches(self):
+        lines = '\n'.join(
+            f'{{"sku": "J{i}", "name": "P{i}", "price": "1.5", "category": "Laptops"}}' for i in range(5)
+        ) + '\nno es json\n'
+        report = self._import('feed.jsonl', lines, batch_size=2)
+        self.assertEqual(report['upserted'], 5)
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_invalid_utf8_is_a_row_error(self):
+        report = self._import('feed.csv', (
+            '\ufeffsku,name,price,stock,category,brand\n'
+            'B1,"Dos\nlíneas",1,1,Laptops,\n'.encode()
+            + b'B2,Mal \xe9xito,1,1,Laptops,\n'
+            + b'B3,"Otra\n\xff",1,1,Laptops,\n'
+            + b'B4,Bien,1,1,Laptops,\n'
+        ))
+        self.assertEqual(report['upserted'], 2)
+        self.assertEqual([e['row'] for e in report['errors']], [2, 3])
+        self.assertEqual(set(Product.objects.values_list('sku', flat=True)), {'B1', 'B4'})
+        self.assertEqual(Product.objects.get(sku='B1').name, 'Dos\nlíneas')
+
+        report = self._import('feed.jsonl', (
+            b'{"sku": "J1", "name": "\xe9", "price": "1", "category": "Laptops"}\n'
+            b'{"sku": "J2", "name": "P", "price": "1", "category": "Laptops"}\n'
+        ))
+        self.assertEqual(report['upserted'], 1)
+        self.assertIn('UTF-8', report['errors'][0]['errors']['non_field_errors'][0])
+
+    def test_created_names_ignore_case_and_concurrent_imports(self):
+        importer = ProductImporter(create_missing=True)
+        # Otra importación crea la marca después de que este importador cargó sus mapas
+        Brand.objects.create(name='ACME')
+        report = importer.run([
+            {'sku': 'C1', 'name': 'A', 'price': '1', 'category': 'Audio', 'brand': 'acme'},
+            {'sku': 'C2', 'name': 'B', 'price': '1', 'category': 'AUDIO', 'brand': 'Acme'},
+            {'sku': 'C3', 'name': 'C', 'price': '1', 'category': 'laptops', 'brand': ''},
+        ])
+        self.assertEqual(report.upserted, 3)
+        self.assertEqual(Brand.objects.count(), 1)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Category.objects.get(name__iexact='audio').products.count(), 2)
+        self.assertEqual(set(Product.objects.values_list('brand__name', flat=True)), {'ACME', None})
+
+        response = self.client.post('/api/categories/', {'name': 'audio'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['name'], ['Ya existe una categoría con este nombre.'])
+
+    def test_iter_rows_leaves_stream_open(self):
+        stream = BytesIO(b'sku,name\nA,B\n')
+        self.assertEqual(list(iter_rows(stream, 'csv')), [{'sku': 'A', 'name': 'B'}])
+        self.assertFalse(stream.closed)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(None)
+        upload = SimpleUploadedFile('feed.csv', b'sku\n')
+        response = self.client.post('/api/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 401)
+
+
+class BulkStockTests(TestCase):
+    """
+    Ajuste masivo de stock.
+    """
+
+    def setUp(self):
+        admin = get_user_model().objects.create_user(username='admin', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        category = Category.objects.create(name='General')
+        self.a = Product.objects.create(name='A', price='1.00', stock=5, category=category)
+        self.b = Product.objects.create(name='B', price='1.00', stock=1, category=category)
+
+    def test_applies_and_rejects_negative(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/products/stock/', [
+                {'product_id': self.a.id, 'delta': -2},
+                {'product_id': self.b.id, 'delta': -3},
+                {'product_id': self.a.id, 'absolute': 10},
+                {'product_id': 0, 'delta': 1},
+            ], format='json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            {r['product_id']: r['stock'] for r in data['results']},
+            {self.a.id: 10, self.b.id: 1},
+        )
+        self.assertEqual([e['index'] for e in data['errors']], [1, 3])
+        self.a.refresh_from_db()
+        self.b.refresh_from_db()
+        self.assertEqual((self.a.stock, self.b.stock), (10, 1))
+        update_queries = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(update_queries), 1)
+
+    def test_requires_delta_or_absolute(self):
+        response = self.client.post('/api/products/stock/', [{'product_id': self.a.id}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SparseFieldsetTests(TestCase):
+    """
+    ?fields= y ?expand= en el listado de productos.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='General')
+        brand = Brand.objects.create(name='Acme')
+        for i in range(3):
+            Product.objects.create(name=f'P{i}', price='1.00', category=category, brand=brand)
+
+    def test_fields_prunes_payload_and_queries(self):
+        full = CaptureQueriesContext(connection)
+        with full:
+            self.client.get('/api/products/')
+        cache.clear()
+        with CaptureQueriesContext(connection) as sparse:
+            response = self.client.get('/api/products/', {'fields': 'id,name,price'})
+        item = response.json()['results'][0]
+        self.assertEqual(set(item), {'id', 'name', 'price'})
+        self.assertLess(len(sparse.captured_queries), len(full.captured_queries))
+
+    def test_expand_controls_nested(self):
+        item = self.client.get('/api/products/', {'expand': 'brand'}).json()['results'][0]
+        self.assertIn('brand', item)
+        self.assertNotIn('category_detail', item)
+        self.assertIn('name', item)
+
+        item = self.client.get('/api/products/').json()['results'][0]
+        self.assertIn('category_detail', item)
+        self.assertIn('brand', item)
+
+    def test_nested_field_paths(self):
+        item = self.client.get('/api/products/', {'fields': 'id,brand.name'}).json()['results'][0]
+        self.assertEqual(item['brand'], {'name': 'Acme'})
+
+
+@override_settings(CATALOG_SYNC_SAFETY_SECONDS=0)
+class CatalogSyncTests(TestCase):
+    """
+    Sincronización incremental: cambios y borrados desde un cursor.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='General')
+        self.products = [
+            Product.objects.create(name=f'P{i}', price='1.00', category=self.category)
+            for i in range(3)
+        ]
+
+    def _sync(self, cursor=None, limit=None):
+        params = {}
+        if cursor:
+            params['cursor'] = cursor
+        if limit:
+            params['limit'] = limit
+        return self.client.get('/api/catalog/sync/', params)
+
+    def test_full_sync_pages_through_catalog(self):
+        seen, cursor = [], None
+        while True:
+            data = self._sync(cursor, limit=2).json()
+            seen.extend(('category', row['id']) for row in data['categories'])
+            seen.extend(('product', row['id']) for row in data['products'])
+            cursor = data['next_cursor']
+            if not data['has_more']:
+                break
+        expected = [('category', self.category.pk)] + [('product', p.pk) for p in self.products]
+        self.assertCountEqual(seen, expected)
+
+        # Sin cambios nuevos el cursor devuelve una página vacía en la misma posición
+        data = self._sync(cursor).json()
+        self.assertEqual(data['products'], [])
+        self.assertEqual(decode_cursor(data['next_cursor'])[0], decode_cursor(cursor)[0])
+
+    def test_delta_includes_updates_and_tombstones(self):
+        cursor = self._sync().json()['next_cursor']
+
+        updated, deleted = self.products[0], self.products[1]
+        updated.name = 'Renombrado'
+        updated.save()
+        deleted_id = deleted.pk
+        deleted.delete()
+
+        data = self._sync(cursor).json()
+        self.assertEqual([row['id'] for row in data['products']], [updated.pk])
+        self.assertEqual(data['products'][0]['name'], 'Renombrado')
+        self.assertEqual(data['deleted'][0]['type'], 'product')
+        self.assertEqual(data['deleted'][0]['id'], deleted_id)
+        self.assertEqual(CatalogTombstone.objects.count(), 1)
+
+    def test_invalid_and_expired_cursor(self):
+        self.assertEqual(self._sync('no-es-un-cursor').status_code, 400)
+
+        old = encode_cursor((timezone.now() - timedelta(days=365), 0, 0))
+        response = self._sync(old)
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.json()['resync'])
+
+    def _age_catalog(self, days):
+        old = timezone.now() - timedelta(days=days)
+        Category.objects.update(updated_at=old)
+        Product.objects.update(updated_at=old)
+
+    def test_full_sync_of_rows_older_than_retention(self):
+        self._age_catalog(365)
+        data = self._sync(limit=2).json()
+        self.assertTrue(data['has_more'])
+        response = self._sync(data['next_cursor'], limit=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['products']), 2)
+
+    def test_caught_up_cursor_on_unchanged_catalog_stays_valid(self):
+        self._age_catalog(365)
+        cursor = self._sync().json()['next_cursor']
+        for _ in range(2):
+            response = self._sync(cursor)
+            self.assertEqual(response.status_code, 200)
+            cursor = response.json()['next_cursor']
+
+        # Un cliente que no sincroniza durante la retención sí debe resincronizar
+        position, _ = decode_cursor(cursor)
+        stale = encode_cursor(position, timezone.now() - timedelta(days=365))
+        self.assertEqual(self._sync(stale).status_code, 410)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'El horizonte por transacciones abiertas es de PostgreSQL')
+@override_settings(CATALOG_SYNC_SAFETY_SECONDS=0)
+class CatalogSyncHorizonTests(TransactionTestCase):
+    """
+    Una transacción larga no pierde sus cambios aunque otros más recientes
+    se confirmen antes.
+    """
+
+    def _sync(self, cursor):
+        return APIClient().get('/api/catalog/sync/', {'cursor': cursor}).json()
+
+    def test_long_transaction_is_not_skipped(self):
+        category = Category.objects.create(name='General')
+        slow, fast = (Product.objects.create(name=name, price='1.00', category=category) for name in 'AB')
+        cursor = APIClient().get('/api/catalog/sync/').json()['next_cursor']
+
+        updated, release = threading.Event(), threading.Event()
+
+        def long_transaction():
+            try:
+                with transaction.atomic():
+                    # updated_at = inicio de esta transacción
+                    Product.objects.filter(pk=slow.pk).update(name='Lento', updated_at=Now())
+                    updated.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=long_transaction)
+        thread.start()
+        try:
+            self.assertTrue(updated.wait(10))
+            Product.objects.filter(pk=fast.pk).update(name='Rápido', updated_at=Now())
+            data = self._sync(cursor)
+            # Nada posterior al inicio de la transacción abierta
+            self.assertEqual(data['products'], [])
+        finally:
+            release.set()
+            thread.join()
+
+        data = self._sync(data['next_cursor'])
+        self.assertEqual([row['name'] for row in data['products']], ['Lento', 'Rápido'])
+
+
+class CatalogExportTests(TestCase):
+    """
+    Exportación en streaming del catálogo en JSONL y MessagePack.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='General')
+        brand = Brand.objects.create(name='Acme')
+        for i in range(5):
+            Product.objects.create(name=f'P{i}', sku=f'SKU-{i}', price='9.99', category=category, brand=brand)
+
+    def test_jsonl_export(self):
+        response = self.client.get('/api/catalog/export/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0]['category_name'], 'General')
+        self.assertEqual(records[0]['brand_name'], 'Acme')
+        self.assertEqual(records[0]['price'], '9.99')
+
+    def test_msgpack_export_and_etag(self):
+        response = self.client.get('/api/catalog/export/', HTTP_ACCEPT='application/x-msgpack')
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(b''.join(response.streaming_content))
+        records = list(unpacker)
+        self.assertEqual([r['sku'] for r in records], [f'SKU-{i}' for i in range(5)])
+
+        cached = self.client.get(
+            '/api/catalog/export/', {'format': 'msgpack'}, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(cached.status_code, 304)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, BrandViewSet, ReviewViewSet
+from .views import CategoryViewSet, ProductViewSet, BrandViewSet, ReviewViewSet, CatalogSyncView, CatalogExportView
 
 app_name = 'products'
 
@@ -11,5 +11,7 @@ router.register(r'products', ProductViewSet, basename='product')
 router.register(r'reviews', ReviewViewSet, basename='review')
 
 urlpatterns = [
+    path('catalog/export/', CatalogExportView.as_view(), name='catalog-export'),
+    path('catalog/sync/', CatalogSyncView.as_view(), name='catalog-sync'),
     path('', include(router.urls)),
 ]
@@ -1,10 +1,34 @@
-from rest_framework import viewsets, permissions, serializers as drf_serializers
+from rest_framework import viewsets, permissions, status, serializers as drf_serializers
 from rest_framework.permissions import IsAdminUser, AllowAny
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.db.models import Count, Max
+from smartsales_backend.conditional import ConditionalGetMixin
+from smartsales_backend.pagination import KeysetPagination, RankedPagination
+from smartsales_backend.serializers import is_field_requested
 from .models import Category, Product, Brand, Review
-from .serializers import CategorySerializer, ProductSerializer, BrandSerializer, ReviewSerializer
+from .serializers import (
+    CategorySerializer,
+    ProductSerializer,
+    BrandSerializer,
+    ReviewSerializer,
+    StockAdjustmentSerializer,
+)
 from .permissions import HasPurchasedProduct, IsReviewAuthorOrReadOnly
+from orders.purchases import purchased_product_ids
+from .cache import CatalogCacheMixin, CatalogConditionalMixin, catalog_version
+from .export import JSONLinesRenderer, MessagePackRenderer, stream_catalog
+from .facets import get_facets
+from .importer import ProductImporter, detect_format, iter_rows
+from .stock import adjust_stock
+from .sync import CursorExpired, InvalidCursor, get_changes
+from .filters import filter_products
 
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -19,57 +43,146 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         return request.user and request.user.is_staff
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CatalogConditionalMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar las categorías de productos.
-    GET: Todos pueden ver
+    GET: Todos pueden ver (respuestas cacheadas y con ETag/Last-Modified)
     POST, PUT, PATCH, DELETE: Solo administradores
     """
-    queryset = Category.objects.all()
+    queryset = Category.objects.annotate(products_count=Count('products'))
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+    # Category no tiene updated_at: el ETag depende de la versión del catálogo
+    conditional_field = None
 
 
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(CatalogConditionalMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar las marcas de productos.
-    GET: Todos pueden ver
+    GET: Todos pueden ver (respuestas cacheadas y con ETag/Last-Modified)
     POST, PUT, PATCH, DELETE: Solo administradores
     """
-    queryset = Brand.objects.all()
+    queryset = Brand.objects.annotate(products_count=Count('products'))
     serializer_class = BrandSerializer
     permission_classes = [IsAdminOrReadOnly]
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CatalogConditionalMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar los productos.
-    GET: Todos pueden ver
+    GET: Todos pueden ver (respuestas cacheadas y con ETag/Last-Modified)
     POST, PUT, PATCH, DELETE: Solo administradores
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = KeysetPagination
+    max_stock_adjustments = 10000
+    # Cambian con compras, ajustes y reseñas sin cambiar la versión del catálogo
+    live_fields = ('stock', 'rating_avg', 'rating_count', 'rating_histogram', 'updated_at')
     
     def get_queryset(self):
         """
-        Opcionalmente filtra productos por categoría o marca usando query params.
-        Ejemplo: /api/products/?category=1&brand=2
+        Opcionalmente filtra productos por categoría o marca usando query params,
+        y busca por texto con ?q= (resultados ordenados por relevancia).
+        Ejemplo: /api/products/?category=1&brand=2&q=laptop
+        Categoría y marca se precargan con sus conteos para evitar N+1,
+        salvo que ?fields= / ?expand= las excluyan de la respuesta.
         """
         queryset = Product.objects.all()
-        category_id = self.request.query_params.get('category', None)
-        brand_id = self.request.query_params.get('brand', None)
-        
-        if category_id is not None:
-            queryset = queryset.filter(category_id=category_id)
-        
-        if brand_id is not None:
-            queryset = queryset.filter(brand_id=brand_id)
-        
-        return queryset
+        if self.needs_catalog_details():
+            queryset = queryset.with_catalog_details()
+        return filter_products(queryset, self.request.query_params)
+
+    def needs_catalog_details(self):
+        request = self.request
+        return (
+            is_field_requested(request, 'category_detail', expandable=True)
+            or is_field_requested(request, 'brand', expandable=True)
+            or is_field_requested(request, 'category_name')
+        )
+
+    def is_search(self):
+        """
+        Indica si la petición es una búsqueda por texto (?q=).
+        """
+        return bool(self.request.query_params.get('q', '').strip())
+
+    @property
+    def paginator(self):
+        """
+        Las búsquedas se paginan por número de página, ya que el orden por
+        relevancia no permite construir un cursor estable.
+        """
+        if not hasattr(self, '_paginator') and self.is_search():
+            self._paginator = RankedPagination()
+        return super().paginator
 
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Conteos por categoría, marca, rango de precio y stock para los
+        filtros actuales (?category=, ?brand=, ?q=).
+        Ejemplo: /api/products/facets/?category=1
+        """
+        return Response(get_facets(request.query_params))
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser])
+    def bulk_import(self, request):
+        """
+        Importa/actualiza productos por SKU desde un archivo CSV o JSONL
+        (campo multipart `file`). Columnas: sku, name, description, price,
+        stock, category, brand (categoría y marca por nombre).
+        Query params: ?file_format=csv|jsonl, ?create_missing=true, ?batch_size=N
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response(
+                {'error': 'Se requiere el archivo en el campo "file".'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fmt = request.query_params.get('file_format') or detect_format(upload.name)
+        if fmt not in ('csv', 'jsonl'):
+            return Response(
+                {'error': 'Formato no soportado. Use csv o jsonl.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            batch_size = int(request.query_params.get('batch_size', ProductImporter.default_batch_size))
+        except ValueError:
+            return Response(
+                {'error': 'batch_size debe ser un entero.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        importer = ProductImporter(
+            batch_size=max(1, min(batch_size, ProductImporter.max_batch_size)),
+            create_missing=request.query_params.get('create_missing', '').lower() in ('true', '1'),
+        )
+        report = importer.run(iter_rows(upload, fmt))
+        return Response(report.as_dict())
+
+    @action(detail=False, methods=['post'], url_path='stock', permission_classes=[IsAdminUser])
+    def bulk_stock(self, request):
+        """
+        Ajusta el stock de varios productos en una sola petición.
+        Cuerpo: [{"product_id": 1, "delta": -2}, {"product_id": 2, "absolute": 10}]
+        Los ajustes que dejarían stock negativo se rechazan y se reportan en `errors`.
+        """
+        serializer = StockAdjustmentSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if len(serializer.validated_data) > self.max_stock_adjustments:
+            return Response(
+                {'error': f'Máximo {self.max_stock_adjustments} ajustes por petición.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-class ReviewViewSet(viewsets.ModelViewSet):
+        results, errors = adjust_stock(serializer.validated_data)
+        return Response({'results': results, 'errors': errors})
+
+
+class ReviewViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar las reseñas de productos.
     GET: Todos pueden ver
@@ -78,6 +191,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
     """
     queryset = Review.objects.all().select_related('user', 'product')
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+    max_reviewable_ids = 500
 
     def get_queryset(self):
         """
@@ -117,6 +232,30 @@ class ReviewViewSet(viewsets.ModelViewSet):
             # Considera loggear el error real 'e' aquí para depuración
             raise drf_serializers.ValidationError({'detail': f'Ocurrió un error inesperado al guardar la reseña: {str(e)}'})
 
+    @action(detail=False, methods=['get'])
+    def reviewable(self, request):
+        """
+        Indica cuáles de los productos dados puede reseñar el usuario
+        (comprados y aún sin reseña), con una sola consulta al caché.
+        Ejemplo: /api/reviews/reviewable/?product_ids=1,2,3
+        """
+        raw_ids = request.query_params.get('product_ids', '')
+        try:
+            product_ids = {int(value) for value in raw_ids.split(',') if value.strip()}
+        except ValueError:
+            raise drf_serializers.ValidationError({'product_ids': 'Debe ser una lista de ids separados por comas.'})
+        if len(product_ids) > self.max_reviewable_ids:
+            raise drf_serializers.ValidationError(
+                {'product_ids': f'Máximo {self.max_reviewable_ids} productos por consulta.'}
+            )
+
+        candidates = product_ids & purchased_product_ids(request.user)
+        reviewed = set(
+            Review.objects.filter(user=request.user, product_id__in=candidates)
+            .values_list('product_id', flat=True)
+        ) if candidates else set()
+        return Response({'reviewable': sorted(candidates - reviewed)})
+
     def get_permissions(self):
         """
         Asigna permisos según la acción
@@ -124,10 +263,76 @@ class ReviewViewSet(viewsets.ModelViewSet):
         # GET (list, retrieve): Cualquiera puede leer
         if self.action in ['list', 'retrieve']:
             permission_classes = [permissions.AllowAny]
-        # POST (create): Usuario autenticado (validación de compra en perform_create)
-        elif self.action == 'create':
+        # POST (create) y consulta de reseñables: Usuario autenticado
+        # (la validación de compra se hace en perform_create)
+        elif self.action in ['create', 'reviewable']:
             permission_classes = [permissions.IsAuthenticated]
         # PUT, PATCH, DELETE: Solo el autor de la reseña
         else:
             permission_classes = [IsReviewAuthorOrReadOnly]
         return [permission() for permission in permission_classes]
+
+
+class CatalogSyncView(APIView):
+    """
+    Sincronización incremental del catálogo.
+    GET /api/catalog/sync/?cursor=<cursor>&limit=500
+    Devuelve categorías, marcas y productos modificados y los borrados
+    (`deleted`) desde el cursor, junto con `next_cursor` y `has_more`.
+    Sin cursor se recorre el catálogo completo desde el principio.
+    """
+    permission_classes = [AllowAny]
+    default_limit = 500
+    max_limit = 1000
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            return Response(
+                {'error': 'limit debe ser un entero.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, self.max_limit))
+
+        try:
+            changes = get_changes(request.query_params.get('cursor'), limit=limit)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except CursorExpired:
+            return Response(
+                {'error': 'El cursor es demasiado antiguo. Realiza una sincronización completa.', 'resync': True},
+                status=status.HTTP_410_GONE
+            )
+        return Response(changes)
+
+
+class CatalogExportView(APIView):
+    """
+    Exportación completa del catálogo en streaming.
+    GET /api/catalog/export/
+    El formato se negocia con la cabecera Accept (application/x-ndjson o
+    application/x-msgpack) o con ?format=jsonl|msgpack. El ETag depende de
+    la versión del catálogo y del último `updated_at` de los productos (que
+    cambia también con el stock y las reseñas), así que los cachés pueden
+    revalidar sin descargar de nuevo.
+    """
+    permission_classes = [AllowAny]
+    renderer_classes = [JSONLinesRenderer, MessagePackRenderer]
+
+    def get(self, request):
+        renderer = request.accepted_renderer
+        last_change = Product.objects.aggregate(last=Max('updated_at'))['last']
+        stamp = int(last_change.timestamp() * 1_000_000) if last_change else 0
+        etag = quote_etag(f'catalog-{catalog_version()}-{stamp}-{renderer.format}')
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = StreamingHttpResponse(
+            stream_catalog(renderer.format),
+            content_type=renderer.media_type,
+        )
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="catalog.{renderer.format}"'
+        return response
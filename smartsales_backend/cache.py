@@ -0,0 +1,19 @@
+"""
+Utilidades sobre la caché por defecto.
+"""
+from django.conf import settings
+
+# Backends cuyo contenido es propio de cada proceso (cada worker de gunicorn)
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def default_cache_is_shared():
+    """
+    Indica si todos los procesos comparten la caché por defecto (Redis,
+    Memcached...). Sin REDIS_URL es LocMemCache: lo que un worker guarda o
+    invalida no lo ven los demás.
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
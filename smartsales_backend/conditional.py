@@ -0,0 +1,105 @@
+"""
+Soporte de GET condicional (ETag / Last-Modified) para ViewSets.
+
+Los validadores se calculan con una consulta mínima (MAX(updated_at) y
+COUNT en listados, `updated_at` del objeto en detalle), de modo que las
+peticiones con `If-None-Match` / `If-Modified-Since` vigentes responden
+304 antes de serializar nada. Los listados solo llevan Last-Modified si la
+vista da una fecha que cambie también con los borrados (ver
+`get_last_modified`); MAX(updated_at) no la cambia.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Mixin para ViewSets: añade ETag y Last-Modified a `list` y `retrieve`
+    y responde 304 Not Modified cuando el cliente ya tiene la versión actual.
+
+    `conditional_field` es el campo de fecha usado como validador; si el
+    modelo no lo tiene (None) solo se usa el ETag.
+    """
+    conditional_field = 'updated_at'
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
+
+    def get_etag_salt(self):
+        """
+        Valor adicional que invalida el ETag (p. ej. la versión del catálogo).
+        """
+        return ''
+
+    def get_last_modified(self, last_modified):
+        """
+        Valor de Last-Modified a partir del `conditional_field`. En listados
+        no se envía: MAX(updated_at) no cambia al borrar filas ni al cambiar
+        datos anidados, y un cliente que solo manda If-Modified-Since
+        recibiría 304 con datos viejos.
+        """
+        return last_modified if self.action == 'retrieve' else None
+
+    def get_validators(self):
+        """
+        Devuelve (etag, last_modified) para la petición actual, o None si el
+        objeto pedido no existe.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        field = self.conditional_field
+
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            try:
+                queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                if field:
+                    row = queryset.values_list(field, flat=True).first()
+                else:
+                    row = queryset.exists() or None
+            except (TypeError, ValueError, ValidationError):
+                # Lookup inválido (p. ej. /api/products/abc/): igual que get_object_or_404
+                return None
+            if row is None:
+                return None
+            last_modified, count = (row if field else None), 1
+        else:
+            aggregates = {'count': Count('pk')}
+            if field:
+                aggregates['last_modified'] = Max(field)
+            result = queryset.aggregate(**aggregates)
+            last_modified, count = result.get('last_modified'), result['count']
+
+        raw = '{}:{}:{}:{}'.format(
+            self.action,
+            last_modified.isoformat() if last_modified else '',
+            count,
+            self.get_etag_salt(),
+        )
+        etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+        return etag, self.get_last_modified(last_modified)
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            # Deja que el handler genere el 404 habitual
+            return handler(request, *args, **kwargs)
+
+        etag, last_modified = validators
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
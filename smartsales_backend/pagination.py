@@ -0,0 +1,64 @@
+"""
+Paginación compartida por las apps del proyecto.
+
+Los listados usan paginación por cursor (keyset): los cursores son opacos
+(base64) y se basan en el campo de ordenamiento, por lo que una página
+profunda cuesta lo mismo que la primera.
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class UnpaginatedOptInMixin:
+    """
+    Permite ?paginate=false para devolver la lista completa sin paginar
+    (solo durante la migración de clientes, mientras API_ALLOW_UNPAGINATED
+    sea True).
+    """
+    unpaginated_query_param = 'paginate'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.wants_unpaginated(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def wants_unpaginated(self, request):
+        """
+        Indica si el cliente pidió explícitamente la respuesta sin paginar.
+        """
+        if not settings.API_ALLOW_UNPAGINATED:
+            return False
+        value = request.query_params.get(self.unpaginated_query_param, '')
+        return value.lower() in ('false', '0', 'no')
+
+
+class KeysetPagination(UnpaginatedOptInMixin, CursorPagination):
+    """
+    Paginación keyset ordenada por fecha de creación (más recientes primero).
+
+    Parámetros de consulta:
+    - cursor: cursor opaco devuelto en `next` / `previous`.
+    - page_size: tamaño de página (limitado por API_MAX_PAGE_SIZE).
+    - paginate=false: devuelve la lista completa sin paginar.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class IdKeysetPagination(KeysetPagination):
+    """
+    Paginación keyset por id ascendente, para modelos sin `created_at`.
+    """
+    ordering = 'id'
+
+
+class RankedPagination(UnpaginatedOptInMixin, PageNumberPagination):
+    """
+    Paginación por número de página para resultados ordenados por relevancia,
+    donde no existe un campo estable sobre el cual construir un cursor.
+    """
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
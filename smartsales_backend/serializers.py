@@ -0,0 +1,119 @@
+"""
+Selección de campos (?fields=) y control de expansión (?expand=) para
+serializers anidados.
+
+- `?fields=id,name,items.product.name`: solo se incluyen los campos listados
+  (las rutas con punto seleccionan dentro de serializers anidados).
+- `?expand=category_detail,items.product`: los campos declarados en
+  `Meta.expandable_fields` solo se incluyen si aparecen aquí o en `fields`.
+  Sin `?expand=` se expanden todos, como hasta ahora.
+
+Los campos descartados se eliminan en `get_fields()`, antes de evaluar
+nada, así que sus serializers anidados y SerializerMethodField no se
+ejecutan.
+"""
+from rest_framework import permissions, serializers
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def parse_paths(value):
+    """
+    Convierte 'a,b.c,b.d' en el árbol {'a': None, 'b': {'c': None, 'd': None}}.
+    None significa "sin restricción" para ese nodo.
+    """
+    tree = {}
+    for path in value.split(','):
+        parts = [part.strip() for part in path.split('.') if part.strip()]
+        node = tree
+        for index, part in enumerate(parts):
+            last = index == len(parts) - 1
+            if last:
+                node.setdefault(part, None)
+            else:
+                child = node.get(part)
+                if child is None:
+                    child = node[part] = {}
+                node = child
+    return tree
+
+
+def get_sparse_spec(request):
+    """
+    Devuelve (fields, expand) a partir de los query params, o (None, None)
+    si la petición no restringe campos ni expansión.
+    """
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return None, None
+    params = request.query_params
+    fields = parse_paths(params[FIELDS_PARAM]) if params.get(FIELDS_PARAM) else None
+    expand = parse_paths(params[EXPAND_PARAM]) if EXPAND_PARAM in params else None
+    return fields, expand
+
+
+def is_field_requested(request, name, expandable=False):
+    """
+    Indica si el campo de primer nivel `name` se incluirá en la respuesta.
+    Permite a las vistas evitar precargas que no se van a usar.
+    """
+    fields, expand = get_sparse_spec(request)
+    if fields is not None and name not in fields:
+        return False
+    if expandable and expand is not None and name not in expand and (fields is None or name not in fields):
+        return False
+    return True
+
+
+class SparseFieldsMixin:
+    """
+    Mixin para ModelSerializer que aplica ?fields= y ?expand= (ver módulo).
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = self._get_sparse_spec()
+        if spec is None:
+            return fields
+        allowed, expand = spec
+        expandable = set(getattr(self.Meta, 'expandable_fields', ()))
+
+        for name in list(fields):
+            if allowed is not None and name not in allowed:
+                del fields[name]
+                continue
+            if name in expandable and expand is not None and name not in expand \
+                    and (allowed is None or name not in allowed):
+                del fields[name]
+                continue
+            self._push_spec(fields[name], allowed, expand, name)
+        return fields
+
+    def _get_sparse_spec(self):
+        spec = getattr(self, '_sparse_spec', None)
+        if spec is not None:
+            return spec
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            # Serializer anidado sin especificación: sin restricciones
+            return None
+        fields, expand = get_sparse_spec(self.context.get('request'))
+        if fields is None and expand is None:
+            return None
+        return fields, expand
+
+    @staticmethod
+    def _push_spec(field, allowed, expand, name):
+        target = field.child if isinstance(field, serializers.ListSerializer) else field
+        if not isinstance(target, SparseFieldsMixin):
+            return
+        sub_fields = allowed.get(name) if allowed is not None else None
+        if expand is None:
+            sub_expand = None
+        else:
+            # Con ?expand= presente, los expandibles anidados solo se incluyen
+            # si su ruta completa aparece en expand.
+            sub_expand = expand.get(name) or {}
+        target._sparse_spec = (sub_fields, sub_expand)
@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 import stripe
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -106,6 +107,25 @@ DATABASES = {
 }
 
 
+# Cache
+# Con REDIS_URL se usa Redis (compartido entre workers); si no, memoria local.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'smartsales',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -169,6 +189,84 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Paginación por cursor (keyset) - ver smartsales_backend/pagination.py
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', '20'))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', '100'))
+# Permite ?paginate=false mientras los clientes migran a respuestas paginadas
+API_ALLOW_UNPAGINATED = os.environ.get('API_ALLOW_UNPAGINATED', 'True') == 'True'
+
+# Segundos que se cachean las respuestas de lectura del catálogo y las facetas.
+# Las entradas se invalidan antes al cambiar la versión del catálogo.
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', '3600'))
+CATALOG_FACETS_CACHE_TIMEOUT = int(os.environ.get('CATALOG_FACETS_CACHE_TIMEOUT', '3600'))
+
+# Sincronización incremental del catálogo (/api/catalog/sync/)
+# Margen del horizonte de entrega; en PostgreSQL se resta a la transacción
+# abierta más antigua y en otras bases de datos a la hora actual, donde debe
+# superar la transacción de escritura más larga (ver products/sync.py)
+CATALOG_SYNC_SAFETY_SECONDS = int(os.environ.get('CATALOG_SYNC_SAFETY_SECONDS', '2'))
+# Días que se conservan los registros de borrado (cursores más antiguos deben resincronizar)
+CATALOG_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('CATALOG_TOMBSTONE_RETENTION_DAYS', '90'))
+
+# Filas leídas por lote del cursor en la exportación del catálogo (/api/catalog/export/)
+CATALOG_EXPORT_CHUNK_SIZE = int(os.environ.get('CATALOG_EXPORT_CHUNK_SIZE', '2000'))
+
+# Almacén de carritos: 'db' (Cart/CartItem) o 'redis' (hashes en Redis con
+# escritura diferida en la base de datos, ver orders/cart_store.py)
+CART_BACKEND = os.environ.get('CART_BACKEND', 'db')
+# Por defecto REDIS_URL. 'locmem://' (un sustituto en memoria del proceso,
+# solo para tests y desarrollo) hay que indicarlo expresamente: en producción
+# cada worker tendría sus propios carritos y se perderían al reiniciar
+CART_REDIS_URL = os.environ.get('CART_REDIS_URL', REDIS_URL or '')
+if CART_BACKEND == 'redis' and not CART_REDIS_URL:
+    raise ImproperlyConfigured('CART_BACKEND=redis requiere CART_REDIS_URL o REDIS_URL.')
+# Segundos que un carrito ya escrito en la base de datos permanece en Redis
+CART_STORE_TTL = int(os.environ.get('CART_STORE_TTL', '604800'))
+
+# Segundos que dura un carrito de invitado sin modificaciones
+GUEST_CART_TIMEOUT = int(os.environ.get('GUEST_CART_TIMEOUT', '604800'))
+
+# Reservas temporales de stock (orders/reservations.py): segundos que se
+# reserva lo añadido al carrito y lo de una orden PENDIENTE sin pagar
+CART_RESERVATION_SECONDS = int(os.environ.get('CART_RESERVATION_SECONDS', '900'))
+ORDER_RESERVATION_SECONDS = int(os.environ.get('ORDER_RESERVATION_SECONDS', '1800'))
+# Máximo que una orden PENDIENTE retiene su stock desde que se creó, aunque
+# se abran nuevas sesiones de Stripe
+ORDER_MAX_RESERVATION_SECONDS = int(os.environ.get('ORDER_MAX_RESERVATION_SECONDS', '7200'))
+
+# Cabecera Idempotency-Key (orders/idempotency.py): segundos que se conserva
+# la respuesta de una clave y que un reintento espera a la petición en curso
+# antes de responder 409
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '10'))
+
+# Particionado mensual de órdenes (opcional, PostgreSQL; ver orders/partitioning.py):
+# meses futuros con partición creada y directorio de los archivos de meses archivados
+ORDER_PARTITION_MONTHS_AHEAD = int(os.environ.get('ORDER_PARTITION_MONTHS_AHEAD', '3'))
+ORDER_ARCHIVE_DIR = os.environ.get('ORDER_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+# Comprobantes cacheados (orders/receipts.py): segundos en caché, procesos que
+# generan los PDF, segundos máximos que se espera a que un PDF termine (cola
+# incluida; el proceso corta la generación al llegar al límite) y segundos
+# que se responde con error tras un fallo antes de volver a intentarlo
+RECEIPT_CACHE_TIMEOUT = int(os.environ.get('RECEIPT_CACHE_TIMEOUT', '2592000'))
+RECEIPT_PDF_WORKERS = int(os.environ.get('RECEIPT_PDF_WORKERS', '2'))
+RECEIPT_PDF_TIMEOUT = int(os.environ.get('RECEIPT_PDF_TIMEOUT', '120'))
+RECEIPT_PDF_RETRY_SECONDS = int(os.environ.get('RECEIPT_PDF_RETRY_SECONDS', '300'))
+
+# Exportación masiva de comprobantes (orders/receipt_export.py): órdenes por
+# lote, hilos que renderizan y máximo de órdenes por exportación
+RECEIPT_EXPORT_BATCH_SIZE = int(os.environ.get('RECEIPT_EXPORT_BATCH_SIZE', '100'))
+RECEIPT_EXPORT_WORKERS = int(os.environ.get('RECEIPT_EXPORT_WORKERS', '4'))
+RECEIPT_EXPORT_MAX_ORDERS = int(os.environ.get('RECEIPT_EXPORT_MAX_ORDERS', '5000'))
+
+# Segundos que se cachea el conjunto de productos comprados por usuario
+# (se invalida al cambiar cualquier orden del usuario). Con una caché local a
+# cada proceso la invalidación solo llega a un worker, así que se usa el
+# segundo valor, mucho más corto
+PURCHASES_CACHE_TIMEOUT = int(os.environ.get('PURCHASES_CACHE_TIMEOUT', '86400'))
+PURCHASES_LOCAL_CACHE_TIMEOUT = int(os.environ.get('PURCHASES_LOCAL_CACHE_TIMEOUT', '30'))
+
 # Spectacular Settings (Swagger/OpenAPI)
 SPECTACULAR_SETTINGS = {
     'TITLE': 'SmartSales365 API',
@@ -196,6 +294,19 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
+    'if-modified-since',
+    'x-cart-token',
+    'idempotency-key',
+]
+
+# Cabeceras de respuesta visibles para el frontend (GET condicional / caché)
+CORS_EXPOSE_HEADERS = [
+    'etag',
+    'last-modified',
+    'x-cache',
+    'x-cart-token',
+    'idempotent-replayed',
 ]
 
 CORS_ALLOW_METHODS = [
@@ -4,6 +4,8 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import get_user_model
+from smartsales_backend.pagination import IdKeysetPagination
+from orders.guest_cart import get_token, merge_guest_cart
 from .serializers import RegisterSerializer, UserSerializer, ClientProfileSerializer, MyTokenObtainPairSerializer, RoleSerializer
 from .models import ClientProfile, Role
 
@@ -14,9 +16,22 @@ class MyTokenObtainPairView(TokenObtainPairView):
     """
     Vista personalizada para obtener tokens JWT.
     Permite autenticación con username o email.
+    Si la petición trae la cabecera X-Cart-Token, el carrito de invitado se
+    fusiona con el del usuario: `cart_merged_items` es el número de
+    productos fusionados y `cart_skipped_items` los ids de los que se
+    omitieron por falta de stock. Los tokens se devuelven siempre.
     """
     serializer_class = MyTokenObtainPairSerializer
 
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        token = get_token(request)
+        if token and response.status_code == status.HTTP_200_OK:
+            merged, skipped = merge_guest_cart(response.data['user']['id'], token)
+            response.data['cart_merged_items'] = merged
+            response.data['cart_skipped_items'] = skipped
+        return response
+
 
 class RegisterView(generics.CreateAPIView):
     """
@@ -102,6 +117,7 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = IdKeysetPagination
     
     def get_queryset(self):
         """